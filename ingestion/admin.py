@@ -0,0 +1,30 @@
+# 管理端点的公共依赖
+import hmac
+import logging
+import os
+
+from fastapi import Header, HTTPException
+
+logger = logging.getLogger(__name__)
+
+# 所有 /admin/* 端点都需要请求头 X-Admin-Token；未设置时默认拒绝
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# 本地开发：未设置 ADMIN_TOKEN 时放行 /admin/*（必须显式开启）
+ADMIN_ALLOW_UNAUTHENTICATED = os.getenv("ADMIN_ALLOW_UNAUTHENTICATED", "0").lower() in ("1", "true", "yes")
+
+if not ADMIN_TOKEN:
+    if ADMIN_ALLOW_UNAUTHENTICATED:
+        logger.warning("ADMIN_TOKEN is not set and ADMIN_ALLOW_UNAUTHENTICATED=1: /admin/* is open to everyone")
+    else:
+        logger.info("ADMIN_TOKEN is not set: /admin/* endpoints are disabled")
+
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    """校验管理令牌；未配置 ADMIN_TOKEN 时拒绝（除非 ADMIN_ALLOW_UNAUTHENTICATED=1）"""
+    if not ADMIN_TOKEN:
+        if ADMIN_ALLOW_UNAUTHENTICATED:
+            return
+        # 不暴露管理端点的存在
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
@@ -0,0 +1,301 @@
+# 对话记录冷存储 + 数据库维护
+#
+# 热库（medical_records.db 各分片）只保留最近的对话；早于 ARCHIVE_AFTER_DAYS 天的对话
+# 被移到 ARCHIVE_DIR 下只追加的压缩段文件（*.seg），热库里只留一行索引
+# （conversation_archive: 段文件名 + 偏移 + 长度），需要时按索引读回。
+#
+# 段文件格式: 一条接一条的 [length:u32][压缩后的 JSON]，写满 ARCHIVE_SEGMENT_BYTES 换新文件。
+# 先追加并 fsync 段文件，再在一个事务里写索引、删热库行：中途崩溃最多留下无索引的孤立字节。
+#
+# 维护任务（归档 + ANALYZE + VACUUM）可以手动运行:
+#     python archive.py run [--older-than-days 90] [--no-vacuum]
+#     python archive.py get <patient_id>
+# 或设置 MAINTENANCE_INTERVAL_HOURS 由服务进程定时执行。
+#
+# 多个进程（每个 uvicorn worker 的定时器、POST /admin/maintenance、命令行）可能同时触发：
+# 整个任务持有 ARCHIVE_DIR/.maintenance.lock 上的 flock，段文件同一时间只有一个写者。
+# 定时任务不等待：拿不到锁、或其他进程在半个周期内刚执行过，就跳过这一轮，
+# 所以同一时间只有一个进程在做归档和 VACUUM。VACUUM 期间数据库被独占锁定，
+# 其他连接的写入最多等待 SQLite 的忙等超时（默认 5 秒），大分片上请安排在低峰期或关闭 VACUUM。
+import argparse
+import fcntl
+import glob
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from compression import compress_text, decompress_text
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# 0 表示不定时执行
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "0"))
+MAINTENANCE_VACUUM = os.getenv("MAINTENANCE_VACUUM", "1").lower() in ("1", "true", "yes")
+
+_LENGTH = struct.Struct("!I")
+
+_LOCK_NAME = ".maintenance.lock"
+_LAST_RUN_NAME = ".maintenance.last"
+
+
+@contextmanager
+def maintenance_lock(directory: str = ARCHIVE_DIR, blocking: bool = True):
+    """跨进程的维护锁；blocking=False 时拿不到锁返回 False"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, _LOCK_NAME), "a") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _last_run(directory: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(os.path.join(directory, _LAST_RUN_NAME))
+    except OSError:
+        return None
+
+
+def _mark_run(directory: str):
+    with open(os.path.join(directory, _LAST_RUN_NAME), "w") as f:
+        f.write(str(time.time()))
+
+
+# ===============================
+# 段文件
+# ===============================
+class SegmentWriter:
+    """只追加的段文件写入器，写满后滚动到下一个文件"""
+
+    def __init__(self, directory: str, prefix: str, max_bytes: int = ARCHIVE_SEGMENT_BYTES):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        existing = sorted(glob.glob(os.path.join(directory, f"{prefix}.*.seg")))
+        self.sequence = int(existing[-1].rsplit(".", 2)[-2]) if existing else 0
+        self._file = None
+        self._open()
+
+    @property
+    def name(self) -> str:
+        return f"{self.prefix}.{self.sequence:05d}.seg"
+
+    def _open(self):
+        self._file = open(os.path.join(self.directory, self.name), "ab")
+
+    def append(self, payload: bytes) -> Tuple[str, int, int]:
+        """追加一条，返回 (段文件名, 数据偏移, 数据长度)"""
+        if self._file.tell() and self._file.tell() + _LENGTH.size + len(payload) > self.max_bytes:
+            self.sync()
+            self._file.close()
+            self.sequence += 1
+            self._open()
+        self._file.write(_LENGTH.pack(len(payload)))
+        offset = self._file.tell()
+        self._file.write(payload)
+        return self.name, offset, len(payload)
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+def read_entry(segment: str, offset: int, length: int, directory: str = ARCHIVE_DIR) -> bytes:
+    with open(os.path.join(directory, segment), "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length:
+        raise IOError(f"Truncated archive entry {segment}@{offset}")
+    return data
+
+
+def read_archived_conversation(segment: str, offset: int, length: int, codec: str,
+                               directory: str = ARCHIVE_DIR) -> Dict:
+    """按索引读回一条归档对话（含 transcript）"""
+    return json.loads(decompress_text(codec, read_entry(segment, offset, length, directory)))
+
+
+# ===============================
+# 归档任务
+# ===============================
+def archive_conversations(medical_db, older_than_days: float = ARCHIVE_AFTER_DAYS,
+                          directory: str = ARCHIVE_DIR, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict:
+    """把早于 older_than_days 天的对话从热库移到冷存储，返回各分片归档条数"""
+    with maintenance_lock(directory):
+        return _archive_conversations(medical_db, older_than_days, directory, batch_size)
+
+
+def _archive_conversations(medical_db, older_than_days: float, directory: str, batch_size: int) -> Dict:
+    """archive_conversations 的实现（调用方持有维护锁）"""
+    from database import decode_transcript
+
+    modifier = f"{-older_than_days:+} days"
+    archived = {}
+    for path in medical_db.shards.paths:
+        prefix = "conversations." + os.path.splitext(os.path.basename(path))[0]
+        writer = SegmentWriter(directory, prefix)
+        conn = sqlite3.connect(path)
+        count = 0
+        try:
+            while True:
+                rows = conn.execute('''
+                    SELECT id, patient_id, transcript, transcript_blob, codec, summary, created_at
+                    FROM conversations
+                    WHERE created_at < datetime('now', ?)
+                    ORDER BY id
+                    LIMIT ?
+                ''', (modifier, batch_size)).fetchall()
+                if not rows:
+                    break
+
+                index_rows = []
+                for conv_id, patient_id, transcript, blob, codec, summary, created_at in rows:
+                    entry = {
+                        "conversation_id": conv_id,
+                        "patient_id": patient_id,
+                        "transcript": decode_transcript(transcript, blob, codec),
+                        "summary": summary,
+                        "created_at": created_at,
+                    }
+                    entry_codec, payload = compress_text(json.dumps(entry, ensure_ascii=False))
+                    segment, offset, length = writer.append(payload)
+                    index_rows.append((patient_id, conv_id, summary, created_at, segment, offset, length, entry_codec))
+                writer.sync()
+
+                # 在同一事务里先删除热库行、删掉了才写索引：同一条对话不会有两行索引
+                # （没删掉的那条在段文件里留下无索引的孤立字节）
+                claimed = 0
+                with conn:
+                    for index_row in index_rows:
+                        if conn.execute('DELETE FROM conversations WHERE id = ?', (index_row[1],)).rowcount != 1:
+                            continue
+                        conn.execute('''
+                            INSERT INTO conversation_archive
+                                (patient_id, conversation_id, summary, created_at, segment, offset, length, codec)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', index_row)
+                        claimed += 1
+                count += claimed
+        finally:
+            writer.close()
+            conn.close()
+        archived[os.path.basename(path)] = count
+    logger.info(f"Archived conversations: {archived}")
+    return archived
+
+
+# ===============================
+# VACUUM / ANALYZE
+# ===============================
+def maintain_database(path: str, vacuum: bool = MAINTENANCE_VACUUM) -> Dict:
+    """ANALYZE 更新查询计划统计；VACUUM 回收归档/删除后的空闲页"""
+    size_before = os.path.getsize(path) if os.path.exists(path) else 0
+    started = time.perf_counter()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        if vacuum:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return {
+        "bytes_before": size_before,
+        "bytes_after": os.path.getsize(path),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def run_maintenance(medical_db, patient_db=None, older_than_days: float = ARCHIVE_AFTER_DAYS,
+                    vacuum: bool = MAINTENANCE_VACUUM) -> Dict:
+    """归档旧对话，然后对所有分片做 ANALYZE（+ VACUUM）；整个过程持有维护锁"""
+    with maintenance_lock(ARCHIVE_DIR):
+        return _run_maintenance(medical_db, patient_db, older_than_days, vacuum)
+
+
+def _run_maintenance(medical_db, patient_db, older_than_days: float, vacuum: bool) -> Dict:
+    report = {"archived": _archive_conversations(medical_db, older_than_days, ARCHIVE_DIR, ARCHIVE_BATCH_SIZE),
+              "databases": {}}
+    paths: List[str] = list(medical_db.shards.paths)
+    if patient_db is not None:
+        paths += patient_db.shards.paths
+    for path in paths:
+        report["databases"][path] = maintain_database(path, vacuum)
+    _mark_run(ARCHIVE_DIR)
+    return report
+
+
+def start_maintenance_scheduler(get_databases: Callable[[], Tuple], interval_hours: float = MAINTENANCE_INTERVAL_HOURS):
+    """
+    后台线程定时执行 run_maintenance（interval_hours <= 0 时不启动）
+
+    每个 worker 都会启动定时器，但每一轮只有拿到维护锁、且最近半个周期内没人执行过的那个进程执行
+    """
+    if interval_hours <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            try:
+                with maintenance_lock(ARCHIVE_DIR, blocking=False) as acquired:
+                    last = _last_run(ARCHIVE_DIR)
+                    if not acquired or (last is not None and time.time() - last < interval_hours * 1800):
+                        logger.info("Maintenance skipped: another process is running or just ran it")
+                        continue
+                    medical_db, patient_db = get_databases()
+                    report = _run_maintenance(medical_db, patient_db, ARCHIVE_AFTER_DAYS, MAINTENANCE_VACUUM)
+                logger.info(f"Maintenance finished: {report}")
+            except Exception as e:
+                logger.error(f"Maintenance failed: {e}")
+
+    thread = threading.Thread(target=loop, name="db-maintenance", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv: Sequence[str] = None):
+    from database import MedicalRecordsDatabase, PatientDatabase
+
+    parser = argparse.ArgumentParser(description="Conversation archival and database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="archive old conversations, then ANALYZE/VACUUM")
+    run.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    run.add_argument("--no-vacuum", action="store_true")
+    get = sub.add_parser("get", help="print the conversations of a patient, including archived ones")
+    get.add_argument("patient_id")
+    args = parser.parse_args(argv)
+
+    medical_db = MedicalRecordsDatabase()
+    if args.command == "run":
+        report = run_maintenance(medical_db, PatientDatabase(), args.older_than_days, vacuum=not args.no_vacuum)
+        print(json.dumps(report, indent=2))
+    else:
+        conversations = medical_db.get_conversations(args.patient_id, include_archived=True)
+        print(json.dumps(conversations, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# 并发转录请求的动态批处理
+#
+# 多个上传同时到达时，各自调用 WhisperModel.transcribe 会争抢同一批 CPU 核。
+# 这里在 transcribe 前面加一个调度器：在 ASR_BATCH_WINDOW_MS 时间窗内收集各请求的
+# 音频片段（每段 ≤30 秒），拼成一次 BatchedInferencePipeline 推理，再按片段归属把
+# 结果拆回给各调用方。ASR_BATCH_WINDOW_MS=0（默认）时不启用。
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+ASR_BATCH_WINDOW_MS = float(os.getenv("ASR_BATCH_WINDOW_MS", "0"))
+ASR_MAX_BATCH_SIZE = int(os.getenv("ASR_MAX_BATCH_SIZE", "8"))
+ASR_BATCH_LANGUAGE = os.getenv("ASR_BATCH_LANGUAGE", "en")
+
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 30
+
+
+def batching_enabled() -> bool:
+    return ASR_BATCH_WINDOW_MS > 0
+
+
+class _Job:
+    __slots__ = ("audio", "clips", "event", "segments", "error", "submitted")
+
+    def __init__(self, audio, clips: List[Tuple[int, int]]):
+        self.audio = audio
+        self.clips = clips
+        self.event = threading.Event()
+        self.segments: List[Dict] = []
+        self.error = None
+        self.submitted = time.perf_counter()
+
+
+def split_clips(audio, max_seconds: int = CHUNK_SECONDS) -> List[Tuple[int, int]]:
+    """
+    把一段音频切成 ≤max_seconds 的片段（采样点区间）
+    短音频整段返回；长音频先做 VAD，再把语音区间贪心合并到不超过上限
+    """
+    limit = max_seconds * SAMPLE_RATE
+    if len(audio) <= limit:
+        return [(0, len(audio))]
+
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    speech = get_speech_timestamps(audio, VadOptions())
+    clips = []
+    for ts in speech:
+        start, end = ts["start"], ts["end"]
+        # 单个语音区间超长时按上限硬切
+        while end - start > limit:
+            clips.append((start, start + limit))
+            start += limit
+        if clips and end - clips[-1][0] <= limit:
+            clips[-1] = (clips[-1][0], end)
+        else:
+            clips.append((start, end))
+    return clips or [(0, min(len(audio), limit))]
+
+
+class BatchScheduler:
+    """收集并发请求的音频片段，按时间窗 / 批大小触发批量推理"""
+
+    def __init__(self, window_s: float, max_batch_size: int, profile: str = "default"):
+        self.profile = profile
+        self.window_s = window_s
+        self.max_batch_size = max_batch_size
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._pipeline = None
+        self._stats = {"batches": 0, "jobs": 0, "clips": 0}
+        self._thread = threading.Thread(target=self._run, name="asr-batcher", daemon=True)
+        self._thread.start()
+
+    def _get_pipeline(self):
+        if self._pipeline is None:
+            from faster_whisper import BatchedInferencePipeline
+            from asr.transcribe import DECODE_PROFILES, get_model
+
+            self._pipeline = BatchedInferencePipeline(model=get_model(DECODE_PROFILES[self.profile]["model"]))
+        return self._pipeline
+
+    def transcribe(self, file_path: str) -> List[Dict]:
+        """在调用方线程解码音频，然后排队等待批量推理结果"""
+        from faster_whisper import decode_audio
+
+        audio = decode_audio(file_path, sampling_rate=SAMPLE_RATE)
+        job = _Job(audio, split_clips(audio))
+        self._queue.put(job)
+        job.event.wait()
+        if job.error is not None:
+            raise job.error
+        return job.segments
+
+    def stats(self) -> Dict:
+        return dict(self._stats, profile=self.profile, window_ms=self.window_s * 1000,
+                    max_batch_size=self.max_batch_size)
+
+    # ---------- 后台批处理线程 ----------
+
+    def _collect(self) -> List[_Job]:
+        jobs = [self._queue.get()]
+        clips = len(jobs[0].clips)
+        deadline = time.perf_counter() + self.window_s
+        while clips < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            clips += len(job.clips)
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            try:
+                self._run_batch(jobs)
+            except Exception as e:
+                logger.error(f"Batched transcription failed: {e}")
+                for job in jobs:
+                    job.error = e
+            finally:
+                for job in jobs:
+                    job.event.set()
+
+    def _run_batch(self, jobs: List[_Job]):
+        import numpy as np
+        from asr.transcribe import DECODE_PROFILES
+
+        # 把所有请求的音频拼接成一条，记录每个请求在拼接音频中的起点
+        offsets = []
+        clip_timestamps = []
+        position = 0
+        for job in jobs:
+            offsets.append(position)
+            for start, end in job.clips:
+                clip_timestamps.append({"start": position + start, "end": position + end})
+            position += len(job.audio)
+        audio = np.concatenate([job.audio for job in jobs])
+
+        started = time.perf_counter()
+        segments, _ = self._get_pipeline().transcribe(
+            audio,
+            language=ASR_BATCH_LANGUAGE,
+            clip_timestamps=clip_timestamps,
+            vad_filter=False,
+            without_timestamps=False,
+            batch_size=self.max_batch_size,
+            **DECODE_PROFILES[self.profile]["options"],
+        )
+
+        # 按起始时间把片段拆回各请求，并换算回请求自身的时间轴
+        bounds = [offset / SAMPLE_RATE for offset in offsets] + [position / SAMPLE_RATE]
+        for seg in segments:
+            index = 0
+            while index + 1 < len(jobs) and seg.start >= bounds[index + 1]:
+                index += 1
+            base = bounds[index]
+            jobs[index].segments.append({
+                "start": round(seg.start - base, 2),
+                "end": round(seg.end - base, 2),
+                "text": seg.text.strip(),
+            })
+
+        self._stats["batches"] += 1
+        self._stats["jobs"] += len(jobs)
+        self._stats["clips"] += len(clip_timestamps)
+        latency = max(time.perf_counter() - job.submitted for job in jobs)
+        logger.info(f"ASR batch ({self.profile}): {len(jobs)} requests, {len(clip_timestamps)} clips in "
+                    f"{time.perf_counter() - started:.2f}s (max latency {latency:.2f}s)")
+
+
+# 每个解码配置一个调度器：只有同一配置的请求才能合并成一批
+_schedulers: Dict[str, BatchScheduler] = {}
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(profile: str = "default") -> BatchScheduler:
+    if profile not in _schedulers:
+        with _scheduler_lock:
+            if profile not in _schedulers:
+                _schedulers[profile] = BatchScheduler(ASR_BATCH_WINDOW_MS / 1000, ASR_MAX_BATCH_SIZE, profile)
+    return _schedulers[profile]
@@ -1,4 +1,5 @@
-from typing import List, Dict
+from collections import deque
+from typing import Deque, Dict, List, Optional
 
 DOCTOR_TERMS = {
     "doctor", "dr", "physician", "nurse", "provider"
@@ -83,12 +84,40 @@ def guess_first_speaker(text: str) -> str:
     return "Patient"
 
 
+# 强医生指标
+DOCTOR_STRONG_PHRASES = (
+    "let me examine", "i recommend", "the diagnosis", "your symptoms indicate", "okay, let me take a look"
+)
+
+# 开场阶段用于推断第一个说话人的片段数
+FIRST_SPEAKER_LOOKAHEAD = 3
+
+
+def strong_speaker_cue(text: str) -> Optional[str]:
+    """强指标直接决定说话人（覆盖交替规则），没有强指标时返回 None"""
+    text_lower = text.lower()
+    # 强患者指标 - 强制切换到患者
+    if any(indicator in text_lower for indicator in PATIENT_TERMS):
+        return "Patient"
+    # 强医生指标 - 强制切换到医生
+    if any(phrase in text_lower for phrase in DOCTOR_STRONG_PHRASES):
+        return "Doctor"
+    # 医生问候语 - 强制切换到医生
+    if is_doctor_greeting(text):
+        return "Doctor"
+    return None
+
+
+def other_speaker(speaker: str) -> str:
+    return "Doctor" if speaker == "Patient" else "Patient"
+
+
 def assign_speakers(segments: List[Dict]) -> List[Dict]:
     if not segments:
         return []
 
     # 分析前几个片段来确定初始说话人
-    first_texts = [seg["text"] for seg in segments[:3]]
+    first_texts = [seg["text"] for seg in segments[:FIRST_SPEAKER_LOOKAHEAD]]
     combined_start = " ".join(first_texts)
     
     # 使用改进的逻辑确定第一个说话人
@@ -96,25 +125,107 @@ def assign_speakers(segments: List[Dict]) -> List[Dict]:
 
     transcript = []
     for i, seg in enumerate(segments):
-        text_lower = seg["text"].lower()
-        
-        # 强患者指标 - 强制切换到患者
-        if any(indicator in text_lower for indicator in PATIENT_TERMS):
-            current_speaker = "Patient"
-        # 强医生指标 - 强制切换到医生
-        elif any(phrase in text_lower for phrase in ["let me examine", "i recommend", "the diagnosis", "your symptoms indicate", "okay, let me take a look"]):
-            current_speaker = "Doctor"
-        # 医生问候语 - 强制切换到医生
-        elif is_doctor_greeting(seg["text"]):
-            current_speaker = "Doctor"
+        current_speaker = strong_speaker_cue(seg["text"]) or current_speaker
         
         transcript.append({
             "speaker": current_speaker,
+            "start": seg.get("start", 0.0),
+            "end": seg.get("end", 0.0),
             "text": seg["text"]
         })
         
         # 交替说话人，但允许被强指标覆盖
         if i < len(segments) - 1:  # 不在最后一个片段后交替
-            current_speaker = "Doctor" if current_speaker == "Patient" else "Patient"
+            current_speaker = other_speaker(current_speaker)
 
     return transcript
+
+
+class IncrementalDiarizer:
+    """
+    流式说话人识别：片段逐个到达，逐个（或延迟 delay 个片段）给出标签
+
+    - 开场阶段（前 lookahead 个片段）每到一个片段就用已有片段重新推断第一个说话人，
+      推断结果变化导致已发出的标签改变时发出 correction 事件
+    - 凑满 lookahead 个片段（或 finish()）后推断结果与 assign_speakers 一致，
+      之后的标签只依赖当前说话人和当前片段，发出即为最终结果
+    - 只保存开场的 lookahead 段文本和至多 delay 个待发片段，内存与会话长度无关
+
+    事件格式:
+      {"event": "label", "index", "speaker", "start", "end", "text"}
+      {"event": "correction", "index", "speaker", "previous"}
+    """
+
+    def __init__(self, delay: int = 0, lookahead: int = FIRST_SPEAKER_LOOKAHEAD):
+        self.lookahead = max(1, lookahead)
+        self.delay = max(0, min(delay, self.lookahead - 1))
+        self.count = 0                      # 已收到的片段数
+        self.final = False                  # 第一个说话人是否已确定
+        self._opening: List[str] = []       # 开场片段文本（至多 lookahead 个）
+        self._labels: List[str] = []        # 开场片段当前标签
+        self._emitted = 0                   # 已发出标签的片段数
+        self._pending: Deque[Dict] = deque()
+        self._next_speaker: Optional[str] = None  # 下一个片段在强指标之前的说话人
+
+    def push(self, segment: Dict) -> List[Dict]:
+        """加入一个片段，返回本次产生的事件"""
+        entry = dict(segment, index=self.count)
+        self.count += 1
+
+        events: List[Dict] = []
+        if self.final:
+            entry["speaker"] = self._label_next(segment["text"])
+        else:
+            self._opening.append(segment["text"])
+            events.extend(self._relabel_opening(final=len(self._opening) >= self.lookahead))
+        self._pending.append(entry)
+
+        # 第一个说话人确定后不再有修正，不必继续等待
+        ready = self.count if self.final else self.count - self.delay
+        events.extend(self._emit_until(ready))
+        return events
+
+    def finish(self) -> List[Dict]:
+        """输入结束：用已有片段确定第一个说话人并发出剩余标签"""
+        events: List[Dict] = []
+        if not self.final and self._opening:
+            events.extend(self._relabel_opening(final=True))
+        events.extend(self._emit_until(self.count))
+        return events
+
+    def _label_next(self, text: str) -> str:
+        speaker = strong_speaker_cue(text) or self._next_speaker
+        self._next_speaker = other_speaker(speaker)
+        return speaker
+
+    def _relabel_opening(self, final: bool) -> List[Dict]:
+        """用当前开场片段重新推断第一个说话人并重放开场标签"""
+        self._next_speaker = guess_first_speaker(" ".join(self._opening))
+        labels = [self._label_next(text) for text in self._opening]
+
+        events = [
+            {"event": "correction", "index": i, "speaker": labels[i], "previous": self._labels[i]}
+            for i in range(self._emitted)
+            if labels[i] != self._labels[i]
+        ]
+        self._labels = labels
+        if final:
+            self.final = True
+            self._opening = []
+        return events
+
+    def _emit_until(self, ready: int) -> List[Dict]:
+        events = []
+        while self._pending and self._pending[0]["index"] < ready:
+            entry = self._pending.popleft()
+            index = entry["index"]
+            events.append({
+                "event": "label",
+                "index": index,
+                "speaker": entry.get("speaker") or self._labels[index],
+                "start": entry.get("start", 0.0),
+                "end": entry.get("end", 0.0),
+                "text": entry["text"],
+            })
+            self._emitted = index + 1
+        return events
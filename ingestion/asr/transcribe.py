@@ -1,48 +1,169 @@
-from faster_whisper import WhisperModel
 from typing import List, Dict
 import time
 import os
+import threading
+import inference_client
+import resources
+from asr import batching
 
 _model = None
+_models = {}
+_models_lock = threading.Lock()
+
+# ===============================
+# 解码配置（速度 / 准确率取舍）
+# ===============================
+# default: 与原行为一致（tiny 模型 + faster-whisper 默认解码参数）
+# preview: 贪心解码、无温度回退，用于问诊过程中的即时草稿
+# final:   束搜索 + 更大的模型，问诊结束后出高质量转录
+DECODE_PROFILES = {
+    "default": {
+        "model": None,
+        "options": {},
+    },
+    "preview": {
+        "model": "tiny",
+        "options": {
+            "beam_size": 1,
+            "best_of": 1,
+            "temperature": 0.0,
+            "condition_on_previous_text": False,
+            "word_timestamps": False,
+        },
+    },
+    "final": {
+        "model": os.getenv("ASR_FINAL_MODEL", "small"),
+        "options": {
+            "beam_size": 5,
+            "best_of": 5,
+            "temperature": (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+            "condition_on_previous_text": True,
+            "word_timestamps": False,
+        },
+    },
+}
+
+DEFAULT_PROFILE = "default"
+
+
+def resolve_profile(profile: str = None) -> str:
+    profile = profile or DEFAULT_PROFILE
+    if profile not in DECODE_PROFILES:
+        raise ValueError(f"Unknown decode profile '{profile}', expected one of {sorted(DECODE_PROFILES)}")
+    return profile
+
+
+# 在 faster_whisper / ctranslate2 / numpy 首次导入之前设置线程数环境变量
+resources.apply()
+
+
+def _thread_options() -> Dict:
+    """CTranslate2 的线程数：每个转录 cpu_threads 个线程，至多 num_workers 个转录并行（见 resources.py）"""
+    budget = resources.get_budget()
+    return {"cpu_threads": budget["asr_cpu_threads"], "num_workers": budget["asr_num_workers"]}
+
+
+def get_model(model_size: str = None):
+    """
+    model_size 为 None 时加载默认模型（带回退）；否则按尺寸加载并缓存
+
+    默认模型也按实际尺寸登记在 _models 中，default 与 preview 共用同一个 tiny 实例
+    """
+    if model_size is not None:
+        if model_size not in _models:
+            with _models_lock:
+                if model_size not in _models:
+                    from faster_whisper import WhisperModel
+
+                    print(f"Loading Whisper model {model_size}...")
+                    _models[model_size] = WhisperModel(model_size, device="cpu", compute_type="int8", **_thread_options())
+        return _models[model_size]
 
-def get_model():
     global _model
     if _model is None:
-        print("Loading Whisper model...")
-        
-        # 尝试多种模型配置，从最简单的开始
-        model_configs = [
-            {"model_size_or_path": "tiny", "device": "cpu", "compute_type": "int8"},
-            {"model_size_or_path": "base", "device": "cpu", "compute_type": "int8"},
-        ]
-        
-        for i, config in enumerate(model_configs):
-            try:
-                print(f"Trying model config {i+1}: {config['model_size_or_path']}")
-                _model = WhisperModel(**config)
-                print(f"Successfully loaded {config['model_size_or_path']} model.")
-                break
-            except Exception as e:
-                print(f"Failed to load {config['model_size_or_path']} model: {e}")
-                if i < len(model_configs) - 1:
-                    print("Retrying with different model...")
-                    time.sleep(2)
-                else:
-                    print("All model configs failed, using fallback...")
-                    # 最后的fallback - 使用最小的模型
-                    try:
-                        _model = WhisperModel("tiny", device="cpu", compute_type="int8")
-                        print("Fallback tiny model loaded.")
-                    except Exception as fallback_error:
-                        print(f"Even fallback failed: {fallback_error}")
-                        raise Exception("Unable to load any Whisper model")
-    
+        with _models_lock:
+            if _model is None:
+                _model = _load_default_model()
     return _model
 
 
-def transcribe_audio(file_path: str) -> List[Dict]:
-    model = get_model()
-    segments, _ = model.transcribe(file_path)
+def _load_default_model():
+    """按配置顺序尝试加载默认模型，已按尺寸加载过的直接复用（调用方持有 _models_lock）"""
+    # 延迟导入：faster_whisper 会连带加载 ctranslate2 / av，放到首次使用时
+    from faster_whisper import WhisperModel
+
+    print("Loading Whisper model...")
+    
+    # 尝试多种模型配置，从最简单的开始
+    model_configs = [
+        {"model_size_or_path": "tiny", "device": "cpu", "compute_type": "int8"},
+        {"model_size_or_path": "base", "device": "cpu", "compute_type": "int8"},
+    ]
+    
+    for i, config in enumerate(model_configs):
+        size = config["model_size_or_path"]
+        if size in _models:
+            print(f"Reusing loaded {size} model.")
+            return _models[size]
+        try:
+            print(f"Trying model config {i+1}: {size}")
+            _models[size] = WhisperModel(**config, **_thread_options())
+            print(f"Successfully loaded {size} model.")
+            return _models[size]
+        except Exception as e:
+            print(f"Failed to load {size} model: {e}")
+            if i < len(model_configs) - 1:
+                print("Retrying with different model...")
+                time.sleep(2)
+
+    print("All model configs failed, using fallback...")
+    # 最后的fallback - 使用最小的模型
+    try:
+        _models["tiny"] = WhisperModel("tiny", device="cpu", compute_type="int8", **_thread_options())
+        print("Fallback tiny model loaded.")
+        return _models["tiny"]
+    except Exception as fallback_error:
+        print(f"Even fallback failed: {fallback_error}")
+        raise Exception("Unable to load any Whisper model")
+
+
+# 启动时预热的解码配置（逗号分隔）
+ASR_WARM_PROFILES = [p.strip() for p in os.getenv("ASR_WARM_PROFILES", DEFAULT_PROFILE).split(",") if p.strip()]
+
+
+def warm_up():
+    """加载模型并对 1 秒静音做一次推理，预热推理路径"""
+    if inference_client.INFERENCE_SOCKET:
+        # 模型由共享推理服务持有，这里只确认服务可用
+        inference_client.get_client().ping()
+        return
+
+    import numpy as np
+
+    for profile in ASR_WARM_PROFILES:
+        config = DECODE_PROFILES[resolve_profile(profile)]
+        model = get_model(config["model"])
+        segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), **config["options"])
+        list(segments)
+
+
+def transcribe_audio(file_path: str, profile: str = None) -> List[Dict]:
+    profile = resolve_profile(profile)
+    if inference_client.INFERENCE_SOCKET:
+        return inference_client.get_client().transcribe(file_path, profile)
+    return transcribe_local(file_path, profile)
+
+
+def transcribe_local(file_path: str, profile: str = None) -> List[Dict]:
+    profile = resolve_profile(profile)
+
+    # 开启动态批处理时，和并发请求合并推理
+    if batching.batching_enabled():
+        return batching.get_scheduler(profile).transcribe(file_path)
+
+    config = DECODE_PROFILES[profile]
+    model = get_model(config["model"])
+    segments, _ = model.transcribe(file_path, **config["options"])
 
     results = []
     for seg in segments:
@@ -0,0 +1,89 @@
+# 录音处理流水线（/upload-audio 与 batch_ingest.py 共用）
+#
+#   转录 → 说话人识别 → RAG（患者识别、医疗信息提取与保存、记录检索）→ 逐片段 PII 脱敏
+#
+# 前两步和脱敏不写数据库，可以放在独立的工作进程中执行；RAG 步骤写数据库。
+import logging
+from typing import Dict, List, Tuple
+
+from asr.diarize import assign_speakers
+from asr.transcribe import transcribe_audio
+from redaction_cache import redact_segment
+from segments import Segment
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_NOTE = "Phase 1: Audio transcription with speaker identification, PII redaction, and medical record retrieval"
+
+
+def transcribe_segments(path: str, profile: str, size: int = None) -> Tuple[List[Dict], List[Segment]]:
+    """转录 + 说话人识别，返回 (Whisper 原始片段, 带说话人的片段)"""
+    logger.info("Starting audio transcription...")
+    with span("transcribe", bytes=size, profile=profile):
+        segments = transcribe_audio(path, profile)
+    logger.info(f"Transcription complete: {len(segments)} segments")
+
+    logger.info("Assigning speakers...")
+    with span("diarize", segments=len(segments)):
+        transcript = [Segment.from_dict(seg) for seg in assign_speakers(segments)]
+    return segments, transcript
+
+
+def redact_transcript(transcript: List[Segment]) -> Dict:
+    """逐片段 PII 脱敏，重复出现的片段直接命中缓存"""
+    logger.info("Starting PII detection and redaction...")
+    redacted_transcript = []
+    all_redacted_entities = set()
+    all_detected_types = set()
+
+    with span("redact", segments=len(transcript)):
+        for seg in transcript:
+            redaction = redact_segment(seg.text)
+            redacted_transcript.append({
+                "speaker": seg.speaker,
+                "text": redaction.text
+            })
+            all_redacted_entities.update(redaction.entities)
+            all_detected_types.update(redaction.detected_types)
+    detected_types = sorted(all_detected_types)
+    logger.info(f"Detected PII types: {detected_types}")
+    return {
+        "transcript": redacted_transcript,
+        "redaction_summary": list(all_redacted_entities),
+        "detected_entity_types": detected_types,
+    }
+
+
+def build_response(redaction: Dict, segments_count: int, profile: str, rag_result: Dict) -> Dict:
+    """/upload-audio 的响应体"""
+    logger.info(f"Processing complete. Patient identified: {rag_result['patient_identified']}")
+    response = {
+        **redaction,
+        "processing_note": PROCESSING_NOTE,
+        "segments_count": segments_count,
+        "decode_profile": profile,
+        # RAG结果
+        "patient_identified": rag_result["patient_identified"],
+        "patient_id": rag_result["patient_id"],
+        "medical_records": rag_result["medical_records"],
+        "extracted_patient_info": rag_result["extracted_info"]
+    }
+
+    # 如果有RAG错误，添加到响应中
+    if rag_result.get("error"):
+        response["rag_error"] = rag_result["error"]
+    return response
+
+
+def process_audio_file(path: str, profile: str, rag_system, size: int = None) -> Dict:
+    """完整流水线：一个录音文件 → /upload-audio 响应体"""
+    segments, transcript = transcribe_segments(path, profile, size)
+
+    # RAG系统处理 - 按说话人逐片段提取，患者识别和医疗记录检索
+    logger.info("Starting RAG processing...")
+    with span("rag"):
+        rag_result = rag_system.process_conversation(transcript)
+
+    redaction = redact_transcript(transcript)
+    return build_response(redaction, len(segments), profile, rag_result)
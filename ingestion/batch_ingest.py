@@ -0,0 +1,295 @@
+# 批量导入录音（回填诊所历史录音）
+#
+#   python batch_ingest.py recordings/ --workers 4 --results batch_results.jsonl
+#   python batch_ingest.py manifest.jsonl --profile final
+#
+# 输入是目录（递归查找音频文件）或清单文件：每行一个路径，或 JSONL {"path": ..., "profile": ...}。
+#
+# 流水线与 /upload-audio 相同（见 audio_pipeline.py），按阶段拆开执行：
+#   - 工作进程：转录 + 说话人识别 + 逐片段脱敏。每个进程持有自己的 Whisper 模型和 NER 管道，
+#     启动时预热；OMP/MKL 和 Whisper 线程数按可用核数（含容器配额）/ 进程数分配，避免多个进程互相抢核
+#   - 主进程：RAG（患者识别、医疗信息提取）并写数据库。SQLite 同一时间只有一个写者，
+#     由主进程统一写入，医疗记录按患者批量写入（add_records，一个事务）
+#
+# 每个文件处理完后把结果追加到结果文件（JSONL），结果文件同时就是检查点：
+# 重新运行同一命令时，(路径, 大小, 修改时间) 未变且已成功的文件会被跳过，失败的文件会重试。
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Sequence, Tuple
+
+import resources
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {".m4a", ".mp3", ".wav", ".flac", ".ogg", ".webm", ".mp4", ".aac"}
+
+# 每个工作进程排队的文件数上限（控制主进程内存和中断时丢失的进度）
+QUEUE_PER_WORKER = 2
+
+
+# ===============================
+# 输入与检查点
+# ===============================
+
+def discover(source: str, default_profile: str) -> List[Tuple[str, str]]:
+    """目录或清单文件 → [(音频路径, 解码配置)]"""
+    if os.path.isdir(source):
+        found = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                    found.append((os.path.join(root, name), default_profile))
+        return sorted(found)
+
+    base = os.path.dirname(os.path.abspath(source))
+    items = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                path, profile = entry["path"], entry.get("profile") or default_profile
+            else:
+                path, profile = line, default_profile
+            # 清单中的相对路径相对于清单文件所在目录
+            items.append((os.path.join(base, path), profile))
+    return items
+
+
+def fingerprint(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def load_checkpoint(results_path: str) -> set:
+    """结果文件中已成功处理的文件 (路径, 大小, 修改时间)"""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 中断时写了一半的最后一行
+                continue
+            if entry.get("status") == "ok":
+                done.add((entry["path"], entry["size"], entry["mtime"]))
+    return done
+
+
+# ===============================
+# 工作进程
+# ===============================
+
+def _init_worker(threads: int, profiles: Sequence[str]):
+    """设置线程数并预热本进程的 Whisper 模型和 NER 管道"""
+    # 每个工作进程只跑一个转录：线程预算固定为 threads（见 resources.py）
+    for name in resources.THREAD_ENV_VARS + ("ASR_CPU_THREADS",):
+        os.environ[name] = str(threads)
+    os.environ["ASR_NUM_WORKERS"] = "1"
+    resources.apply()
+    logging.basicConfig(level=logging.WARNING)
+
+    from asr import transcribe
+    from redaction_cache import redact_segment
+
+    transcribe.ASR_WARM_PROFILES = list(profiles)
+    transcribe.warm_up()
+    redact_segment("Warm up with John Smith.")
+
+
+def _process_in_worker(path: str, profile: str) -> Dict:
+    """转录 + 说话人识别 + 脱敏（不写数据库）"""
+    from audio_pipeline import redact_transcript, transcribe_segments
+
+    t0 = time.perf_counter()
+    segments, transcript = transcribe_segments(path, profile, os.path.getsize(path))
+    t1 = time.perf_counter()
+    redaction = redact_transcript(transcript)
+    t2 = time.perf_counter()
+    return {
+        "segments_count": len(segments),
+        "audio_seconds": segments[-1]["end"] if segments else 0.0,
+        "transcript": [seg.to_dict() for seg in transcript],
+        "redaction": redaction,
+        "timings": {"transcribe": round(t1 - t0, 3), "redact": round(t2 - t1, 3)},
+    }
+
+
+# ===============================
+# 主进程：调度、写库、记录结果
+# ===============================
+
+def _store(rag, profile: str, output: Dict) -> Dict:
+    """RAG 处理并写数据库，返回与 /upload-audio 相同的响应体"""
+    from audio_pipeline import build_response
+    from segments import Segment
+
+    transcript = [Segment.from_dict(seg) for seg in output["transcript"]]
+    t0 = time.perf_counter()
+    rag_result = rag.process_conversation(transcript)
+    output["timings"]["rag"] = round(time.perf_counter() - t0, 3)
+    return build_response(output["redaction"], output["segments_count"], profile, rag_result)
+
+
+def _result_summary(response: Dict) -> Dict:
+    """结果文件中保存的内容：患者 ID、计数和脱敏类型，不含任何转录文本或身份信息"""
+    summary = {
+        "patient_identified": response["patient_identified"],
+        "patient_id": response["patient_id"],
+        "segments_count": response["segments_count"],
+        "decode_profile": response["decode_profile"],
+        "medical_records": len(response["medical_records"]),
+        # 只记录提取到了哪些身份字段（extracted_patient_info 里是姓名/SSN/出生日期明文）
+        "extracted_fields": sorted(k for k, v in response["extracted_patient_info"].items() if v),
+        "redaction_summary": response["redaction_summary"],
+    }
+    if response.get("rag_error"):
+        summary["rag_error"] = response["rag_error"]
+    return summary
+
+
+def run_batch(items: List[Tuple[str, str]], results_path: str, workers: int, threads: int = None,
+              rag=None, progress=None) -> Dict:
+    """处理 items 中尚未完成的文件，返回汇总统计"""
+    if rag is None:
+        from rag_system import RAGSystem
+        rag = RAGSystem()
+    workers = max(1, workers)
+    threads = threads or max(1, resources.available_cpus() // workers)
+
+    done = load_checkpoint(results_path)
+    pending = []
+    missing = 0
+    for path, profile in items:
+        try:
+            fp = fingerprint(path)
+        except OSError as e:
+            logger.warning(f"Skipping {path}: {e}")
+            missing += 1
+            continue
+        if (fp["path"], fp["size"], fp["mtime"]) not in done:
+            pending.append((fp, profile))
+
+    stats = {
+        "files": len(items),
+        "missing": missing,
+        "skipped": len(items) - missing - len(pending),
+        "succeeded": 0,
+        "failed": 0,
+        "audio_seconds": 0.0,
+        "workers": workers,
+        "threads_per_worker": threads,
+    }
+    if not pending:
+        stats.update(wall_seconds=0.0, files_per_second=0.0, speed_factor=0.0)
+        return stats
+
+    profiles = sorted({profile for _, profile in pending})
+    started = time.perf_counter()
+    # spawn：工作进程不继承主进程已加载的模型和打开的数据库连接
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(threads, profiles)) as pool, \
+            open(results_path, "a", encoding="utf-8") as results:
+        queue = iter(pending)
+        in_flight = {}
+
+        def submit_next() -> bool:
+            item = next(queue, None)
+            if item is None:
+                return False
+            fp, profile = item
+            try:
+                future = pool.submit(_process_in_worker, fp["path"], profile)
+            except BrokenProcessPool:
+                # 工作进程崩溃（或初始化失败）；其余文件留到下次运行
+                logger.error("Worker pool is broken, stopping; rerun to resume")
+                return False
+            in_flight[future] = (fp, profile, time.perf_counter())
+            return True
+
+        for _ in range(workers * QUEUE_PER_WORKER):
+            if not submit_next():
+                break
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                fp, profile, submitted = in_flight.pop(future)
+                entry = dict(fp, profile=profile)
+                try:
+                    output = future.result()
+                    response = _store(rag, profile, output)
+                    # RTF 按实际处理耗时计算；wall_seconds 还包括在进程池中排队的时间
+                    busy = sum(output["timings"].values())
+                    entry.update(
+                        status="ok",
+                        audio_seconds=output["audio_seconds"],
+                        wall_seconds=round(time.perf_counter() - submitted, 3),
+                        rtf=round(busy / output["audio_seconds"], 3) if output["audio_seconds"] else None,
+                        timings=output["timings"],
+                        result=_result_summary(response),
+                    )
+                    stats["succeeded"] += 1
+                    stats["audio_seconds"] += output["audio_seconds"]
+                except Exception as e:
+                    logger.error(f"Failed to process {fp['path']}: {e}")
+                    entry.update(status="error", error=str(e))
+                    stats["failed"] += 1
+                results.write(json.dumps(entry) + "\n")
+                results.flush()
+                if progress:
+                    progress(entry)
+                submit_next()
+
+    wall = time.perf_counter() - started
+    stats.update(
+        audio_seconds=round(stats["audio_seconds"], 1),
+        wall_seconds=round(wall, 3),
+        files_per_second=round(stats["succeeded"] / wall, 3),
+        speed_factor=round(stats["audio_seconds"] / wall, 2),
+    )
+    return stats
+
+
+def _print_progress(entry: Dict):
+    if entry["status"] == "ok":
+        print(f"ok     {entry['path']}  audio={entry['audio_seconds']:.1f}s  wall={entry['wall_seconds']:.1f}s  "
+              f"rtf={entry['rtf']}  patient={entry['result']['patient_id']}", file=sys.stderr)
+    else:
+        print(f"error  {entry['path']}  {entry['error']}", file=sys.stderr)
+
+
+def main(argv: Sequence[str] = None):
+    from asr.transcribe import DECODE_PROFILES, DEFAULT_PROFILE
+
+    parser = argparse.ArgumentParser(description="Transcribe, redact and store a directory or manifest of recordings")
+    parser.add_argument("source", help="directory of recordings, or a manifest (one path per line, or JSONL with path/profile)")
+    parser.add_argument("--results", default="batch_results.jsonl", help="results JSONL, also used as the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=max(1, resources.available_cpus() // 2))
+    parser.add_argument("--threads", type=int, help="OMP threads per worker (default: cores / workers)")
+    parser.add_argument("--profile", choices=sorted(DECODE_PROFILES), default=DEFAULT_PROFILE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    items = discover(args.source, args.profile)
+    unknown = sorted({profile for _, profile in items} - set(DECODE_PROFILES))
+    if unknown:
+        parser.error(f"unknown decode profiles in manifest: {unknown}")
+    stats = run_batch(items, args.results, args.workers, args.threads, progress=_print_progress)
+    print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+ASR 解码配置基准：各 profile 在样例录音上的实时率（RTF = 转录耗时 / 音频时长）
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.asr_profiles_bench                     # 默认使用 ingestion/*.m4a
+    python -m benchmarks.asr_profiles_bench --profiles preview,final --runs 3 --output asr.json
+"""
+import argparse
+import glob
+import os
+import time
+
+from asr.transcribe import DECODE_PROFILES, get_model, transcribe_local
+from benchmarks.common import environment, summarize, write_results
+
+INGESTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def audio_seconds(path: str) -> float:
+    from faster_whisper import decode_audio
+
+    return len(decode_audio(path, sampling_rate=16000)) / 16000
+
+
+def run(args) -> dict:
+    files = args.files or sorted(glob.glob(os.path.join(INGESTION_DIR, "*.m4a")))
+    durations = {path: audio_seconds(path) for path in files}
+    total_audio = sum(durations.values())
+
+    results = {}
+    for profile in args.profiles:
+        # 模型加载不计入 RTF
+        load_started = time.perf_counter()
+        get_model(DECODE_PROFILES[profile]["model"])
+        load_seconds = time.perf_counter() - load_started
+
+        latencies = []
+        per_file = {}
+        for path in files:
+            runs = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                segments = transcribe_local(path, profile)
+                runs.append(time.perf_counter() - started)
+            latencies.extend(runs)
+            best = min(runs)
+            per_file[os.path.basename(path)] = {
+                "audio_seconds": round(durations[path], 2),
+                "best_seconds": round(best, 3),
+                "real_time_factor": round(best / durations[path], 4),
+                "segments": len(segments),
+                "preview": " ".join(seg["text"] for seg in segments)[:120],
+            }
+
+        stats = summarize(latencies)
+        stats["model_load_seconds"] = round(load_seconds, 2)
+        stats["real_time_factor"] = round(sum(latencies) / args.runs / total_audio, 4) if total_audio else None
+        stats["files"] = per_file
+        results[profile] = stats
+
+    return {
+        "benchmark": "asr_profiles",
+        "environment": environment(),
+        "params": {"runs": args.runs, "audio_seconds": round(total_audio, 2), "files": len(files)},
+        "profiles": {name: DECODE_PROFILES[name] for name in args.profiles},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Real-time factor of each ASR decode profile")
+    parser.add_argument("files", nargs="*", help="audio files (default: the sample recordings)")
+    parser.add_argument("--profiles", type=lambda v: v.split(","), default=sorted(DECODE_PROFILES))
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# 基准测试公共工具：计时统计、JSON 结果输出
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Sequence
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """最近秩百分位（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies_s: List[float], wall_s: float = None) -> Dict:
+    """把一组延迟（秒）汇总为吞吐量和 p50/p99（毫秒）"""
+    values = sorted(latencies_s)
+    total = wall_s if wall_s is not None else sum(values)
+    return {
+        "n": len(values),
+        "throughput_per_s": round(len(values) / total, 2) if total > 0 else None,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else None,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+
+def measure(func: Callable, inputs: Sequence, warmup: int = 1) -> Dict:
+    """对每个输入调用一次 func，返回延迟统计"""
+    for item in inputs[:warmup]:
+        func(item)
+
+    latencies = []
+    started = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - started
+    return summarize(latencies, wall)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def environment() -> Dict:
+    return {
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def write_results(results: Dict, output: str = None):
+    """输出 JSON：写文件或打印到 stdout，便于不同提交之间对比"""
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Results written to {output}", file=sys.stderr)
+    else:
+        print(text)
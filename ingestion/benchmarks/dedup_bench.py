@@ -0,0 +1,135 @@
+"""
+近似重复检测基准：add_record 的延迟随单个患者历史记录数量的变化，以及检测效果
+
+- near_dup: 已有记录改一个词 / 插入脱敏占位符后再写入（应被识别为重复）
+- fresh:    新内容（应被写入）
+- clinical: 已有记录加上剂量或否定词后再写入（临床含义不同，应被写入）
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.dedup_bench --history 100,1000,5000 --writes 200 --output dedup.json
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import near_dup
+from benchmarks.common import environment, summarize, write_results
+from database import MedicalRecordsDatabase
+
+VOCABULARY = (
+    "headache fever cough nausea dizziness fatigue rash swelling pain chest back knee stomach throat "
+    "morning night evening daily weekly sharp dull mild severe constant intermittent left right upper "
+    "lower after before eating walking sleeping climbing stairs standing sitting lying medication pills "
+    "tablets ibuprofen aspirin metformin lisinopril insulin inhaler started stopped worse better same "
+    "since days weeks months ago twice once three four blurred vision shortness breath palpitations "
+    "numbness tingling itching vomiting diarrhea constipation appetite weight loss gain anxiety stress"
+).split()
+
+RECORD_TYPE = "Current Symptoms"
+
+
+def random_record(rng: random.Random) -> str:
+    return "Patient reports: " + " ".join(rng.sample(VOCABULARY, 10))
+
+
+def near_duplicate(rng: random.Random, content: str) -> str:
+    words = content.split()
+    if rng.random() < 0.5:
+        i = rng.randrange(2, len(words))
+        words[i] = rng.choice([w for w in VOCABULARY if w not in words])
+    else:
+        words.insert(rng.randrange(2, len(words) + 1), rng.choice(["[NAME]", "[DATE]"]))
+    return " ".join(words)
+
+
+def clinical_variant(rng: random.Random, content: str) -> str:
+    words = content.split()
+    i = rng.randrange(2, len(words))
+    if rng.random() < 0.5:
+        words.insert(i, rng.choice(["no", "denies", "without"]))
+    else:
+        words.insert(i, f"{rng.choice([5, 10, 250, 500, 1000])}mg")
+    return " ".join(words)
+
+
+def populate(medical_db: MedicalRecordsDatabase, patient_id: str, contents):
+    """直接批量写入历史记录（含分段索引），避免逐条提交"""
+    conn = sqlite3.connect(medical_db.shards.path_for(patient_id))
+    cursor = conn.cursor()
+    for content in contents:
+        cursor.execute(
+            'INSERT INTO medical_records (patient_id, record_type, content) VALUES (?, ?, ?)',
+            (patient_id, RECORD_TYPE, content),
+        )
+        medical_db._index_record(cursor, cursor.lastrowid, patient_id, RECORD_TYPE, content)
+    conn.commit()
+    conn.close()
+
+
+def timed_writes(medical_db, patient_id, contents):
+    latencies, actions = [], []
+    for content in contents:
+        t0 = time.perf_counter()
+        actions.append(medical_db.add_record(patient_id, RECORD_TYPE, content))
+        latencies.append(time.perf_counter() - t0)
+    return latencies, actions
+
+
+def run_one(history: int, writes: int, policy: str, seed: int) -> dict:
+    rng = random.Random(seed)
+    near_dup.DEDUP_POLICY = policy
+    workdir = tempfile.mkdtemp(prefix=f"ingestion-dedup{history}-")
+    medical_db = MedicalRecordsDatabase(os.path.join(workdir, "medical_records.db"), shards=1)
+    patient_id = "P00000001"
+    existing = [random_record(rng) for _ in range(history)]
+    populate(medical_db, patient_id, existing)
+
+    dup_latencies, dup_actions = timed_writes(
+        medical_db, patient_id, [near_duplicate(rng, rng.choice(existing)) for _ in range(writes)]
+    )
+    fresh_latencies, fresh_actions = timed_writes(
+        medical_db, patient_id, [random_record(rng) for _ in range(writes)]
+    )
+    # 每条变体来自不同的已有记录（同一记录的两个变体彼此可能就是重复）
+    variants = [clinical_variant(rng, content) for content in rng.sample(existing, min(writes, history))]
+    clinical_latencies, clinical_actions = timed_writes(medical_db, patient_id, variants)
+    return {
+        "near_dup": dict(summarize(dup_latencies), detected=round(1 - dup_actions.count("added") / writes, 4)),
+        "fresh": dict(summarize(fresh_latencies), false_positive=round(1 - fresh_actions.count("added") / writes, 4)),
+        "clinical": dict(summarize(clinical_latencies),
+                         false_positive=round(1 - clinical_actions.count("added") / len(variants), 4)),
+    }
+
+
+def run(args) -> dict:
+    results = {}
+    for policy in args.policies:
+        results[policy] = {str(h): run_one(h, args.writes, policy, args.seed) for h in args.history}
+    return {
+        "benchmark": "near_duplicate_detection",
+        "environment": environment(),
+        "params": {
+            "writes": args.writes,
+            "similarity": near_dup.DEDUP_SIMILARITY,
+            "layout": near_dup.layout_key(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="add_record latency vs. per-patient history with near-duplicate detection")
+    parser.add_argument("--history", type=lambda v: [int(x) for x in v.split(",")], default=[100, 1000, 5000])
+    parser.add_argument("--writes", type=int, default=200, help="near-duplicate and fresh writes per history size")
+    parser.add_argument("--policies", type=lambda v: v.split(","), default=["skip", "off"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+FastAPI 服务端到端压测（open-loop，可替换的假 ASR）
+
+按泊松到达率向 /upload-audio、/ingest、/patient/{id}/records 发请求，
+逐档提高到达率，报告每档的实际吞吐量、尾延迟和错误率。
+请求带 ?timings=true，同时汇总服务端各阶段耗时（transcribe / rag / ner_detect / redact ...），
+用来判断 ASR、NER 还是 SQLite 先饱和。
+
+用法（在 ingestion/ 目录下）:
+    # 进程内：在临时目录里起 uvicorn，转录替换为假实现
+    python -m benchmarks.load_test run --rates 1,2,4,8 --duration 20 --asr-latency 1.5
+
+    # 单独起一个带假 ASR 的本地服务，再从另一个终端压测
+    python -m benchmarks.load_test serve --port 8001 --asr-latency 1.5
+    python -m benchmarks.load_test run --url http://127.0.0.1:8001 \\
+        --identities /tmp/ingestion-load-xxx/identities.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from benchmarks.common import environment, summarize, write_results
+from benchmarks.synthetic import make_databases, make_segments, write_wav
+
+INGESTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeTranscriber:
+    """
+    transcribe_audio 的替身：返回合成片段
+
+    - latency: 每次调用的平均耗时（秒），jitter 为相对抖动
+    - mode: "sleep" 释放 GIL（模拟原生推理），"spin" 占用 CPU 和 GIL（最坏情况）
+    """
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.2, turns: int = 20,
+                 pii_density: float = 0.2, mode: str = "sleep", identities: List[Dict] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.turns = turns
+        self.pii_density = pii_density
+        self.mode = mode
+        self.identities = identities or []
+        self._rng = random.Random(0)
+        self._lock = threading.Lock()
+
+    def __call__(self, file_path: str, *args, **kwargs) -> List[Dict]:
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.latency, self.latency * self.jitter))
+            seed = self._rng.getrandbits(32)
+            identity = self._rng.choice(self.identities) if self.identities else None
+
+        if self.mode == "spin":
+            deadline = time.perf_counter() + delay
+            while time.perf_counter() < deadline:
+                pass
+        else:
+            time.sleep(delay)
+        return make_segments(self.turns, self.pii_density, seed=seed, identity=identity)
+
+
+def install_fake_asr(fake: FakeTranscriber):
+    """把录音流水线中使用的 transcribe_audio 替换为假实现（须在导入 main 之前调用）"""
+    # 假 ASR 下不需要加载和预热真实的 Whisper 模型（NER 后端仍会在启动时校验）
+    os.environ.setdefault("WARMUP_ON_STARTUP", "0")
+    import audio_pipeline
+    audio_pipeline.transcribe_audio = fake
+
+
+def prepare_workdir(patients: int, records_per_patient: int, seed: int = 0) -> (str, List[Dict]):
+    """在临时目录中生成数据库并切换工作目录，main 的默认数据库路径会指向这里"""
+    workdir = tempfile.mkdtemp(prefix="ingestion-load-")
+    _, _, identities = make_databases(workdir, patients, records_per_patient, seed=seed)
+    with open(os.path.join(workdir, "identities.json"), "w") as f:
+        json.dump(identities, f)
+    if INGESTION_DIR not in sys.path:
+        sys.path.insert(0, INGESTION_DIR)
+    os.chdir(workdir)
+    return workdir, identities
+
+
+def start_server(host: str, port: int):
+    """在后台线程中启动 uvicorn，返回 server 对象"""
+    import uvicorn
+    import main
+
+    config = uvicorn.Config(main.app, host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+    return server
+
+
+# ---------- 客户端 ----------
+
+class LoadGenerator:
+    def __init__(self, base_url: str, identities: List[Dict], mix: Dict[str, float],
+                 max_in_flight: int = 256, timeout: float = 120.0, seed: int = 0):
+        self.base_url = base_url.rstrip("/")
+        self.identities = identities
+        self.mix = mix
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self._local = threading.local()
+
+        path = write_wav(os.path.join(tempfile.gettempdir(), "load_test_upload.wav"), 0.5)
+        with open(path, "rb") as f:
+            self.audio = f.read()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _pick_endpoint(self) -> str:
+        total = sum(self.mix.values())
+        r = self.rng.random() * total
+        for name, weight in self.mix.items():
+            r -= weight
+            if r <= 0:
+                return name
+        return next(iter(self.mix))
+
+    def _request(self, endpoint: str, seed: int) -> Dict:
+        session = self._session()
+        started = time.perf_counter()
+        try:
+            if endpoint == "upload":
+                resp = session.post(
+                    f"{self.base_url}/upload-audio",
+                    params={"timings": "true"},
+                    files={"file": ("load_test.wav", self.audio, "audio/wav")},
+                    timeout=self.timeout,
+                )
+            elif endpoint == "ingest":
+                text = " ".join(seg["text"] for seg in make_segments(4, 0.5, seed=seed))
+                resp = session.post(
+                    f"{self.base_url}/ingest",
+                    params={"timings": "true"},
+                    json={"text": text},
+                    timeout=self.timeout,
+                )
+            else:
+                rng = random.Random(seed)
+                patient_id = rng.choice(self.identities)["patient_id"] if self.identities else f"P{seed:08X}"
+                resp = session.get(f"{self.base_url}/patient/{patient_id}/records", timeout=self.timeout)
+            latency = time.perf_counter() - started
+            ok = resp.status_code < 400
+            timings = None
+            if ok and endpoint != "records":
+                timings = resp.json().get("timings")
+            return {"endpoint": endpoint, "latency": latency, "ok": ok,
+                    "error": None if ok else f"HTTP {resp.status_code}", "timings": timings}
+        except Exception as e:
+            return {"endpoint": endpoint, "latency": time.perf_counter() - started, "ok": False,
+                    "error": type(e).__name__, "timings": None}
+
+    def run_rate(self, rate: float, duration: float) -> Dict:
+        """open-loop：按泊松过程发请求，不等待前一个请求完成"""
+        results = []
+        results_lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        dropped = 0
+
+        def done(future):
+            in_flight.release()
+            with results_lock:
+                results.append(future.result())
+
+        started = time.perf_counter()
+        next_arrival = started
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            while True:
+                next_arrival += self.rng.expovariate(rate)
+                if next_arrival - started > duration:
+                    break
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if not in_flight.acquire(blocking=False):
+                    # 客户端并发已满：记为丢弃，保持到达过程不受服务端速度影响
+                    dropped += 1
+                    continue
+                future = pool.submit(self._request, self._pick_endpoint(), self.rng.getrandbits(32))
+                future.add_done_callback(done)
+        wall = time.perf_counter() - started
+
+        return self._report(rate, wall, results, dropped)
+
+    @staticmethod
+    def _report(rate: float, wall: float, results: List[Dict], dropped: int) -> Dict:
+        report = {
+            "offered_rate_per_s": rate,
+            "wall_s": round(wall, 2),
+            "requests": len(results),
+            "dropped_client_side": dropped,
+            "endpoints": {},
+        }
+        for endpoint in sorted({r["endpoint"] for r in results}):
+            rows = [r for r in results if r["endpoint"] == endpoint]
+            ok_rows = [r for r in rows if r["ok"]]
+            stats = summarize([r["latency"] for r in ok_rows], wall) if ok_rows else {"n": 0}
+            stats["error_rate"] = round(1 - len(ok_rows) / len(rows), 4)
+            errors = {}
+            for r in rows:
+                if r["error"]:
+                    errors[r["error"]] = errors.get(r["error"], 0) + 1
+            if errors:
+                stats["errors"] = errors
+
+            # 服务端阶段耗时中位数（只看顶层 span）
+            stages = {}
+            for r in ok_rows:
+                for span in (r["timings"] or {}).get("spans", []):
+                    stages.setdefault(span["name"], []).append(span["duration_ms"])
+            if stages:
+                stats["server_stage_p50_ms"] = {k: round(statistics.median(v), 2) for k, v in stages.items()}
+            report["endpoints"][endpoint] = stats
+        return report
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("upload", "ingest", "records"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def cmd_serve(args):
+    workdir, identities = prepare_workdir(args.patients, args.records_per_patient, args.seed)
+    install_fake_asr(FakeTranscriber(args.asr_latency, args.asr_jitter, args.turns,
+                                     mode=args.asr_mode, identities=identities))
+    print(f"Workdir: {workdir}")
+    print(f"Identities: {os.path.join(workdir, 'identities.json')}")
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
+
+
+def cmd_run(args):
+    server = None
+    if args.url:
+        base_url = args.url
+        identities = []
+        if args.identities:
+            with open(args.identities) as f:
+                identities = json.load(f)
+    else:
+        workdir, identities = prepare_workdir(args.patients, args.records_per_patient, args.seed)
+        install_fake_asr(FakeTranscriber(args.asr_latency, args.asr_jitter, args.turns,
+                                         mode=args.asr_mode, identities=identities))
+        server = start_server(args.host, args.port)
+        base_url = f"http://{args.host}:{args.port}"
+
+    generator = LoadGenerator(base_url, identities, args.mix, args.max_in_flight, seed=args.seed)
+    steps = []
+    try:
+        for rate in args.rates:
+            print(f"Running {rate}/s for {args.duration}s ...", flush=True)
+            steps.append(generator.run_rate(rate, args.duration))
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+    write_results({
+        "benchmark": "load_test",
+        "environment": environment(),
+        "params": {
+            "target": args.url or "in-process",
+            "mix": args.mix,
+            "duration_s": args.duration,
+            "asr_latency_s": args.asr_latency,
+            "asr_mode": args.asr_mode,
+            "turns": args.turns,
+        },
+        "steps": steps,
+    }, args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test for the ingestion API with a fake ASR backend")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--host", default="127.0.0.1")
+        p.add_argument("--port", type=int, default=8001)
+        p.add_argument("--patients", type=int, default=1000)
+        p.add_argument("--records-per-patient", type=int, default=6)
+        p.add_argument("--asr-latency", type=float, default=1.0, help="fake transcribe_audio latency in seconds")
+        p.add_argument("--asr-jitter", type=float, default=0.2)
+        p.add_argument("--asr-mode", choices=["sleep", "spin"], default="sleep")
+        p.add_argument("--turns", type=int, default=20, help="segments returned by the fake ASR")
+        p.add_argument("--seed", type=int, default=0)
+
+    serve = sub.add_parser("serve", help="start a local uvicorn with the fake ASR installed")
+    common(serve)
+    serve.set_defaults(func=cmd_serve)
+
+    run = sub.add_parser("run", help="drive load in-process or against --url")
+    common(run)
+    run.add_argument("--url", help="target an already running server instead of starting one in-process")
+    run.add_argument("--identities", help="identities.json written by 'serve' (for /patient/{id}/records)")
+    run.add_argument("--rates", type=lambda v: [float(x) for x in v.split(",")], default=[1, 2, 4, 8],
+                     help="comma separated arrival rates (requests/s) to step through")
+    run.add_argument("--duration", type=float, default=20, help="seconds per rate step")
+    run.add_argument("--mix", type=parse_mix, default=parse_mix("upload=1,ingest=2,records=4"))
+    run.add_argument("--max-in-flight", type=int, default=256)
+    run.add_argument("--output")
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+NER 前置过滤评估：在标注样本上统计漏检率（有人名却被跳过）、跳过率和单次判断耗时
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.name_gate_eval
+    python -m benchmarks.name_gate_eval --data my_labelled.jsonl --output gate.json
+
+样本格式（JSONL）: {"text": "...", "names": ["John Smith"]}，names 为空表示不含人名
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import environment, write_results
+from name_gate import GATE_VERSION, might_contain_name
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "pii_labelled.jsonl")
+
+
+def load_samples(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(args) -> dict:
+    samples = load_samples(args.data)
+
+    with_names = [s for s in samples if s["names"]]
+    without_names = [s for s in samples if not s["names"]]
+    missed = [s["text"] for s in with_names if not might_contain_name(s["text"])]
+    skipped_clean = sum(1 for s in without_names if not might_contain_name(s["text"]))
+    skipped_total = len(missed) + skipped_clean
+
+    # 单次判断耗时（整个样本集重复多轮取平均）
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for s in samples:
+            might_contain_name(s["text"])
+    per_call_us = (time.perf_counter() - started) / (args.rounds * len(samples)) * 1e6
+
+    return {
+        "benchmark": "name_gate",
+        "environment": environment(),
+        "params": {"data": os.path.basename(args.data), "samples": len(samples), "gate_version": GATE_VERSION},
+        "results": {
+            "false_negative_rate": round(len(missed) / len(with_names), 4) if with_names else None,
+            "skip_rate": round(skipped_total / len(samples), 4) if samples else None,
+            "clean_skip_rate": round(skipped_clean / len(without_names), 4) if without_names else None,
+            "per_call_us": round(per_call_us, 2),
+            "missed": missed,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="False-negative rate and cost of the NER name gate")
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
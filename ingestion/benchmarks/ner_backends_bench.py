@@ -0,0 +1,101 @@
+"""
+NER 后端对比：各后端在标注 PII 样本上的吞吐、延迟和人名召回率
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.ner_backends_bench
+    python -m benchmarks.ner_backends_bench --backends gazetteer,onnx --runs 5 --output ner.json
+
+ONNX 后端读取 ONNX_NER_MODEL_DIR（见 ner_backends.py）；无法加载的后端记录错误后跳过。
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import environment, summarize, write_results
+from benchmarks.name_gate_eval import DEFAULT_DATA, load_samples
+from ner_backends import BACKENDS, backend_config_version, create_backend
+
+
+def name_found(text: str, name: str, spans) -> bool:
+    """标注的人名与任一预测区间重叠即算召回"""
+    start = text.lower().find(name.lower())
+    if start < 0:
+        return False
+    end = start + len(name)
+    return any(s < end and start < e for s, e in spans)
+
+
+def evaluate(backend, samples, runs: int) -> dict:
+    load_started = time.perf_counter()
+    backend.load()
+    load_seconds = time.perf_counter() - load_started
+
+    texts = [s["text"] for s in samples]
+    for text in texts[:5]:
+        backend.person_spans(text)
+
+    latencies = []
+    predictions = []
+    started = time.perf_counter()
+    for run_index in range(runs):
+        for text in texts:
+            t0 = time.perf_counter()
+            spans = backend.person_spans(text)
+            latencies.append(time.perf_counter() - t0)
+            if run_index == 0:
+                predictions.append(spans)
+    wall = time.perf_counter() - started
+
+    names_total = names_found = 0
+    clean_total = clean_flagged = 0
+    missed = []
+    for sample, spans in zip(samples, predictions):
+        if sample["names"]:
+            for name in sample["names"]:
+                names_total += 1
+                if name_found(sample["text"], name, spans):
+                    names_found += 1
+                else:
+                    missed.append(name)
+        else:
+            clean_total += 1
+            clean_flagged += bool(spans)
+
+    stats = summarize(latencies, wall)
+    stats["model_load_seconds"] = round(load_seconds, 3)
+    stats["recall"] = round(names_found / names_total, 4) if names_total else None
+    stats["false_positive_rate"] = round(clean_flagged / clean_total, 4) if clean_total else None
+    stats["missed"] = missed
+    return stats
+
+
+def run(args) -> dict:
+    samples = load_samples(args.data)
+    results = {}
+    for name in args.backends:
+        try:
+            results[name] = evaluate(create_backend(name), samples, args.runs)
+            results[name]["config"] = backend_config_version(name)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    return {
+        "benchmark": "ner_backends",
+        "environment": environment(),
+        "params": {"data": os.path.basename(args.data), "samples": len(samples), "runs": args.runs},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput, latency and recall of each NER backend")
+    parser.add_argument("--backends", type=lambda v: v.split(","), default=sorted(BACKENDS))
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+容错患者匹配基准：在大规模患者表上测量盲索引模糊匹配的延迟和准确率
+
+- asr_name:   已有患者，姓名带 ASR 式拼写错误（"John Smith" → "Jon Smyth"），附 DOB 或 SSN
+- new_patient: 不存在的患者（应无候选）
+- exact:      同样的错拼姓名走原来的精确哈希匹配，作为召回率对照
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.patient_match_bench --patients 1000000 --queries 1000 --output match.json
+"""
+import argparse
+import random
+import re
+import tempfile
+import time
+
+import patient_match
+from benchmarks.common import environment, summarize, write_results
+from benchmarks.synthetic import make_databases, random_identity
+
+# ASR 常见的同音/近音拼写替换
+SUBSTITUTIONS = [
+    ("ph", "f"), ("th", "t"), ("oh", "o"), ("y", "i"), ("i", "y"), ("c", "k"), ("k", "c"),
+    ("son", "sen"), ("ck", "k"), ("ae", "e"), ("ie", "y"), ("ll", "l"), ("tt", "t"), ("rr", "r"),
+    ("ee", "ea"), ("er", "a"), ("s", "z"),
+]
+
+
+def asr_misspell(rng: random.Random, name: str) -> str:
+    """对每个姓名词尽量做一处拼写替换（不改首字母）"""
+    words = []
+    for word in name.split():
+        options = [(a, b) for a, b in SUBSTITUTIONS if a in word[1:].lower()]
+        if options:
+            a, b = rng.choice(options)
+            head, tail = word[0], word[1:]
+            word = head + re.sub(a, b, tail, count=1, flags=re.IGNORECASE)
+        words.append(word)
+    return " ".join(words)
+
+
+def timed(func, inputs):
+    latencies, outputs = [], []
+    for item in inputs:
+        t0 = time.perf_counter()
+        outputs.append(func(item))
+        latencies.append(time.perf_counter() - t0)
+    return latencies, outputs
+
+
+def run(args) -> dict:
+    # 与 make_databases 使用不同的随机序列，否则"新患者"会与已有身份重合
+    rng = random.Random(f"queries-{args.seed}")
+    workdir = tempfile.mkdtemp(prefix="ingestion-match-")
+    t0 = time.perf_counter()
+    patient_db, _, identities = make_databases(workdir, args.patients, 0, seed=args.seed)
+    build_seconds = time.perf_counter() - t0
+
+    queries = []
+    for _ in range(args.queries):
+        identity = rng.choice(identities)
+        corroboration = rng.choice(["dob", "ssn"])
+        queries.append((identity, asr_misspell(rng, identity["name"]), corroboration))
+    changed = sum(1 for identity, name, _ in queries if name != identity["name"])
+
+    def fuzzy(query):
+        identity, name, corroboration = query
+        return patient_db.find_patient_candidates(name, **{corroboration: identity[corroboration]})
+
+    def exact(query):
+        identity, name, corroboration = query
+        return patient_db.find_patient(name=name, **{corroboration: identity[corroboration]})
+
+    fuzzy_latencies, candidates = timed(fuzzy, queries)
+    top1 = sum(1 for (identity, _, _), c in zip(queries, candidates) if c and c[0]["patient_id"] == identity["patient_id"])
+
+    strangers = [random_identity(rng) for _ in range(args.queries)]
+    new_latencies, new_candidates = timed(
+        lambda ident: patient_db.find_patient_candidates(asr_misspell(rng, ident["name"]), dob=ident["dob"]),
+        strangers,
+    )
+
+    # 原精确匹配路径的召回率（关闭模糊匹配）
+    patient_match.FUZZY_MATCH_ENABLED = False
+    exact_latencies, exact_ids = timed(exact, queries)
+    patient_match.FUZZY_MATCH_ENABLED = True
+    exact_hits = sum(1 for (identity, _, _), pid in zip(queries, exact_ids) if pid == identity["patient_id"])
+
+    return {
+        "benchmark": "patient_fuzzy_match",
+        "environment": environment(),
+        "params": {
+            "patients": args.patients,
+            "queries": args.queries,
+            "misspelled_queries": changed,
+            "min_score": patient_match.FUZZY_MIN_SCORE,
+            "build_seconds": round(build_seconds, 1),
+            "workdir": workdir,
+        },
+        "results": {
+            "asr_name": dict(summarize(fuzzy_latencies), recall_at_1=round(top1 / len(queries), 4)),
+            "new_patient": dict(
+                summarize(new_latencies),
+                false_match_rate=round(sum(1 for c in new_candidates if c) / len(strangers), 4),
+            ),
+            "exact": dict(summarize(exact_latencies), recall=round(exact_hits / len(queries), 4)),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzzy patient matching latency and accuracy on a large patient table")
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
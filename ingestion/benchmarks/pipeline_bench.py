@@ -0,0 +1,104 @@
+"""
+摄取流水线基准测试
+
+用合成转录和合成数据库测量各阶段的吞吐量与 p50/p99 延迟，
+结果以 JSON 输出，便于在不同提交之间对比。
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.pipeline_bench --turns 40 --pii-density 0.2 \\
+        --patients 5000 --records-per-patient 8 --output bench.json
+    python -m benchmarks.pipeline_bench --asr-seconds 30   # 额外测 transcribe_audio
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from asr.diarize import assign_speakers
+from benchmarks.common import environment, measure, write_results
+from benchmarks.synthetic import make_databases, make_segments, write_wav
+from pii import redact_pii
+from pii_ner import ner_detect_pii
+from rag_system import RAGSystem
+from segments import Segment
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="ingestion-bench-")
+    patient_db, medical_db, identities = make_databases(
+        workdir, args.patients, args.records_per_patient, seed=args.seed
+    )
+    rag = RAGSystem(patient_db=patient_db, medical_db=medical_db)
+
+    # 一半对话来自已有患者，一半来自新患者
+    conversations = []
+    for i in range(args.iterations):
+        identity = rng.choice(identities) if identities and i % 2 == 0 else None
+        conversations.append(make_segments(args.turns, args.pii_density, seed=args.seed + i, identity=identity))
+    # 与 main.upload_audio 一致：说话人识别后的结构化片段
+    transcripts = [[Segment.from_dict(seg) for seg in assign_speakers(segs)] for segs in conversations]
+    segment_texts = [seg["text"] for segs in conversations for seg in segs]
+
+    lookups = [rng.choice(identities) for _ in range(args.iterations)] if identities else []
+
+    results = {}
+    results["redact_pii"] = measure(lambda text: redact_pii(text, allowed_types=["NAME"]), segment_texts)
+    results["ner_detect_pii"] = measure(ner_detect_pii, segment_texts)
+    results["assign_speakers"] = measure(assign_speakers, conversations)
+    results["extract_patient_info"] = measure(rag.extract_patient_info, transcripts)
+    if lookups:
+        results["find_patient"] = measure(
+            lambda ident: patient_db.find_patient(name=ident["name"], ssn=ident["ssn"], dob=ident["dob"]),
+            lookups,
+        )
+        results["get_patient_records"] = measure(
+            lambda ident: medical_db.get_patient_records(ident["patient_id"]),
+            lookups,
+        )
+    results["process_conversation"] = measure(rag.process_conversation, transcripts, warmup=0)
+
+    if args.asr_seconds:
+        from asr.transcribe import transcribe_audio
+
+        wav_path = write_wav(os.path.join(workdir, "synthetic.wav"), args.asr_seconds, seed=args.seed)
+        asr = measure(transcribe_audio, [wav_path] * args.asr_runs)
+        asr["audio_seconds"] = args.asr_seconds
+        asr["real_time_factor"] = round(asr["mean_ms"] / 1000 / args.asr_seconds, 4)
+        results["transcribe_audio"] = asr
+
+    return {
+        "benchmark": "ingestion_pipeline",
+        "environment": environment(),
+        "params": {
+            "turns": args.turns,
+            "pii_density": args.pii_density,
+            "patients": args.patients,
+            "records_per_patient": args.records_per_patient,
+            "iterations": args.iterations,
+            "segments": len(segment_texts),
+            "seed": args.seed,
+            "workdir": workdir,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline on synthetic data")
+    parser.add_argument("--turns", type=int, default=30, help="segments per synthetic conversation")
+    parser.add_argument("--pii-density", type=float, default=0.2, help="probability of PII in a patient turn")
+    parser.add_argument("--patients", type=int, default=1000, help="synthetic patients in patients.db")
+    parser.add_argument("--records-per-patient", type=int, default=6)
+    parser.add_argument("--iterations", type=int, default=50, help="conversations / lookups per benchmark")
+    parser.add_argument("--asr-seconds", type=float, default=0, help="also benchmark transcribe_audio on synthetic audio")
+    parser.add_argument("--asr-runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+分片写入基准：并发写入病历（add_record + add_conversation）的吞吐随分片数的变化
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.shard_write_bench --shards 1,2,4,8 --threads 8 --writes 400
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import environment, summarize, write_results
+from benchmarks.synthetic import PATIENT_LINES, RECORD_TEMPLATES
+from database import MedicalRecordsDatabase
+
+
+def run_one(shards: int, threads: int, writes: int, patients: int, seed: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"ingestion-shards{shards}-")
+    medical_db = MedicalRecordsDatabase(os.path.join(workdir, "medical_records.db"), shards=shards)
+    patient_ids = [f"P{i:08X}" for i in range(patients)]
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index: int):
+        rng = random.Random(seed + index)
+        local = []
+        for n in range(writes):
+            patient_id = rng.choice(patient_ids)
+            record_type, content = RECORD_TEMPLATES[n % len(RECORD_TEMPLATES)]
+            t0 = time.perf_counter()
+            try:
+                medical_db.add_record(patient_id, record_type, f"{content} ({index}-{n})")
+                medical_db.add_conversation(patient_id, f"Patient: {rng.choice(PATIENT_LINES)}")
+            except Exception as e:  # sqlite3.OperationalError: database is locked
+                errors.append(str(e))
+                continue
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - started
+
+    stats = summarize(latencies, wall)
+    stats["errors"] = len(errors)
+    stats["workdir"] = workdir
+    return stats
+
+
+def run(args) -> dict:
+    results = {}
+    for shards in args.shards:
+        results[str(shards)] = run_one(shards, args.threads, args.writes, args.patients, args.seed)
+    return {
+        "benchmark": "shard_writes",
+        "environment": environment(),
+        "params": {"threads": args.threads, "writes_per_thread": args.writes, "patients": args.patients},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent write throughput vs. number of SQLite shards")
+    parser.add_argument("--shards", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=200, help="writes per thread")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
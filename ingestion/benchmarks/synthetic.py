@@ -0,0 +1,226 @@
+# 合成数据生成：医患对话转录、患者/病历数据库、测试音频
+import math
+import os
+import random
+import struct
+import wave
+from typing import Dict, List, Tuple
+
+import patient_match
+from database import MedicalRecordsDatabase, PatientDatabase
+
+FIRST_NAMES = [
+    "John", "Mary", "Jack", "Linda", "James", "Patricia", "Robert", "Jennifer",
+    "Michael", "Elizabeth", "David", "Susan", "William", "Jessica", "Richard", "Sarah",
+    "Joseph", "Karen", "Thomas", "Nancy", "Daniel", "Emily", "Matthew", "Olivia",
+]
+
+LAST_NAMES = [
+    "Smith", "Johnson", "Stewart", "Williams", "Brown", "Jones", "Garcia", "Miller",
+    "Davis", "Rodriguez", "Martinez", "Wilson", "Anderson", "Taylor", "Thomas", "Moore",
+    "Jackson", "Martin", "Lee", "Thompson", "White", "Harris", "Clark", "Lewis",
+]
+
+DOCTOR_LINES = [
+    "Hi, what can I help you?",
+    "Okay, what's the detail for that?",
+    "How long have you had these symptoms?",
+    "Let me take a look.",
+    "Are you taking any medication right now?",
+    "Do you have any allergies?",
+    "I recommend you rest and drink plenty of water.",
+    "The diagnosis looks like a mild viral infection.",
+    "Any history of heart disease in your family?",
+    "Okay.",
+]
+
+PATIENT_LINES = [
+    "I have a headache and I feel tired all the time.",
+    "It started about three days ago.",
+    "My stomach hurts after eating.",
+    "I'm taking some pills for my blood pressure.",
+    "I feel dizzy when I stand up.",
+    "No, not really.",
+    "It hurts here.",
+    "I have a cough and a little fever.",
+    "I'm allergic to penicillin.",
+    "Okay, thank you.",
+]
+
+RECORD_TEMPLATES = [
+    ("Medical History", "Patient has a history of hypertension. Currently on Metformin 500mg twice daily."),
+    ("Previous Visit", "Blood pressure 140/90, HbA1c 7.2%. Recommended diet modification."),
+    ("Allergies", "Allergic to Penicillin - causes rash and swelling."),
+    ("Current Symptoms", "Patient reports: I have a headache and I feel tired."),
+    ("Current Medications", "Patient mentioned: I'm taking some pills for my blood pressure."),
+    ("Doctor Notes", "Doctor noted: I recommend you rest and drink plenty of water."),
+]
+
+
+def random_identity(rng: random.Random) -> Dict[str, str]:
+    return {
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "ssn": f"{rng.randint(100, 899):03d}-{rng.randint(10, 99):02d}-{rng.randint(1000, 9999):04d}",
+        "dob": f"{rng.randint(1940, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+    }
+
+
+def _pii_line(rng: random.Random, identity: Dict[str, str]) -> str:
+    kind = rng.choice(["name", "dob", "ssn", "other_name"])
+    if kind == "name":
+        return f"My name is {identity['name']}."
+    if kind == "dob":
+        return f"I was born on {identity['dob']}."
+    if kind == "ssn":
+        return f"My SSN is {identity['ssn']}."
+    return f"Dr. {rng.choice(LAST_NAMES)} told me to come back."
+
+
+def make_segments(
+    turns: int,
+    pii_density: float = 0.2,
+    seed: int = 0,
+    identity: Dict[str, str] = None,
+) -> List[Dict]:
+    """
+    生成 Whisper 风格的转录片段（start / end / text）
+
+    - turns: 片段数量（医患交替）
+    - pii_density: 患者发言中包含姓名/DOB/SSN 的概率
+    - identity: 指定患者身份；默认随机生成
+    """
+    rng = random.Random(seed)
+    identity = identity or random_identity(rng)
+
+    segments = []
+    clock = 0.0
+    for i in range(turns):
+        if i % 2 == 0:
+            text = DOCTOR_LINES[0] if i == 0 else rng.choice(DOCTOR_LINES)
+        elif i == 1 and pii_density > 0:
+            # 第一句患者发言带自我介绍，便于患者识别
+            text = f"Hi, Dr. I'm {identity['name']}. {rng.choice(PATIENT_LINES)}"
+        elif rng.random() < pii_density:
+            text = _pii_line(rng, identity)
+        else:
+            text = rng.choice(PATIENT_LINES)
+
+        duration = 0.4 + 0.06 * len(text.split())
+        segments.append({
+            "start": round(clock, 2),
+            "end": round(clock + duration, 2),
+            "text": text,
+        })
+        clock += duration + 0.3
+    return segments
+
+
+def make_transcript(turns: int, pii_density: float = 0.2, seed: int = 0, identity: Dict[str, str] = None) -> str:
+    """纯文本转录：片段文本用空格拼接（不带说话人）"""
+    return " ".join(seg["text"] for seg in make_segments(turns, pii_density, seed, identity))
+
+
+BULK_CHUNK = 50_000
+
+
+def _bulk_insert(shards, sql: str, rows: List[tuple]):
+    """rows 的第一列是 patient_id"""
+    by_shard: Dict[int, List[tuple]] = {}
+    for row in rows:
+        by_shard.setdefault(shards.index_for(row[0]), []).append(row)
+    for index, shard_rows in by_shard.items():
+        conn = shards.connect_index(index)
+        conn.executemany(sql, shard_rows)
+        conn.commit()
+        conn.close()
+
+
+def make_databases(
+    directory: str,
+    patients: int,
+    records_per_patient: int,
+    seed: int = 0,
+) -> Tuple[PatientDatabase, MedicalRecordsDatabase, List[Dict[str, str]]]:
+    """在 directory 下生成合成的 patients.db / medical_records.db，返回数据库对象和患者身份列表"""
+    rng = random.Random(seed)
+    patient_db = PatientDatabase(os.path.join(directory, "patients.db"))
+    medical_db = MedicalRecordsDatabase(os.path.join(directory, "medical_records.db"))
+
+    identities = []
+    patient_rows = []
+    name_index_rows = []
+    record_rows = []
+
+    def flush():
+        # 直接批量写入（按分片路由），避免逐条 add_record 的建库开销
+        _bulk_insert(
+            patient_db.shards,
+            "INSERT OR REPLACE INTO patients (patient_id, name_hash, ssn_hash, dob_hash) VALUES (?, ?, ?, ?)",
+            patient_rows,
+        )
+        _bulk_insert(
+            patient_db.shards,
+            "INSERT OR IGNORE INTO patient_name_index (patient_id, key, features) VALUES (?, ?, ?)",
+            name_index_rows,
+        )
+        _bulk_insert(
+            medical_db.shards,
+            "INSERT INTO medical_records (patient_id, record_type, content, metadata) VALUES (?, ?, ?, ?)",
+            record_rows,
+        )
+        patient_rows.clear()
+        name_index_rows.clear()
+        record_rows.clear()
+
+    for n in range(patients):
+        identity = random_identity(rng)
+        patient_id = f"P{rng.getrandbits(32):08X}"
+        identity["patient_id"] = patient_id
+        identities.append(identity)
+        patient_rows.append((
+            patient_id,
+            patient_db.hash_pii(identity["name"]),
+            patient_db.hash_pii(identity["ssn"]),
+            patient_db.hash_pii(identity["dob"]),
+        ))
+        features = len(patient_match.name_features(identity["name"]))
+        name_index_rows.extend(
+            (patient_id, key, features)
+            for key in patient_match.blind_keys(identity["name"], identity["ssn"], identity["dob"])
+        )
+        for j in range(records_per_patient):
+            record_type, content = RECORD_TEMPLATES[j % len(RECORD_TEMPLATES)]
+            record_rows.append((patient_id, record_type, f"{content} (#{j})", '{"source": "synthetic"}'))
+        # 分批写入，百万级患者时内存不随规模增长
+        if (n + 1) % BULK_CHUNK == 0:
+            flush()
+    flush()
+
+    return patient_db, medical_db, identities
+
+
+def write_wav(path: str, seconds: float, sample_rate: int = 16000, seed: int = 0) -> str:
+    """
+    生成 16-bit 单声道 WAV：语音频段的调幅音调 + 静音间隔
+    仅用于 ASR 吞吐/延迟测试，内容不可识别
+    """
+    rng = random.Random(seed)
+    frames = bytearray()
+    total = int(seconds * sample_rate)
+    freq = 220.0
+    for n in range(total):
+        t = n / sample_rate
+        if n % sample_rate == 0:
+            freq = rng.uniform(150, 400)
+        # 每 2 秒中 1.5 秒有声，0.5 秒静音
+        voiced = (t % 2.0) < 1.5
+        amp = 0.3 * (0.6 + 0.4 * math.sin(2 * math.pi * 3 * t)) if voiced else 0.0
+        sample = int(32767 * amp * math.sin(2 * math.pi * freq * t))
+        frames += struct.pack("<h", sample)
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return path
@@ -0,0 +1,94 @@
+"""
+写后缓冲基准：响应路径上的写入延迟（save_medical_info + add_conversation），同步写库 vs 写后缓冲
+
+- sync:         原来的路径，每次提交都等 SQLite fsync
+- write_behind: 只追加本地日志（fsync 一次），后台批量落库；另外报告全部落库所需时间
+
+用法（在 ingestion/ 目录下）:
+    python -m benchmarks.write_behind_bench --threads 4 --writes 200 --output wb.json
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import environment, summarize, write_results
+from benchmarks.synthetic import PATIENT_LINES, RECORD_TEMPLATES
+from database import MedicalRecordsDatabase, PatientDatabase
+from rag_system import RAGSystem
+from write_behind import WriteBehindQueue
+
+
+def run_one(mode: str, threads: int, writes: int, patients: int, fsync: bool, seed: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"ingestion-{mode}-")
+    medical_db = MedicalRecordsDatabase(os.path.join(workdir, "medical_records.db"))
+    rag = RAGSystem(PatientDatabase(os.path.join(workdir, "patients.db")), medical_db)
+    if mode == "write_behind":
+        rag.write_behind = WriteBehindQueue(medical_db, os.path.join(workdir, "wal"),
+                                            on_flushed=rag._invalidate_patients, fsync=fsync)
+    patient_ids = [f"P{i:08X}" for i in range(patients)]
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index: int):
+        rng = random.Random(seed + index)
+        local = []
+        for n in range(writes):
+            patient_id = rng.choice(patient_ids)
+            record_type, content = RECORD_TEMPLATES[n % len(RECORD_TEMPLATES)]
+            info = [{"type": record_type, "content": f"{content} ({index}-{n})",
+                     "source": "audio_conversation", "date": "2024/01/01"}]
+            t0 = time.perf_counter()
+            rag.save_medical_info(patient_id, info)
+            rag.add_conversation(patient_id, f"Patient: {rng.choice(PATIENT_LINES)}")
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - started
+
+    stats = summarize(latencies, wall)
+    if rag.write_behind is not None:
+        rag.write_behind.close()
+        stats["durable_seconds"] = round(time.perf_counter() - started, 3)
+        stats["flushes"] = rag.write_behind.stats()["flushes"]
+    stats["workdir"] = workdir
+    return stats
+
+
+def run(args) -> dict:
+    return {
+        "benchmark": "write_behind",
+        "environment": environment(),
+        "params": {"threads": args.threads, "writes_per_thread": args.writes, "patients": args.patients,
+                   "log_fsync": not args.no_fsync},
+        "results": {
+            mode: run_one(mode, args.threads, args.writes, args.patients, not args.no_fsync, args.seed)
+            for mode in ("sync", "write_behind")
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response-path write latency: synchronous SQLite vs write-behind log")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--writes", type=int, default=200, help="writes per thread")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--no-fsync", action="store_true", help="do not fsync the write-behind log")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    write_results(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# 转录文本压缩
+#
+# 对话转录写入时压缩，只在读取转录内容时解压。优先使用 zstd（需要 zstandard 包），
+# 不可用时退回标准库 zlib。每条数据都记录自己的 codec，两种格式可以混存。
+import os
+import zlib
+from typing import Tuple
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+TRANSCRIPT_CODEC = os.getenv("TRANSCRIPT_CODEC", "zstd").lower()
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "6"))
+ZLIB_LEVEL = int(os.getenv("ZLIB_LEVEL", "6"))
+
+CODECS = ("zstd", "zlib", "none")
+
+
+def default_codec() -> str:
+    if TRANSCRIPT_CODEC == "zstd" and zstandard is None:
+        return "zlib"
+    return TRANSCRIPT_CODEC if TRANSCRIPT_CODEC in CODECS else "zlib"
+
+
+def compress(data: bytes, codec: str = None) -> Tuple[str, bytes]:
+    """返回 (codec, 压缩后的数据)"""
+    codec = codec or default_codec()
+    if codec == "zstd":
+        return codec, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == "zlib":
+        return codec, zlib.compress(data, ZLIB_LEVEL)
+    return "none", data
+
+
+def decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed data requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    return bytes(blob)
+
+
+def compress_text(text: str, codec: str = None) -> Tuple[str, bytes]:
+    return compress(text.encode("utf-8"), codec)
+
+
+def decompress_text(codec: str, blob: bytes) -> str:
+    return decompress(codec, blob).decode("utf-8")
@@ -4,17 +4,54 @@ import json
 from typing import Dict, List, Optional, Tuple
 import hashlib
 from datetime import datetime
+from tracing import traced
+from sharding import ShardSet
+from compression import compress_text, decompress_text
+from archive import ARCHIVE_DIR, read_archived_conversation
+import near_dup
+import patient_match
+
+def decode_transcript(transcript: str, blob: bytes, codec: str) -> str:
+    """对话转录：新数据压缩存在 transcript_blob，旧数据是 transcript 明文"""
+    if blob is not None:
+        return decompress_text(codec, blob)
+    return transcript
+
+
+# 记录类型 → 前端显示的分类（patient_summary 按分类计数）
+RECORD_CATEGORIES = {
+    'Medical History': 'history',
+    'Previous Visit': 'visit',
+    'Allergies': 'allergy',
+    'Medications': 'medication',
+    'Lab Results': 'lab',
+    'Diagnosis': 'diagnosis'
+}
+SUMMARY_CATEGORIES = list(RECORD_CATEGORIES.values()) + ['other']
+SYMPTOMS_RECORD_TYPE = 'Current Symptoms'
+VISIT_RECORD_TYPE = 'Previous Visit'
+
+
+def categorize_record(record_type: str) -> str:
+    """将记录类型分类"""
+    return RECORD_CATEGORIES.get(record_type, 'other')
+
 
 class PatientDatabase:
     """患者身份信息数据库"""
     
-    def __init__(self, db_path: str = "patients.db"):
+    def __init__(self, db_path: str = "patients.db", shards: int = None):
         self.db_path = db_path
+        # 按 patient_id 分片（DB_SHARDS=1 时就是 db_path 本身）
+        self.shards = ShardSet(db_path, shards)
         self.init_database()
     
     def init_database(self):
         """初始化数据库表 - 只存储患者身份信息"""
-        conn = sqlite3.connect(self.db_path)
+        for path in self.shards.paths:
+            self._init_shard(sqlite3.connect(path))
+    
+    def _init_shard(self, conn: sqlite3.Connection):
         cursor = conn.cursor()
         
         # 患者身份信息表
@@ -28,35 +65,76 @@ class PatientDatabase:
             )
         ''')
         
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_name_hash ON patients(name_hash)')
+        
+        # 姓名盲索引 - HMAC(佐证标识 + 姓名发音特征)，不含明文（见 patient_match.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS patient_name_index (
+                key INTEGER NOT NULL,
+                patient_id TEXT NOT NULL,
+                features INTEGER NOT NULL,
+                PRIMARY KEY (key, patient_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_patient_name_index_patient ON patient_name_index(patient_id)')
+        # 建索引所用密钥的指纹；与当前密钥不一致（或未设置密钥）时旧索引作废
+        cursor.execute('CREATE TABLE IF NOT EXISTS patient_name_index_key (fingerprint TEXT PRIMARY KEY)')
+        fingerprint = patient_match.key_fingerprint()
+        stored = {row[0] for row in cursor.execute('SELECT fingerprint FROM patient_name_index_key')}
+        if stored != ({fingerprint} if fingerprint else set()):
+            cursor.execute('DELETE FROM patient_name_index')
+            cursor.execute('DELETE FROM patient_name_index_key')
+            if fingerprint:
+                cursor.execute('INSERT INTO patient_name_index_key (fingerprint) VALUES (?)', (fingerprint,))
+        
         conn.commit()
         conn.close()
     
+    def _index_name(self, cursor, patient_id: str, name: str, ssn: str = None, dob: str = None):
+        """写入患者的姓名盲索引（已存在的键忽略）"""
+        features = len(patient_match.name_features(name))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO patient_name_index (key, patient_id, features) VALUES (?, ?, ?)
+        ''', [(key, patient_id, features) for key in patient_match.blind_keys(name, ssn, dob)])
+    
+    def _ensure_name_indexed(self, patient_id: str, name: str, ssn: str = None, dob: str = None):
+        """建索引之前创建的患者：精确匹配成功时用本次的明文补建索引"""
+        if not patient_match.PATIENT_INDEX_KEY:
+            return
+        conn = self.shards.connect(patient_id)
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM patient_name_index WHERE patient_id = ? LIMIT 1', (patient_id,))
+        if cursor.fetchone() is None:
+            self._index_name(cursor, patient_id, name, ssn, dob)
+            conn.commit()
+        conn.close()
+    
     def hash_pii(self, value: str) -> str:
         """对PII信息进行哈希处理"""
         return hashlib.sha256(value.lower().strip().encode()).hexdigest()
     
+    @traced("db.add_patient")
     def add_patient(self, name: str, ssn: str, dob: str) -> str:
         """添加新患者"""
         patient_id = f"P{hashlib.md5(f'{name}{ssn}{dob}'.encode()).hexdigest()[:8].upper()}"
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.shards.connect(patient_id)
         cursor = conn.cursor()
         
         cursor.execute('''
             INSERT OR REPLACE INTO patients (patient_id, name_hash, ssn_hash, dob_hash)
             VALUES (?, ?, ?, ?)
         ''', (patient_id, self.hash_pii(name), self.hash_pii(ssn), self.hash_pii(dob)))
+        self._index_name(cursor, patient_id, name, ssn, dob)
         
         conn.commit()
         conn.close()
         
         return patient_id
     
+    @traced("db.find_patient")
     def find_patient(self, name: str = None, ssn: str = None, dob: str = None) -> Optional[str]:
-        """根据PII信息查找患者ID - 优先使用更多信息匹配"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """根据PII信息查找患者ID - 优先使用更多信息匹配（分片时逐优先级 scatter-gather）"""
         # 构建查询条件 - 按优先级排序
         queries = []
         
@@ -92,16 +170,78 @@ class PatientDatabase:
                 'priority': 4
             })
         
-        # 按优先级执行查询
-        for query_info in sorted(queries, key=lambda x: x['priority']):
-            cursor.execute(query_info['query'], query_info['params'])
-            result = cursor.fetchone()
-            if result:
+        # 按优先级执行查询：同一优先级查完所有分片再降级
+        connections = list(self.shards.connections())
+        match = None
+        try:
+            for query_info in sorted(queries, key=lambda x: x['priority']):
+                # 5. 有佐证的模糊匹配排在仅姓名精确匹配之前
+                if query_info['priority'] == 4 and (ssn or dob):
+                    candidates = self.find_patient_candidates(name, ssn, dob, limit=1)
+                    if candidates:
+                        return candidates[0]['patient_id']
+                for conn in connections:
+                    result = conn.execute(query_info['query'], query_info['params']).fetchone()
+                    if result:
+                        match = (result[0], query_info['priority'])
+                        break
+                if match:
+                    break
+        finally:
+            for conn in connections:
                 conn.close()
-                return result[0]
         
-        conn.close()
-        return None
+        if match is None:
+            return None
+        if match[1] < 4:
+            self._ensure_name_indexed(match[0], name, ssn, dob)
+        return match[0]
+    
+    @traced("db.find_patient_candidates")
+    def find_patient_candidates(self, name: str, ssn: str = None, dob: str = None, limit: int = 5) -> List[Dict]:
+        """
+        模糊匹配：返回按相似度排序的候选 [{'patient_id', 'score', 'phonetic_match', 'corroborated_by'}]
+        
+        候选必须与 SSN 或 DOB 之一一致（盲索引的键已包含它们）；score 为姓名特征的 Dice 系数，
+        接受条件见 patient_match.py。
+        """
+        if not patient_match.FUZZY_MATCH_ENABLED or not name:
+            return []
+        key_info = patient_match.blind_index(name, ssn, dob)
+        if not key_info:
+            return []
+        query_features = len(patient_match.name_features(name))
+        
+        matches: Dict[str, Dict] = {}
+        placeholders = ', '.join('?' * len(key_info))
+        for conn in self.shards.connections():
+            rows = conn.execute(
+                f'SELECT key, patient_id, features FROM patient_name_index WHERE key IN ({placeholders})',
+                list(key_info),
+            ).fetchall()
+            conn.close()
+            for key, patient_id, features in rows:
+                kind, feature = key_info[key]
+                match = matches.setdefault(patient_id, {'features': features, 'overlap': {}, 'phonetic': False})
+                match['overlap'][kind] = match['overlap'].get(kind, 0) + 1
+                if feature.startswith(patient_match.FULL_NAME_FEATURES):
+                    match['phonetic'] = True
+        
+        candidates = []
+        for patient_id, match in matches.items():
+            score = max(
+                patient_match.dice(count, query_features, match['features'])
+                for count in match['overlap'].values()
+            )
+            if match['phonetic'] or score >= patient_match.FUZZY_MIN_SCORE:
+                candidates.append({
+                    'patient_id': patient_id,
+                    'score': round(score, 3),
+                    'phonetic_match': match['phonetic'],
+                    'corroborated_by': sorted(match['overlap']),
+                })
+        candidates.sort(key=lambda c: (len(c['corroborated_by']), c['phonetic_match'], c['score']), reverse=True)
+        return candidates[:limit]
     
     def add_conversation(self, patient_id: str, transcript: str, summary: str = None):
         """添加对话记录 - 现在存储在medical_records.db中"""
@@ -114,13 +254,18 @@ class PatientDatabase:
 class MedicalRecordsDatabase:
     """医疗记录向量数据库（简化版）"""
     
-    def __init__(self, db_path: str = "medical_records.db"):
+    def __init__(self, db_path: str = "medical_records.db", shards: int = None):
         self.db_path = db_path
+        # 按 patient_id 分片；对外的记录 ID 是全局 ID（见 sharding.py）
+        self.shards = ShardSet(db_path, shards)
         self.init_database()
     
     def init_database(self):
         """初始化医疗记录数据库 - 包含医疗记录和对话记录"""
-        conn = sqlite3.connect(self.db_path)
+        for path in self.shards.paths:
+            self._init_shard(sqlite3.connect(path))
+    
+    def _init_shard(self, conn: sqlite3.Connection):
         cursor = conn.cursor()
         
         # 医疗记录表
@@ -134,47 +279,436 @@ class MedicalRecordsDatabase:
                 metadata TEXT
             )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_medical_records_patient ON medical_records(patient_id, record_type)')
         
-        # 对话记录表 - 移到这里
+        # 近似重复检测的 LSH 分段索引（见 near_dup.py）；可由 medical_records 重建
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS record_bands (
+                record_id INTEGER NOT NULL,
+                patient_id TEXT NOT NULL,
+                record_type TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_record_bands_lookup ON record_bands(patient_id, record_type, band, value)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_record_bands_record ON record_bands(record_id)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS record_bands_layout (layout TEXT NOT NULL)')
+        self._rebuild_record_bands(cursor)
+        
+        # 对话记录表 - 移到这里（转录压缩存放在 transcript_blob，codec 为压缩格式）
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS conversations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 patient_id TEXT NOT NULL,
                 transcript TEXT NOT NULL,
                 summary TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                transcript_blob BLOB,
+                codec TEXT
+            )
+        ''')
+        # 旧库迁移：补上压缩列
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(conversations)')}
+        if 'transcript_blob' not in columns:
+            cursor.execute('ALTER TABLE conversations ADD COLUMN transcript_blob BLOB')
+        if 'codec' not in columns:
+            cursor.execute('ALTER TABLE conversations ADD COLUMN codec TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_patient ON conversations(patient_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_created ON conversations(created_at)')
+        
+        # 已归档对话的索引 - 内容在冷存储段文件中（见 archive.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_archive (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id TEXT NOT NULL,
+                conversation_id INTEGER,
+                summary TEXT,
+                created_at TIMESTAMP,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_archive_patient ON conversation_archive(patient_id)')
+        
+        # 写后缓冲（write_behind.py）已落库的操作 ID，日志重放时据此跳过，保证幂等
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS write_ops (
+                op_id TEXT PRIMARY KEY,
+                patient_id TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_write_ops_applied ON write_ops(applied_at)')
+        
+        # 每个患者的摘要（分类计数、最近就诊、最近症状），与记录/对话在同一事务中增量维护
+        summary_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_summary'"
+        ).fetchone() is not None
+        category_columns = ''.join(f'{category}_count INTEGER NOT NULL DEFAULT 0,\n' for category in SUMMARY_CATEGORIES)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS patient_summary (
+                patient_id TEXT PRIMARY KEY,
+                record_count INTEGER NOT NULL DEFAULT 0,
+                {category_columns}
+                conversation_count INTEGER NOT NULL DEFAULT 0,
+                last_visit_at TIMESTAMP,
+                latest_symptoms TEXT,
+                latest_symptoms_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_patient_summary_updated ON patient_summary(updated_at, patient_id)')
+        if not summary_exists:
+            # 旧库：由已有数据生成
+            self._rebuild_summary(cursor)
+        
+        # 每个患者的数据版本号 - 任何写入都会+1，供多 worker 的缓存判断是否过期
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS patient_versions (
+                patient_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
             )
         ''')
         
         conn.commit()
         conn.close()
     
-    def add_record(self, patient_id: str, record_type: str, content: str, metadata: Dict = None):
-        """添加医疗记录（避免重复）"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _rebuild_record_bands(self, cursor):
+        """阈值变化时重建分段索引；补齐缺少索引的记录（旧库、重分片后）"""
+        layout = near_dup.layout_key()
+        row = cursor.execute('SELECT layout FROM record_bands_layout').fetchone()
+        if row is None or row[0] != layout:
+            cursor.execute('DELETE FROM record_bands')
+            cursor.execute('DELETE FROM record_bands_layout')
+            cursor.execute('INSERT INTO record_bands_layout (layout) VALUES (?)', (layout,))
         
-        # 检查是否已存在相同的记录
+        missing = cursor.execute('''
+            SELECT id, patient_id, record_type, content FROM medical_records
+            WHERE id NOT IN (SELECT record_id FROM record_bands)
+        ''').fetchall()
+        for record_id, patient_id, record_type, content in missing:
+            self._index_record(cursor, record_id, patient_id, record_type, content)
+        if missing:
+            print(f"Indexed {len(missing)} medical records for near-duplicate detection")
+    
+    def _index_record(self, cursor, record_id: int, patient_id: str, record_type: str, content: str):
+        cursor.executemany('''
+            INSERT INTO record_bands (record_id, patient_id, record_type, band, value)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(record_id, patient_id, record_type, band, value) for band, value in near_dup.bands(content)])
+    
+    def _find_near_duplicate(self, cursor, patient_id: str, record_type: str, content: str,
+                             bands: List[Tuple[int, int]]) -> Optional[Tuple[int, str, str]]:
+        """按 LSH 分段取候选，返回精确 Jaccard 最高且达到阈值的记录 (id, content, metadata)"""
+        # 每段一次完整索引查找（写成 OR 时 SQLite 只用到索引前两列）
+        lookups = " UNION ".join([
+            "SELECT record_id FROM record_bands WHERE patient_id = ? AND record_type = ? AND band = ? AND value = ?"
+        ] * len(bands))
+        cursor.execute(
+            f'SELECT id, content, metadata FROM medical_records WHERE id IN ({lookups})',
+            [v for band, value in bands for v in (patient_id, record_type, band, value)],
+        )
+        
+        new_tokens = near_dup.tokens(content)
+        best, best_score = None, near_dup.DEDUP_SIMILARITY
+        for row in cursor.fetchall():
+            old_tokens = near_dup.tokens(row[1])
+            # 剂量/数值或否定不同的记录不是重复
+            if near_dup.hard_features(old_tokens) != near_dup.hard_features(new_tokens):
+                continue
+            score = near_dup.jaccard(new_tokens, old_tokens)
+            if score >= best_score:
+                best, best_score = row, score
+        return best
+    
+    def _bump_version(self, cursor, patient_id: str):
+        """在当前事务中递增患者数据版本号"""
         cursor.execute('''
-            SELECT id FROM medical_records 
-            WHERE patient_id = ? AND record_type = ? AND content = ?
-        ''', (patient_id, record_type, content))
+            INSERT INTO patient_versions (patient_id, version) VALUES (?, 1)
+            ON CONFLICT(patient_id) DO UPDATE SET version = version + 1
+        ''', (patient_id,))
+    
+    @traced("db.get_patient_version")
+    def get_patient_version(self, patient_id: str) -> int:
+        """获取患者数据版本号（主键查询，开销很小）"""
+        conn = self.shards.connect(patient_id)
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM patient_versions WHERE patient_id = ?', (patient_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else 0
+    
+    def get_record_patient_id(self, record_id: int) -> Optional[str]:
+        """根据记录ID查找所属患者"""
+        shard, local_id = self.shards.decode_id(record_id)
+        conn = self.shards.connect_index(shard)
+        cursor = conn.cursor()
+        cursor.execute('SELECT patient_id FROM medical_records WHERE id = ?', (local_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    @traced("db.add_record")
+    def add_record(self, patient_id: str, record_type: str, content: str, metadata: Dict = None) -> str:
+        """
+        添加医疗记录（避免重复）
         
-        if cursor.fetchone() is None:
+        近似重复（见 near_dup.py）按 DEDUP_POLICY 处理，只对 DEDUP_RECORD_TYPES 中的类型生效；
+        返回 "added" / "skipped" / "merged"
+        """
+        conn = self.shards.connect(patient_id)
+        cursor = conn.cursor()
+        action = self._add_record(cursor, patient_id, record_type, content, metadata)
+        conn.commit()
+        conn.close()
+        return action
+    
+    @traced("db.add_records")
+    def add_records(self, patient_id: str, records: List[Dict]) -> List[str]:
+        """
+        批量添加同一患者的医疗记录（一个事务；每条记录的去重规则同 add_record）
+        
+        records: [{'type', 'content', 'metadata'}]，返回每条记录的处理结果
+        """
+        if not records:
+            return []
+        conn = self.shards.connect(patient_id)
+        cursor = conn.cursor()
+        actions = [
+            self._add_record(cursor, patient_id, record['type'], record['content'], record.get('metadata'))
+            for record in records
+        ]
+        conn.commit()
+        conn.close()
+        return actions
+    
+    def _add_record(self, cursor, patient_id: str, record_type: str, content: str, metadata: Dict = None,
+                    recorded_at: str = None) -> str:
+        """在调用方的事务中添加一条记录（不提交）；recorded_at 为空时取当前时间"""
+        policy = near_dup.DEDUP_POLICY if near_dup.DEDUP_POLICY in near_dup.POLICIES else "off"
+        bands = near_dup.bands(content)
+        
+        if policy == "off" or not near_dup.dedup_allowed(record_type):
+            # 只检查完全相同的记录
             cursor.execute('''
-                INSERT INTO medical_records (patient_id, record_type, content, metadata)
-                VALUES (?, ?, ?, ?)
-            ''', (patient_id, record_type, content, json.dumps(metadata) if metadata else None))
-            conn.commit()
+                SELECT id, content, metadata FROM medical_records 
+                WHERE patient_id = ? AND record_type = ? AND content = ?
+            ''', (patient_id, record_type, content))
+            duplicate = cursor.fetchone()
+        else:
+            duplicate = self._find_near_duplicate(cursor, patient_id, record_type, content, bands)
+        
+        if duplicate is None:
+            cursor.execute('''
+                INSERT INTO medical_records (patient_id, record_type, content, metadata, date_recorded)
+                VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ''', (patient_id, record_type, content, json.dumps(metadata) if metadata else None, recorded_at))
+            self._index_record(cursor, cursor.lastrowid, patient_id, record_type, content)
+            self._summary_record_added(cursor, patient_id, record_type, content, recorded_at)
+            self._bump_version(cursor, patient_id)
             print(f"Added new medical record: {record_type} for {patient_id}")
+            action = "added"
+        elif policy == "merge" and duplicate[1] != content:
+            # 用新内容替换旧记录，保留旧元数据并累计合并次数
+            record_id = duplicate[0]
+            merged = json.loads(duplicate[2]) if duplicate[2] else {}
+            merged.update(metadata or {})
+            merged['merged_count'] = merged.get('merged_count', 0) + 1
+            cursor.execute('''
+                UPDATE medical_records
+                SET content = ?, metadata = ?, date_recorded = COALESCE(?, CURRENT_TIMESTAMP)
+                WHERE id = ?
+            ''', (content, json.dumps(merged), recorded_at, record_id))
+            cursor.execute('DELETE FROM record_bands WHERE record_id = ?', (record_id,))
+            self._index_record(cursor, record_id, patient_id, record_type, content)
+            self._summary_record_merged(cursor, patient_id, record_type, content, recorded_at)
+            self._bump_version(cursor, patient_id)
+            print(f"Merged near-duplicate medical record: {record_type} for {patient_id}")
+            action = "merged"
         else:
             print(f"Record already exists, skipping: {record_type} for {patient_id}")
+            action = "skipped"
+        return action
+    
+    # ===============================
+    # 患者摘要（patient_summary）
+    # ===============================
+    
+    def _summary_touch(self, cursor, patient_id: str):
+        """确保摘要行存在并更新活动时间"""
+        cursor.execute('INSERT OR IGNORE INTO patient_summary (patient_id) VALUES (?)', (patient_id,))
+        cursor.execute('UPDATE patient_summary SET updated_at = CURRENT_TIMESTAMP WHERE patient_id = ?', (patient_id,))
+    
+    def _summary_record_added(self, cursor, patient_id: str, record_type: str, content: str,
+                              recorded_at: str = None):
+        column = f'{categorize_record(record_type)}_count'
+        self._summary_touch(cursor, patient_id)
+        cursor.execute(f'''
+            UPDATE patient_summary SET record_count = record_count + 1, {column} = {column} + 1
+            WHERE patient_id = ?
+        ''', (patient_id,))
+        self._summary_record_merged(cursor, patient_id, record_type, content, recorded_at)
+    
+    def _summary_record_merged(self, cursor, patient_id: str, record_type: str, content: str,
+                               recorded_at: str = None):
+        """新增或合并后的记录是该类型最新的一条（延迟落库的旧记录不覆盖更新的摘要）"""
+        if record_type == SYMPTOMS_RECORD_TYPE:
+            cursor.execute('''
+                UPDATE patient_summary SET latest_symptoms = ?, latest_symptoms_at = COALESCE(?, CURRENT_TIMESTAMP),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE patient_id = ? AND (latest_symptoms_at IS NULL OR latest_symptoms_at <= COALESCE(?, CURRENT_TIMESTAMP))
+            ''', (content, recorded_at, patient_id, recorded_at))
+        elif record_type == VISIT_RECORD_TYPE:
+            self._summary_visit(cursor, patient_id, recorded_at)
+    
+    def _summary_visit(self, cursor, patient_id: str, visited_at: str = None):
+        """last_visit_at 只向后移动"""
+        cursor.execute('''
+            UPDATE patient_summary
+            SET last_visit_at = MAX(COALESCE(last_visit_at, ''), COALESCE(?, CURRENT_TIMESTAMP)),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE patient_id = ?
+        ''', (visited_at, patient_id))
+    
+    def _summary_record_removed(self, cursor, patient_id: str, record_type: str):
+        """计数减一；删除的是症状/就诊记录时，从剩余记录重新取最近一条"""
+        column = f'{categorize_record(record_type)}_count'
+        self._summary_touch(cursor, patient_id)
+        cursor.execute(f'''
+            UPDATE patient_summary SET record_count = MAX(record_count - 1, 0), {column} = MAX({column} - 1, 0)
+            WHERE patient_id = ?
+        ''', (patient_id,))
+        if record_type == SYMPTOMS_RECORD_TYPE:
+            latest = cursor.execute('''
+                SELECT content, date_recorded FROM medical_records
+                WHERE patient_id = ? AND record_type = ?
+                ORDER BY date_recorded DESC, id DESC LIMIT 1
+            ''', (patient_id, record_type)).fetchone() or (None, None)
+            cursor.execute('''
+                UPDATE patient_summary SET latest_symptoms = ?, latest_symptoms_at = ? WHERE patient_id = ?
+            ''', (latest[0], latest[1], patient_id))
+        elif record_type == VISIT_RECORD_TYPE:
+            cursor.execute('''
+                UPDATE patient_summary SET last_visit_at = (
+                    SELECT MAX(visited) FROM (
+                        SELECT MAX(date_recorded) AS visited FROM medical_records WHERE patient_id = ?1 AND record_type = ?2
+                        UNION ALL SELECT MAX(created_at) FROM conversations WHERE patient_id = ?1
+                        UNION ALL SELECT MAX(created_at) FROM conversation_archive WHERE patient_id = ?1
+                    )
+                )
+                WHERE patient_id = ?1
+            ''', (patient_id, record_type))
+    
+    def _rebuild_summary(self, cursor, patient_id: str = None) -> int:
+        """由 medical_records / conversations / conversation_archive 重新生成摘要（本分片），返回患者数"""
+        where, params = ('WHERE patient_id = ?', (patient_id,)) if patient_id else ('', ())
+        summaries: Dict[str, Dict] = {}
+        
+        def row(pid: str) -> Dict:
+            if pid not in summaries:
+                summaries[pid] = {'record_count': 0, 'conversation_count': 0, 'last_visit_at': None,
+                                  'latest_symptoms': None, 'latest_symptoms_at': None,
+                                  **{f'{category}_count': 0 for category in SUMMARY_CATEGORIES}}
+            return summaries[pid]
+        
+        def visit(pid: str, at: str):
+            if at and (row(pid)['last_visit_at'] is None or at > row(pid)['last_visit_at']):
+                row(pid)['last_visit_at'] = at
+        
+        for pid, record_type, count, latest in cursor.execute(f'''
+            SELECT patient_id, record_type, COUNT(*), MAX(date_recorded) FROM medical_records {where}
+            GROUP BY patient_id, record_type
+        ''', params).fetchall():
+            row(pid)['record_count'] += count
+            row(pid)[f'{categorize_record(record_type)}_count'] += count
+            if record_type == VISIT_RECORD_TYPE:
+                visit(pid, latest)
+        
+        # 最近症状：与删除时重新取值的顺序一致（时间相同时取 id 大的）
+        for pid, content, latest in cursor.execute(f'''
+            SELECT patient_id, content, date_recorded FROM (
+                SELECT patient_id, content, date_recorded,
+                    ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY date_recorded DESC, id DESC) AS rank
+                FROM medical_records
+                WHERE record_type = ? {where.replace('WHERE', 'AND')}
+            )
+            WHERE rank = 1
+        ''', (SYMPTOMS_RECORD_TYPE,) + params).fetchall():
+            row(pid).update(latest_symptoms=content, latest_symptoms_at=latest)
+        
+        for table in ('conversations', 'conversation_archive'):
+            for pid, count, latest in cursor.execute(f'''
+                SELECT patient_id, COUNT(*), MAX(created_at) FROM {table} {where} GROUP BY patient_id
+            ''', params).fetchall():
+                row(pid)['conversation_count'] += count
+                visit(pid, latest)
         
+        cursor.execute(f'DELETE FROM patient_summary {where}', params)
+        if summaries:
+            columns = list(next(iter(summaries.values())))
+            cursor.executemany(f'''
+                INSERT INTO patient_summary (patient_id, {', '.join(columns)})
+                VALUES (?, {', '.join('?' for _ in columns)})
+            ''', [(pid, *(summary[c] for c in columns)) for pid, summary in summaries.items()])
+        return len(summaries)
+    
+    def rebuild_patient_summaries(self, patient_id: str = None) -> int:
+        """重建全部（或单个患者的）摘要，返回患者数"""
+        paths = [self.shards.path_for(patient_id)] if patient_id else self.shards.paths
+        total = 0
+        for path in paths:
+            conn = sqlite3.connect(path)
+            total += self._rebuild_summary(conn.cursor(), patient_id)
+            conn.commit()
+            conn.close()
+        return total
+    
+    @staticmethod
+    def _summary_dict(cursor, row) -> Dict:
+        summary = dict(zip([column[0] for column in cursor.description], row))
+        summary['category_counts'] = {category: summary.pop(f'{category}_count') for category in SUMMARY_CATEGORIES}
+        return summary
+    
+    @traced("db.get_patient_summary")
+    def get_patient_summary(self, patient_id: str) -> Optional[Dict]:
+        """读取一个患者的摘要（一行）；没有任何记录和对话时返回 None"""
+        conn = self.shards.connect(patient_id)
+        cursor = conn.cursor()
+        row = cursor.execute('SELECT * FROM patient_summary WHERE patient_id = ?', (patient_id,)).fetchone()
+        summary = self._summary_dict(cursor, row) if row else None
         conn.close()
+        return summary
+    
+    @traced("db.list_patient_summaries")
+    def list_patient_summaries(self, limit: int = 50, before: Tuple[str, str] = None) -> List[Dict]:
+        """
+        按最近活动时间倒序列出患者摘要（仪表盘列表）
+        
+        before=(updated_at, patient_id) 为上一页最后一行，键集分页；每个分片一次索引查询后合并
+        """
+        query = 'SELECT * FROM patient_summary'
+        params: Tuple = ()
+        if before:
+            query += ' WHERE (updated_at, patient_id) < (?, ?)'
+            params = tuple(before)
+        query += ' ORDER BY updated_at DESC, patient_id DESC LIMIT ?'
+        
+        summaries = []
+        for conn in self.shards.connections():
+            cursor = conn.cursor()
+            summaries.extend(self._summary_dict(cursor, row) for row in cursor.execute(query, params + (limit,)))
+            conn.close()
+        summaries.sort(key=lambda s: (s['updated_at'], s['patient_id']), reverse=True)
+        return summaries[:limit]
     
+    @traced("db.get_patient_records")
     def get_patient_records(self, patient_id: str) -> List[Dict]:
         """获取患者的所有医疗记录"""
-        conn = sqlite3.connect(self.db_path)
+        shard = self.shards.index_for(patient_id)
+        conn = self.shards.connect_index(shard)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -187,7 +721,7 @@ class MedicalRecordsDatabase:
         records = []
         for row in cursor.fetchall():
             records.append({
-                'id': row[0],  # 添加记录ID
+                'id': self.shards.encode_id(row[0], shard),  # 添加记录ID（全局ID）
                 'type': row[1],
                 'content': row[2],
                 'date': row[3],
@@ -197,61 +731,151 @@ class MedicalRecordsDatabase:
         conn.close()
         return records
     
+    @traced("db.delete_medical_record")
     def delete_medical_record(self, record_id: int) -> bool:
         """删除特定的医疗记录"""
-        conn = sqlite3.connect(self.db_path)
+        shard, local_id = self.shards.decode_id(record_id)
+        conn = self.shards.connect_index(shard)
         cursor = conn.cursor()
         
         # 检查记录是否存在
-        cursor.execute('SELECT id FROM medical_records WHERE id = ?', (record_id,))
-        if cursor.fetchone() is None:
+        cursor.execute('SELECT patient_id, record_type FROM medical_records WHERE id = ?', (local_id,))
+        row = cursor.fetchone()
+        if row is None:
             conn.close()
             return False
         
         # 删除记录
-        cursor.execute('DELETE FROM medical_records WHERE id = ?', (record_id,))
+        cursor.execute('DELETE FROM medical_records WHERE id = ?', (local_id,))
+        deleted_rows = cursor.rowcount
+        cursor.execute('DELETE FROM record_bands WHERE record_id = ?', (local_id,))
+        self._summary_record_removed(cursor, row[0], row[1])
+        self._bump_version(cursor, row[0])
         conn.commit()
         
-        deleted_rows = cursor.rowcount
         conn.close()
         
         print(f"Deleted medical record with ID: {record_id}")
         return deleted_rows > 0
     
+    @traced("db.add_conversation")
     def add_conversation(self, patient_id: str, transcript: str, summary: str = None):
         """添加对话记录到medical_records数据库"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.shards.connect(patient_id)
         cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO conversations (patient_id, transcript, summary)
-            VALUES (?, ?, ?)
-        ''', (patient_id, transcript, summary))
-        
+        self._add_conversation(cursor, patient_id, transcript, summary)
         conn.commit()
         conn.close()
         print(f"Added conversation record for patient {patient_id}")
     
-    def get_conversations(self, patient_id: str) -> List[Dict]:
-        """获取患者的对话记录"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    def _add_conversation(self, cursor, patient_id: str, transcript: str, summary: str = None,
+                          created_at: str = None):
+        # 写入时压缩，transcript 列留空；created_at 为空时取当前时间
+        codec, blob = compress_text(transcript)
         cursor.execute('''
-            SELECT transcript, summary, created_at
-            FROM conversations
+            INSERT INTO conversations (patient_id, transcript, summary, transcript_blob, codec, created_at)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        ''', (patient_id, '', summary, blob, codec, created_at))
+        self._summary_touch(cursor, patient_id)
+        cursor.execute('''
+            UPDATE patient_summary SET conversation_count = conversation_count + 1
             WHERE patient_id = ?
-            ORDER BY created_at DESC
         ''', (patient_id,))
+        self._summary_visit(cursor, patient_id, created_at)
+        self._bump_version(cursor, patient_id)
+    
+    @traced("db.apply_write_ops")
+    def apply_write_ops(self, ops: List[Dict], retain_hours: float = 24) -> Dict[str, Optional[List[str]]]:
+        """
+        批量落库写后缓冲中的操作（见 write_behind.py），每个分片一个事务
+        
+        ops: {'op_id', 'kind': 'records' | 'conversation', 'patient_id', ...}
+        记录和对话的时间取 op 的 submitted_at（提交时间），而不是落库时间
+        已应用过的 op_id 跳过（日志重放时保证幂等）；返回 {op_id: 每条记录的处理结果，跳过为 None}
+        超过 retain_hours 的 op_id 记录顺带清理
+        """
+        by_shard: Dict[int, List[Dict]] = {}
+        for op in ops:
+            by_shard.setdefault(self.shards.index_for(op['patient_id']), []).append(op)
+        
+        results = {}
+        for shard, shard_ops in by_shard.items():
+            conn = self.shards.connect_index(shard)
+            cursor = conn.cursor()
+            for op in shard_ops:
+                cursor.execute('INSERT OR IGNORE INTO write_ops (op_id, patient_id) VALUES (?, ?)',
+                               (op['op_id'], op['patient_id']))
+                if cursor.rowcount == 0:
+                    results[op['op_id']] = None
+                    continue
+                if op['kind'] == 'records':
+                    results[op['op_id']] = [
+                        self._add_record(cursor, op['patient_id'], record['type'], record['content'],
+                                         record.get('metadata'), op.get('submitted_at'))
+                        for record in op['records']
+                    ]
+                else:
+                    self._add_conversation(cursor, op['patient_id'], op['transcript'], op.get('summary'),
+                                           op.get('submitted_at'))
+                    results[op['op_id']] = ['added']
+            cursor.execute("DELETE FROM write_ops WHERE applied_at < datetime('now', ?)", (f"-{retain_hours} hours",))
+            conn.commit()
+            conn.close()
+        return results
+    
+    @traced("db.get_conversations")
+    def get_conversations(self, patient_id: str, include_transcript: bool = True,
+                          include_archived: bool = False) -> List[Dict]:
+        """
+        获取患者的对话记录
+        
+        - include_transcript=False 时不解压转录（只要列表/摘要时更快）
+        - include_archived=True 时同时返回冷存储中的归档对话（archived=True）
+        """
+        conn = self.shards.connect(patient_id)
+        cursor = conn.cursor()
+        
+        if include_transcript:
+            cursor.execute('''
+                SELECT summary, created_at, transcript, transcript_blob, codec
+                FROM conversations
+                WHERE patient_id = ?
+                ORDER BY created_at DESC
+            ''', (patient_id,))
+        else:
+            cursor.execute('''
+                SELECT summary, created_at
+                FROM conversations
+                WHERE patient_id = ?
+                ORDER BY created_at DESC
+            ''', (patient_id,))
         
         conversations = []
         for row in cursor.fetchall():
             conversations.append({
-                'transcript': row[0],
-                'summary': row[1],
-                'created_at': row[2]
+                'transcript': decode_transcript(*row[2:]) if include_transcript else None,
+                'summary': row[0],
+                'created_at': row[1]
             })
         
+        if include_archived:
+            cursor.execute('''
+                SELECT summary, created_at, segment, offset, length, codec
+                FROM conversation_archive
+                WHERE patient_id = ?
+                ORDER BY created_at DESC
+            ''', (patient_id,))
+            for summary, created_at, segment, offset, length, codec in cursor.fetchall():
+                transcript = None
+                if include_transcript:
+                    transcript = read_archived_conversation(segment, offset, length, codec, ARCHIVE_DIR)['transcript']
+                conversations.append({
+                    'transcript': transcript,
+                    'summary': summary,
+                    'created_at': created_at,
+                    'archived': True
+                })
+        
         conn.close()
         return conversations
 
@@ -292,4 +916,16 @@ def init_sample_data():
 
 
 if __name__ == "__main__":
-    init_sample_data()
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Medical records database utilities")
+    parser.add_argument("command", nargs="?", choices=["init-sample-data", "rebuild-summary"], default="init-sample-data")
+    parser.add_argument("--patient-id", help="rebuild-summary: only this patient")
+    parser.add_argument("--db", default="medical_records.db")
+    args = parser.parse_args()
+    
+    if args.command == "rebuild-summary":
+        count = MedicalRecordsDatabase(args.db).rebuild_patient_summaries(args.patient_id)
+        print(f"Rebuilt summaries for {count} patients")
+    else:
+        init_sample_data()
\ No newline at end of file
@@ -0,0 +1,361 @@
+# 批量导出：病历记录和对话记录 → NDJSON / Parquet
+#
+# 供夜间报表等分析任务使用，代替逐个患者调用 /patient/{id}/records。
+#
+# - 逐分片按主键做 keyset 分页（WHERE id > ? ORDER BY id LIMIT n），每批一个短读事务，
+#   内存占用与数据量无关，也不会长时间持有读锁挡住写入
+# - 位置（每张表、每个分片已导出的最大 id）就是断点：CLI 写入 checkpoint 文件，
+#   HTTP 导出在每批之后输出一行 {"table": "_checkpoint", "cursor": ...}，带上 cursor 重新请求即可续传
+# - 过滤: patient_id、since / until（按 date_recorded / created_at）
+#
+# 用法:
+#     python export.py --output export.ndjson [--tables records,conversations,archived_conversations] \
+#         [--patient-id P1234ABCD] [--since 2024-01-01] [--until 2024-02-01] [--checkpoint export.ckpt]
+#     python export.py --format parquet --output export_dir/    # 需要 pyarrow
+# 中断后用相同参数重新运行即从断点继续。
+import argparse
+import base64
+import copy
+import json
+import logging
+import os
+import sys
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Parquet 每个文件的行数；文件写完才推进断点
+EXPORT_PARQUET_ROWS_PER_FILE = int(os.getenv("EXPORT_PARQUET_ROWS_PER_FILE", "100000"))
+
+CHECKPOINT_VERSION = 1
+
+# 导出名 → (表名, 日期列, 查询列)
+TABLES = {
+    "records": ("medical_records", "date_recorded",
+                "id, patient_id, record_type, content, date_recorded, metadata"),
+    "conversations": ("conversations", "created_at",
+                      "id, patient_id, transcript, transcript_blob, codec, summary, created_at"),
+    # 已归档到冷存储的对话（见 archive.py），内容从段文件读回
+    "archived_conversations": ("conversation_archive", "created_at",
+                               "id, patient_id, conversation_id, summary, created_at, segment, offset, length, codec"),
+}
+
+
+def _normalize_time(value: Optional[str]) -> Optional[str]:
+    """ISO 日期/时间 → SQLite CURRENT_TIMESTAMP 的格式（YYYY-MM-DD HH:MM:SS）"""
+    return value.replace("T", " ") if value else None
+
+
+def _to_row(name: str, shards, shard: int, row: tuple) -> Dict:
+    from archive import read_archived_conversation
+    from database import decode_transcript
+
+    if name == "records":
+        local_id, patient_id, record_type, content, date_recorded, metadata = row
+        return {
+            "table": name,
+            "id": shards.encode_id(local_id, shard),
+            "patient_id": patient_id,
+            "type": record_type,
+            "content": content,
+            "date": date_recorded,
+            "metadata": json.loads(metadata) if metadata else {},
+        }
+    if name == "archived_conversations":
+        _, patient_id, conversation_id, summary, created_at, segment, offset, length, codec = row
+        return {
+            "table": name,
+            "id": shards.encode_id(conversation_id, shard),
+            "patient_id": patient_id,
+            "transcript": read_archived_conversation(segment, offset, length, codec)["transcript"],
+            "summary": summary,
+            "created_at": created_at,
+        }
+    local_id, patient_id, transcript, blob, codec, summary, created_at = row
+    return {
+        "table": name,
+        "id": shards.encode_id(local_id, shard),
+        "patient_id": patient_id,
+        "transcript": decode_transcript(transcript, blob, codec),
+        "summary": summary,
+        "created_at": created_at,
+    }
+
+
+def iter_batches(
+    medical_db,
+    tables: Sequence[str] = tuple(TABLES),
+    patient_id: str = None,
+    since: str = None,
+    until: str = None,
+    positions: Dict[str, Dict[str, int]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[Tuple[str, List[Dict], Dict[str, Dict[str, int]]]]:
+    """
+    逐批产出 (导出名, 行列表, 本批之后的位置)
+
+    positions: {导出名: {分片序号: 已导出的最大分片内 id}}，用于续传；会被原地更新
+    """
+    positions = positions if positions is not None else {}
+    shards = medical_db.shards
+    if patient_id:
+        shard_indexes = [shards.index_for(patient_id)]
+    else:
+        shard_indexes = list(range(shards.count))
+
+    for name in tables:
+        table, date_column, columns = TABLES[name]
+        conditions, params = ["id > ?"], []
+        if patient_id:
+            conditions.append("patient_id = ?")
+            params.append(patient_id)
+        if since:
+            conditions.append(f"{date_column} >= ?")
+            params.append(_normalize_time(since))
+        if until:
+            conditions.append(f"{date_column} < ?")
+            params.append(_normalize_time(until))
+        sql = f"SELECT {columns} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+
+        table_positions = positions.setdefault(name, {})
+        for shard in shard_indexes:
+            last_id = table_positions.get(str(shard), 0)
+            while True:
+                conn = shards.connect_index(shard)
+                try:
+                    rows = conn.execute(sql, [last_id] + params + [batch_size]).fetchall()
+                finally:
+                    conn.close()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                table_positions[str(shard)] = last_id
+                yield name, [_to_row(name, shards, shard, row) for row in rows], positions
+                if len(rows) < batch_size:
+                    break
+
+
+# ===============================
+# HTTP 续传游标
+# ===============================
+def encode_cursor(positions: Dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Dict:
+    if not cursor:
+        return {}
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid export cursor: {e}")
+    if not isinstance(positions, dict):
+        raise ValueError("Invalid export cursor")
+    return positions
+
+
+def stream_ndjson(medical_db, cursor: str = None, **filters) -> Iterator[bytes]:
+    """HTTP 流式导出：数据行 + 每批之后一行断点"""
+    positions = decode_cursor(cursor)
+    for _, rows, positions in iter_batches(medical_db, positions=positions, **filters):
+        chunk = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        chunk += json.dumps({"table": "_checkpoint", "cursor": encode_cursor(positions)}) + "\n"
+        yield chunk.encode("utf-8")
+
+
+# ===============================
+# 文件输出 + checkpoint
+# ===============================
+def _load_checkpoint(path: str, params: Dict) -> Dict:
+    if not path or not os.path.exists(path):
+        return {"version": CHECKPOINT_VERSION, "params": params, "positions": {}, "rows": 0}
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("params") != params:
+        raise ValueError(f"Checkpoint {path} was written with different export parameters: {checkpoint.get('params')}")
+    return checkpoint
+
+
+def _save_checkpoint(path: str, checkpoint: Dict):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class NDJSONSink:
+    """追加写 NDJSON；断点记录文件偏移，续传时截掉断点之后写了一半的数据（没有断点时从头覆盖）"""
+
+    def __init__(self, path: str, checkpoint: Dict):
+        self.path = path
+        self.file = open(path, "ab")
+        offset = checkpoint.get("offset", 0)
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def write(self, name: str, rows: List[Dict]) -> bool:
+        """写一批；返回 True 表示可以推进断点"""
+        self.file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return True
+
+    def state(self) -> Dict:
+        return {"offset": self.file.tell()}
+
+    def close(self) -> Dict:
+        state = self.state()
+        self.file.close()
+        return state
+
+
+class ParquetSink:
+    """
+    每张表一个子目录，按 EXPORT_PARQUET_ROWS_PER_FILE 行切分 part 文件
+
+    Parquet 文件写完 footer 才可读，所以只在关闭文件时推进断点；
+    续传时删除断点之后（上次中断时未完成）的 part 文件。
+    """
+
+    def __init__(self, directory: str, checkpoint: Dict, rows_per_file: int = EXPORT_PARQUET_ROWS_PER_FILE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export requires the 'pyarrow' package (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        string, int64 = pyarrow.string(), pyarrow.int64()
+        self.schemas = {
+            "records": pyarrow.schema([
+                ("table", string), ("id", int64), ("patient_id", string), ("type", string),
+                ("content", string), ("date", string), ("metadata", string),
+            ]),
+            "conversations": pyarrow.schema([
+                ("table", string), ("id", int64), ("patient_id", string), ("transcript", string),
+                ("summary", string), ("created_at", string),
+            ]),
+        }
+        self.schemas["archived_conversations"] = self.schemas["conversations"]
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.files = list(checkpoint.get("files", []))
+        self.writer = None
+        self.writer_table = None
+        self.writer_rows = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in TABLES:
+            table_dir = os.path.join(directory, name)
+            if os.path.isdir(table_dir):
+                for file_name in os.listdir(table_dir):
+                    if os.path.join(name, file_name) not in self.files:
+                        os.remove(os.path.join(table_dir, file_name))
+
+    def _open(self, name: str):
+        os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+        index = sum(1 for f in self.files if f.startswith(name + os.sep))
+        self.writer_path = os.path.join(name, f"part-{index:05d}.parquet")
+        self.writer_table = name
+        self.writer_rows = 0
+        self.writer = None
+
+    def write(self, name: str, rows: List[Dict]) -> bool:
+        if self.writer_table != name:
+            self._finish()
+            self._open(name)
+        for row in rows:
+            if "metadata" in row:
+                row["metadata"] = json.dumps(row["metadata"], ensure_ascii=False)
+        batch = self.pa.Table.from_pylist(rows, schema=self.schemas[name])
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(os.path.join(self.directory, self.writer_path), batch.schema)
+        self.writer.write_table(batch)
+        self.writer_rows += len(rows)
+        if self.writer_rows >= self.rows_per_file:
+            self._finish()
+            self._open(name)
+            return True
+        return False
+
+    def _finish(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.files.append(self.writer_path)
+            self.writer = None
+
+    def state(self) -> Dict:
+        return {"files": list(self.files)}
+
+    def close(self) -> Dict:
+        self._finish()
+        return self.state()
+
+
+def export(
+    medical_db,
+    output: str,
+    fmt: str = "ndjson",
+    tables: Sequence[str] = tuple(TABLES),
+    patient_id: str = None,
+    since: str = None,
+    until: str = None,
+    checkpoint_path: str = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Dict:
+    """导出到文件；有 checkpoint_path 时可中断续传。返回导出统计"""
+    params = {"output": os.path.abspath(output), "format": fmt, "tables": list(tables),
+              "patient_id": patient_id, "since": since, "until": until}
+    checkpoint = _load_checkpoint(checkpoint_path, params)
+    sink = NDJSONSink(output, checkpoint) if fmt == "ndjson" else ParquetSink(output, checkpoint)
+
+    # 已写入但未推进断点的位置（Parquet 文件未关闭时）
+    pending_positions = copy.deepcopy(checkpoint["positions"])
+    pending_rows = checkpoint["rows"]
+    exported = 0
+    for name, rows, positions in iter_batches(
+        medical_db, tables, patient_id, since, until, pending_positions, batch_size
+    ):
+        exported += len(rows)
+        pending_rows += len(rows)
+        if sink.write(name, rows):
+            checkpoint.update(sink.state(), positions=copy.deepcopy(positions), rows=pending_rows)
+            _save_checkpoint(checkpoint_path, checkpoint)
+    # 中断时不会走到这里：未关闭的 Parquet 文件不完整，断点停在上一个完整文件
+    checkpoint.update(sink.close(), positions=pending_positions, rows=pending_rows, complete=True)
+    _save_checkpoint(checkpoint_path, checkpoint)
+    return {"rows": exported, "total_rows": pending_rows, "positions": pending_positions}
+
+
+def main(argv: Sequence[str] = None):
+    from database import MedicalRecordsDatabase
+
+    parser = argparse.ArgumentParser(description="Export medical records and conversations in batches")
+    parser.add_argument("--output", required=True, help="NDJSON file, or a directory for parquet")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--tables", type=lambda v: v.split(","), default=list(TABLES))
+    parser.add_argument("--patient-id")
+    parser.add_argument("--since", help="inclusive, e.g. 2024-01-01 or 2024-01-01T08:00:00")
+    parser.add_argument("--until", help="exclusive")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--db", default="medical_records.db")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        parser.error(f"unknown tables {sorted(unknown)}, expected {list(TABLES)}")
+    checkpoint = args.checkpoint or args.output.rstrip("/") + ".ckpt"
+    result = export(
+        MedicalRecordsDatabase(args.db), args.output, args.format, args.tables,
+        args.patient_id, args.since, args.until, checkpoint, args.batch_size,
+    )
+    print(json.dumps(result), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# 本地推理服务客户端 + 二进制协议
+#
+# 设置 INFERENCE_SOCKET 后，transcribe_audio / ner_detect_pii / redact_pii
+# 不再在本进程加载 Whisper 和 spaCy，而是通过 Unix domain socket 调用
+# inference_server.py（单个长驻进程持有模型）。
+#
+# 帧格式（网络字节序）:
+#   请求: op:u8  length:u32  payload
+#   响应: status:u8  length:u32  payload      status 0=ok, 1=error(payload 为 utf-8 错误信息)
+import os
+import socket
+import struct
+import threading
+from typing import Dict, List, Tuple
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET")
+
+HEADER = struct.Struct("!BI")
+MAX_FRAME = 64 * 1024 * 1024
+
+OP_PING = 0
+OP_TRANSCRIBE = 1
+OP_NER_DETECT = 2
+OP_REDACT = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# PII 类型集合编码为 1 字节位掩码
+PII_TYPES = ("NAME", "DATE", "SSN")
+
+_SEGMENT = struct.Struct("!ffI")
+
+
+class InferenceError(Exception):
+    """推理服务返回的错误"""
+
+
+# ===============================
+# 编解码
+# ===============================
+def encode_types(types) -> int:
+    mask = 0
+    for i, name in enumerate(PII_TYPES):
+        if name in types:
+            mask |= 1 << i
+    return mask
+
+
+def decode_types(mask: int) -> List[str]:
+    return [name for i, name in enumerate(PII_TYPES) if mask & (1 << i)]
+
+
+def encode_segments(segments: List[Dict]) -> bytes:
+    parts = [struct.pack("!I", len(segments))]
+    for seg in segments:
+        text = seg["text"].encode("utf-8")
+        parts.append(_SEGMENT.pack(seg["start"], seg["end"], len(text)))
+        parts.append(text)
+    return b"".join(parts)
+
+
+def decode_segments(payload: bytes) -> List[Dict]:
+    (count,) = struct.unpack_from("!I", payload, 0)
+    offset = 4
+    segments = []
+    for _ in range(count):
+        start, end, length = _SEGMENT.unpack_from(payload, offset)
+        offset += _SEGMENT.size
+        text = payload[offset:offset + length].decode("utf-8")
+        offset += length
+        segments.append({"start": round(start, 2), "end": round(end, 2), "text": text})
+    return segments
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("inference socket closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_frame(sock: socket.socket) -> Tuple[int, bytes]:
+    kind, length = HEADER.unpack(recv_exact(sock, HEADER.size))
+    if length > MAX_FRAME:
+        raise InferenceError(f"frame too large: {length}")
+    return kind, recv_exact(sock, length) if length else b""
+
+
+def write_frame(sock: socket.socket, kind: int, payload: bytes = b""):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+# ===============================
+# 客户端
+# ===============================
+class InferenceClient:
+    """
+    每个线程一条持久连接
+
+    请求帧没有发出去（连接不上、旧连接已被服务端关闭）时重连重试一次；请求发出后的任何错误
+    （包括读超时）都不重试，因为服务端可能已经执行或仍在执行这次请求。
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 600.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _drop(self, sock: socket.socket):
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _call(self, op: int, payload: bytes = b"") -> bytes:
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                write_frame(sock, op, payload)
+            except (BrokenPipeError, ConnectionResetError, ConnectionRefusedError, FileNotFoundError):
+                # 请求帧不完整，服务端不会执行：可以安全地重连重试
+                self._drop(sock)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                # 例如发送超时：不知道服务端收到了多少
+                self._drop(sock)
+                raise
+            try:
+                status, body = read_frame(sock)
+            except Exception:
+                # 请求已发出，连接状态未知：丢弃连接，不重试
+                self._drop(sock)
+                raise
+            break
+        if status != STATUS_OK:
+            raise InferenceError(body.decode("utf-8", "replace"))
+        return body
+
+    def ping(self) -> bool:
+        return self._call(OP_PING) == b"pong"
+
+    def transcribe(self, file_path: str, profile: str = "default") -> List[Dict]:
+        # payload: profile_len:u8 profile path
+        name = profile.encode("utf-8")
+        payload = bytes([len(name)]) + name + os.path.abspath(file_path).encode("utf-8")
+        return decode_segments(self._call(OP_TRANSCRIBE, payload))
+
+    def ner_detect(self, text: str) -> List[str]:
+        return decode_types(self._call(OP_NER_DETECT, text.encode("utf-8"))[0])
+
+    def redact(self, text: str, allowed_types: List[str]) -> Tuple[str, List[str]]:
+        payload = bytes([encode_types(allowed_types)]) + text.encode("utf-8")
+        body = self._call(OP_REDACT, payload)
+        return body[1:].decode("utf-8"), decode_types(body[0])
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> InferenceClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient(INFERENCE_SOCKET)
+    return _client
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+本地共享推理服务
+
+单个长驻进程持有 Whisper 和 spaCy 模型，通过 Unix domain socket 为同一节点上的
+所有 uvicorn worker 提供转录 / NER / 脱敏，worker 进程本身不再加载模型，
+HTTP 并发可以独立于模型内存扩展。协议见 inference_client.py。
+
+用法（在 ingestion/ 目录下）:
+    python inference_server.py --socket /tmp/ci-inference.sock
+    INFERENCE_SOCKET=/tmp/ci-inference.sock uvicorn main:app --workers 4
+"""
+import argparse
+import logging
+import os
+import socketserver
+import time
+
+import inference_client as protocol
+from asr import transcribe
+import ner_backends
+import pii
+import pii_ner
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("inference_server")
+
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    """一条连接上循环处理请求帧，直到客户端断开"""
+
+    def handle(self):
+        sock = self.request
+        while True:
+            try:
+                op, payload = protocol.read_frame(sock)
+            except (ConnectionError, OSError):
+                return
+            except protocol.InferenceError as e:
+                protocol.write_frame(sock, protocol.STATUS_ERROR, str(e).encode("utf-8"))
+                return
+
+            try:
+                body = self.dispatch(op, payload)
+                protocol.write_frame(sock, protocol.STATUS_OK, body)
+            except Exception as e:
+                logger.error(f"Inference op {op} failed: {e}")
+                try:
+                    protocol.write_frame(sock, protocol.STATUS_ERROR, str(e).encode("utf-8"))
+                except OSError:
+                    return
+
+    @staticmethod
+    def dispatch(op: int, payload: bytes) -> bytes:
+        if op == protocol.OP_PING:
+            return b"pong"
+
+        if op == protocol.OP_TRANSCRIBE:
+            started = time.perf_counter()
+            profile = payload[1:1 + payload[0]].decode("utf-8")
+            path = payload[1 + payload[0]:].decode("utf-8")
+            segments = transcribe.transcribe_local(path, profile)
+            logger.info(f"Transcribed {os.path.basename(path)} ({profile}): {len(segments)} segments in "
+                        f"{time.perf_counter() - started:.2f}s")
+            return protocol.encode_segments(segments)
+
+        if op == protocol.OP_NER_DETECT:
+            detected = pii_ner.ner_detect_local(payload.decode("utf-8"))
+            return bytes([protocol.encode_types(detected)])
+
+        if op == protocol.OP_REDACT:
+            allowed = protocol.decode_types(payload[0])
+            redacted, found = pii.redact_local(payload[1:].decode("utf-8"), allowed)
+            return bytes([protocol.encode_types(found)]) + redacted.encode("utf-8")
+
+        raise ValueError(f"unknown op {op}")
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path: str, warm_up: bool = True):
+    # 服务端自己必须在本进程推理，不能再作为客户端转发
+    protocol.INFERENCE_SOCKET = None
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    # NER 后端不可用时不提供服务（否则客户端收到的是未脱敏姓名的文本）
+    ner_backends.validate_backend()
+    if warm_up:
+        started = time.perf_counter()
+        transcribe.warm_up()
+        pii_ner.ner_detect_local("Warm up with John Smith.")
+        pii.redact_local("Warm up with John Smith.", ["NAME"])
+        logger.info(f"Models warmed up in {time.perf_counter() - started:.2f}s")
+
+    with InferenceServer(socket_path, InferenceHandler) as server:
+        os.chmod(socket_path, 0o660)
+        logger.info(f"Inference server listening on {socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared Whisper/spaCy inference server over a Unix socket")
+    parser.add_argument("--socket", default=protocol.INFERENCE_SOCKET or "/tmp/ci-inference.sock")
+    parser.add_argument("--no-warm-up", action="store_true")
+    args = parser.parse_args()
+    serve(args.socket, warm_up=not args.no_warm_up)
+
+
+if __name__ == "__main__":
+    main()
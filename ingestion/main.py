@@ -1,23 +1,49 @@
-from fastapi import FastAPI, HTTPException
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+# 在导入 ctranslate2 / torch / numpy 之前分配 CPU 线程（见 resources.py）
+import resources
+resources.apply()
+
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
 from pydantic import BaseModel
-import requests
 import uuid
+import threading
 from fastapi.middleware.cors import CORSMiddleware
 from pii import redact_pii
 from pii_ner import ner_detect_pii
+from ner_backends import NER_BACKEND, validate_backend as validate_ner_backend
+import inference_client
+from redaction_cache import redact_segment
+import redaction_cache
 from fastapi import UploadFile, File
 import tempfile
 import os
-from asr.transcribe import transcribe_audio
-from asr.diarize import assign_speakers
+from asr.transcribe import DECODE_PROFILES
+from audio_pipeline import process_audio_file
 from fastapi import Response
+from fastapi.responses import StreamingResponse
 import logging
 from rag_system import RAGSystem
+from segments import DOCTOR, PATIENT, Segment
+from session_store import SessionStore
+from tracing import TRACE_HEADER, span, thread_active, trace_request
+import profiling
+from admin import require_admin
+import archive
+import export
+import contextvars
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import AdmissionScheduler, SchedulerFull, probe_duration
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 重型依赖（faster_whisper / torch / spaCy）都已改为首次使用时导入
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 app = FastAPI(title="Clinical Intelligence Ingestion Service")
 
 app.add_middleware(
@@ -31,8 +57,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 初始化RAG系统
-rag_system = RAGSystem()
+# 可选：按需性能剖析（PROFILING_ENABLED=1），关闭时不注册任何中间件
+if profiling.PROFILING_ENABLED:
+    app.middleware("http")(profiling.profile_middleware)
+    app.include_router(profiling.router)
+
+# 初始化RAG系统（延迟到启动预热或首次请求，避免导入时打开数据库）
+_rag_system = None
+_rag_lock = threading.Lock()
+
+
+def get_rag_system() -> RAGSystem:
+    global _rag_system
+    if _rag_system is None:
+        with _rag_lock:
+            if _rag_system is None:
+                _rag_system = RAGSystem()
+    return _rag_system
+
+
+# /upload-audio 准入调度（最短作业优先，见 scheduler.py）；只在事件循环线程中使用
+_scheduler = None
+
+
+def get_scheduler() -> AdmissionScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = AdmissionScheduler()
+    return _scheduler
+
+
+# /ingest 会话存储：会话过期时保存脱敏后的对话记录
+_session_store = None
+_session_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        with _session_lock:
+            if _session_store is None:
+                _session_store = SessionStore(on_expire=lambda session: get_rag_system().finish_session(session))
+    return _session_store
+
+
+# ---------- 启动预热（Feature: /ready） ----------
+
+# 启动时在后台线程中加载模型并做一次假推理；完成前 /ready 返回 503
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1").lower() in ("1", "true", "yes")
+
+startup_state = {
+    "ready": False,
+    "import_seconds": round(IMPORT_SECONDS, 3),
+    "startup_seconds": None,
+    "steps": {},
+    "error": None,
+}
+
+
+def _warm_up():
+    started = time.perf_counter()
+
+    def step(name, func):
+        t0 = time.perf_counter()
+        func()
+        startup_state["steps"][name] = round(time.perf_counter() - t0, 3)
+        logger.info(f"Warm-up step {name} done in {startup_state['steps'][name]}s")
+
+    try:
+        step("rag_system", get_rag_system)
+        # NER 后端不可用时不能就绪（否则姓名会漏脱敏）；使用共享推理服务时由服务端校验
+        if not inference_client.INFERENCE_SOCKET:
+            step("ner_backend", validate_ner_backend)
+        if WARMUP_ON_STARTUP:
+            from asr.transcribe import warm_up as warm_up_asr
+            step("whisper", warm_up_asr)
+            step("ner", lambda: redact_pii("Warm up with John Smith.", ner_detect_pii("Warm up with John Smith.")))
+        startup_state["ready"] = True
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        startup_state["error"] = str(e)
+    finally:
+        startup_state["startup_seconds"] = round(time.perf_counter() - started, 3)
+        logger.info(f"Startup timings: {startup_state}")
 
 # ---------- 数据模型（统一 payload） ----------
 
@@ -45,6 +152,8 @@ class IngestRequest(BaseModel):
 class IngestResponse(BaseModel):
     session_id: str
     result: dict
+    session: dict | None = None
+    timings: dict | None = None
 
 
 # ---------- 核心处理逻辑（Feature 1 & 2 共用） ----------
@@ -52,26 +161,38 @@ class IngestResponse(BaseModel):
 def process_input(payload: dict) -> dict:
     raw_text = payload["content"]
 
-    detected_types = ner_detect_pii(raw_text)
-
-    redacted_text, entities = redact_pii(
-        raw_text,
-        allowed_types=detected_types
-    )
+    # NER 检测 + 脱敏（相同文本命中片段缓存）
+    with span("redact"):
+        redaction = redact_segment(raw_text)
 
     return {
         "raw_text": raw_text,
-        "redacted_text": redacted_text,
-        "redaction_summary": entities,
-        "detected_by": "spacy_ner",
-        "detected_entity_types": detected_types,
+        "redacted_text": redaction.text,
+        "redaction_summary": list(redaction.entities),
+        "redaction_spans": [list(s) for s in redaction.spans],
+        "detected_by": f"{NER_BACKEND}_ner",
+        "detected_entity_types": list(redaction.detected_types),
         "note": "phase1 semantic-assisted pii redaction"
     }
 
+def process_session_message(session_id: str, text: str, speaker: str | None, result: dict) -> dict:
+    """把一条消息累积到会话中：只处理这条消息，身份和医疗信息跨消息累积"""
+    speaker = {"doctor": DOCTOR, "patient": PATIENT}.get((speaker or "").lower())
+
+    with get_session_store().session(session_id) as session:
+        session.add_utterance(speaker, result["redacted_text"])
+        update = get_rag_system().process_utterance(session, Segment(speaker, text))
+        return dict(session.summary(), new_medical_info=update["new_medical_info"])
+
 # ---------- HTTP Adapter（Feature 1 用） ----------
 
 @app.post("/ingest", response_model=IngestResponse)
-def ingest(req: IngestRequest):
+def ingest(
+    req: IngestRequest,
+    response: Response,
+    timings: bool = False,
+    x_request_id: str | None = Header(default=None),
+):
     session_id = req.session_id or str(uuid.uuid4())
 
     payload = {
@@ -81,12 +202,31 @@ def ingest(req: IngestRequest):
         "mode": "batch"
     }
 
-    result = process_input(payload)
+    with trace_request("ingest", x_request_id) as trace:
+        result = process_input(payload)
+        with span("session"):
+            session = process_session_message(session_id, req.text, req.speaker, result)
 
-    return {
+    response.headers[TRACE_HEADER] = trace.trace_id
+
+    body = {
         "session_id": session_id,
-        "result": result
+        "result": result,
+        "session": session
     }
+    if timings:
+        body["timings"] = trace.to_dict()
+    return body
+
+
+@app.delete("/ingest/session/{session_id}")
+def close_session(session_id: str):
+    """结束会话：保存脱敏后的对话记录并释放会话状态"""
+    session = get_session_store().close(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    get_rag_system().finish_session(session)
+    return {"session_id": session_id, "session": session.summary()}
 
 
 @app.get("/health")
@@ -94,83 +234,84 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready(response: Response):
+    """就绪探针：模型预热完成后才返回 200（/health 只表示进程存活）"""
+    if not startup_state["ready"]:
+        response.status_code = 503
+    return startup_state
+
+
 @app.post("/upload-audio")
-async def upload_audio(file: UploadFile = File(...)):
-    logger.info(f"Received audio file: {file.filename}, size: {file.size}")
+async def upload_audio(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    profile: str = "default",
+    timings: bool = False,
+    x_request_id: str | None = Header(default=None),
+    x_client_id: str | None = Header(default=None),
+):
+    logger.info(f"Received audio file: {file.filename}, size: {file.size}, profile: {profile}")
     
     # 验证文件类型
     if not file.content_type or not file.content_type.startswith('audio/'):
         raise HTTPException(status_code=400, detail="File must be an audio file")
-    
+
+    # 验证解码配置（preview: 快速草稿，final: 高质量）
+    if profile not in DECODE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile '{profile}', expected one of {sorted(DECODE_PROFILES)}")
+
+    with trace_request("upload-audio", x_request_id) as trace:
+        # 没有 X-Client-ID 时按 IP 区分（加前缀，避免与显式 ID 冲突），调度器对其不做单客户端限流
+        if x_client_id:
+            client_id, explicit_client = x_client_id, True
+        else:
+            client_id, explicit_client = f"ip:{request.client.host if request.client else 'unknown'}", False
+        body = await _run_audio_pipeline(file, profile, client_id, explicit_client)
+
+    response.headers[TRACE_HEADER] = trace.trace_id
+    if timings:
+        body["timings"] = trace.to_dict()
+    return body
+
+
+def _process_in_worker(tmp_path: str, profile: str, size: int) -> dict:
+    # 登记工作线程，采样剖析只统计本请求实际占用的线程
+    with thread_active():
+        return process_audio_file(tmp_path, profile, get_rag_system(), size=size)
+
+
+async def _run_audio_pipeline(file: UploadFile, profile: str, client_id: str, explicit_client: bool = True) -> dict:
     # 保存临时文件
-    suffix = os.path.splitext(file.filename or "audio.wav")[-1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        content = await file.read()
-        tmp.write(content)
-        tmp_path = tmp.name
+    with span("save_upload"):
+        suffix = os.path.splitext(file.filename or "audio.wav")[-1]
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            content = await file.read()
+            tmp.write(content)
+            tmp_path = tmp.name
     
     logger.info(f"Saved temporary file: {tmp_path}")
 
     try:
-        # 1. 转录音频
-        logger.info("Starting audio transcription...")
-        segments = transcribe_audio(tmp_path)
-        logger.info(f"Transcription complete: {len(segments)} segments")
-        
-        # 2. 说话人识别
-        logger.info("Assigning speakers...")
-        transcript = assign_speakers(segments)
-        
-        # 3. 合并完整转录文本用于RAG处理
-        full_text = " ".join([seg["text"] for seg in transcript])
-        logger.info(f"Full transcript: {full_text[:200]}...")
-        
-        # 4. RAG系统处理 - 患者识别和医疗记录检索
-        logger.info("Starting RAG processing...")
-        rag_result = rag_system.process_conversation(full_text)
-        
-        # 5. PII 检测和脱敏
-        logger.info("Starting PII detection and redaction...")
-        detected_types = ner_detect_pii(full_text)
-        logger.info(f"Detected PII types: {detected_types}")
-        
-        # 对每个片段进行脱敏
-        redacted_transcript = []
-        all_redacted_entities = set()
-        
-        for seg in transcript:
-            redacted_text, entities = redact_pii(
-                seg["text"],
-                allowed_types=detected_types
+        # 按音频时长排队（短录音优先），拿到执行槽后在线程池中运行，不阻塞事件循环
+        # 读容器头是文件 I/O（PyAV），同样放到线程池
+        with span("probe_duration"):
+            audio_seconds, source = await asyncio.get_running_loop().run_in_executor(
+                None, probe_duration, tmp_path, len(content)
             )
-            redacted_transcript.append({
-                "speaker": seg["speaker"],
-                "text": redacted_text
-            })
-            all_redacted_entities.update(entities)
-
-        logger.info(f"Processing complete. Patient identified: {rag_result['patient_identified']}")
-        
-        # 6. 构建响应
-        response = {
-            "transcript": redacted_transcript,
-            "redaction_summary": list(all_redacted_entities),
-            "detected_entity_types": detected_types,
-            "processing_note": "Phase 1: Audio transcription with speaker identification, PII redaction, and medical record retrieval",
-            "segments_count": len(segments),
-            # RAG结果
-            "patient_identified": rag_result["patient_identified"],
-            "patient_id": rag_result["patient_id"],
-            "medical_records": rag_result["medical_records"],
-            "extracted_patient_info": rag_result["extracted_info"]
-        }
-        
-        # 如果有RAG错误，添加到响应中
-        if rag_result.get("error"):
-            response["rag_error"] = rag_result["error"]
-        
-        return response
-        
+        with span("queue", audio_seconds=round(audio_seconds, 1), duration_source=source, client=client_id):
+            job = await get_scheduler().acquire(client_id, audio_seconds, profile, source, explicit_client)
+        try:
+            # 复制 contextvars，线程中的 span 仍记在本请求的 trace 下
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                None, context.run, _process_in_worker, tmp_path, profile, len(content)
+            )
+        finally:
+            get_scheduler().release(job)
+    except SchedulerFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing audio: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Audio processing failed: {str(e)}")
@@ -187,7 +328,7 @@ async def upload_audio(file: UploadFile = File(...)):
 async def get_patient_records(patient_id: str):
     """获取特定患者的医疗记录"""
     try:
-        records = rag_system.retrieve_medical_context(patient_id)
+        records = get_rag_system().retrieve_medical_context(patient_id)
         return {
             "patient_id": patient_id,
             "records": records,
@@ -198,11 +339,36 @@ async def get_patient_records(patient_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/patient/{patient_id}/summary")
+async def get_patient_summary(patient_id: str):
+    """患者摘要：分类计数、最近就诊时间、最近症状（读 patient_summary 一行，不扫描病历）"""
+    summary = get_rag_system().medical_db.get_patient_summary(patient_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f"No records for patient {patient_id}")
+    return summary
+
+
+@app.get("/patients/summary", dependencies=[Depends(require_admin)])
+async def list_patient_summaries(limit: int = 50, before: str | None = None):
+    """仪表盘列表：按最近活动倒序的患者摘要；before 传上一页返回的 next_before 翻页（会枚举全部患者，需管理员令牌）"""
+    limit = max(1, min(limit, 500))
+    cursor = tuple(before.split("|", 1)) if before else None
+    if cursor is not None and len(cursor) != 2:
+        raise HTTPException(status_code=400, detail="before must be '<updated_at>|<patient_id>'")
+    summaries = get_rag_system().medical_db.list_patient_summaries(limit, cursor)
+    last = summaries[-1] if len(summaries) == limit else None
+    return {
+        "patients": summaries,
+        "count": len(summaries),
+        "next_before": f"{last['updated_at']}|{last['patient_id']}" if last else None,
+    }
+
+
 @app.delete("/medical-record/{record_id}")
 async def delete_medical_record(record_id: int):
     """删除特定的医疗记录"""
     try:
-        success = rag_system.delete_medical_record(record_id)
+        success = get_rag_system().delete_medical_record(record_id)
         if success:
             return {"message": "Medical record deleted successfully", "record_id": record_id}
         else:
@@ -212,6 +378,68 @@ async def delete_medical_record(record_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/admin/cache-stats", dependencies=[Depends(require_admin)])
+def cache_stats():
+    """进程内缓存的命中率等统计"""
+    return {
+        "medical_records": get_rag_system().records_cache.stats(),
+        "redaction": redaction_cache.cache_stats(),
+        "ingest_sessions": get_session_store().stats(),
+        "write_behind": get_rag_system().write_behind.stats() if get_rag_system().write_behind else None,
+    }
+
+
+@app.get("/admin/scheduler", dependencies=[Depends(require_admin)])
+def scheduler_state():
+    """/upload-audio 调度队列：运行中/排队中的作业、各客户端占用、排队时间"""
+    return get_scheduler().snapshot()
+
+
+@app.get("/admin/resources", dependencies=[Depends(require_admin)])
+def resource_budget():
+    """生效的 CPU 线程预算（容器配额、进程数、ASR / BLAS / 线程池线程数）"""
+    return resources.effective_config()
+
+
+@app.post("/admin/maintenance", dependencies=[Depends(require_admin)])
+def run_maintenance(older_than_days: float = archive.ARCHIVE_AFTER_DAYS, vacuum: bool = archive.MAINTENANCE_VACUUM):
+    """归档旧对话到冷存储，然后 ANALYZE / VACUUM 各数据库"""
+    rag = get_rag_system()
+    return archive.run_maintenance(rag.medical_db, rag.patient_db, older_than_days, vacuum)
+
+
+@app.get("/admin/export", dependencies=[Depends(require_admin)])
+def export_records(
+    tables: str = ",".join(export.TABLES),
+    patient_id: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    cursor: str | None = None,
+    batch_size: int = export.EXPORT_BATCH_SIZE,
+):
+    """
+    流式批量导出（NDJSON）
+    
+    每批数据之后有一行 {"table": "_checkpoint", "cursor": ...}；中断后带上最后一个 cursor 重新请求即可续传
+    """
+    table_names = [t for t in tables.split(",") if t]
+    unknown = set(table_names) - set(export.TABLES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tables {sorted(unknown)}, expected {list(export.TABLES)}")
+    try:
+        export.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        export.stream_ndjson(
+            get_rag_system().medical_db, cursor,
+            tables=table_names, patient_id=patient_id, since=since, until=until,
+            batch_size=max(1, min(batch_size, 10000)),
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
 @app.post("/initialize-sample-data")
 async def initialize_sample_data():
     """初始化示例数据（仅用于演示）"""
@@ -225,7 +453,14 @@ async def initialize_sample_data():
     
 @app.on_event("startup")
 def startup_event():
-    print("FastAPI started. Ready to accept requests.")
+    print(f"FastAPI started in {IMPORT_SECONDS:.2f}s (imports). Warming up models in background...")
+    # 流水线在事件循环的默认线程池中运行，大小与 CPU 预算中的并发流水线数一致
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=resources.get_budget()["executor_threads"], thread_name_prefix="pipeline")
+    )
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    # MAINTENANCE_INTERVAL_HOURS > 0 时定时归档 + VACUUM
+    archive.start_maintenance_scheduler(lambda: (get_rag_system().medical_db, get_rag_system().patient_db))
     # 注释掉自动初始化，避免重复数据
     # try:
     #     from database import init_sample_data
@@ -234,6 +469,16 @@ def startup_event():
     # except Exception as e:
     #     logger.warning(f"Failed to initialize sample data: {e}")
 
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # 活跃会话写入 SQLite，重启后可以继续
+    if _session_store is not None:
+        _session_store.flush()
+    # 写后缓冲中剩余的操作落库（失败时下次启动重放日志）
+    if _rag_system is not None and _rag_system.write_behind is not None:
+        _rag_system.write_behind.close()
+
 @app.options("/upload-audio")
 def options_upload_audio():
     return Response(
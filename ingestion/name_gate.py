@@ -0,0 +1,101 @@
+# NER 前置过滤：快速判断一段文本是否可能包含人名
+#
+# 大部分临床话语（"Okay."、"It hurts here."）不可能包含 PERSON 实体，
+# 对它们跑完整的 spaCy 管线是浪费。这里用词形（首字母大写）+ 常用词表 + 姓名词典
+# 在微秒级做判断：只要有一点可能是人名就返回 True（宁可多跑 NER，不能漏脱敏）。
+# 漏检率见 benchmarks/name_gate_eval.py。
+import os
+import re
+
+NER_GATE_ENABLED = os.getenv("NER_GATE_ENABLED", "1").lower() in ("1", "true", "yes")
+
+# 规则或词表变化时更新（参与脱敏缓存的版本号）
+GATE_VERSION = 1
+
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z'\-]*")
+
+# ===============================
+# 姓名词典（小写）- 常见英文名 / 姓
+# ===============================
+NAME_GAZETTEER = frozenset("""
+aaron abigail adam adrian aiden alan albert alex alexander alexandra alice alicia allison amanda amber amy
+andrea andrew angela ann anna anne anthony antonio arthur ashley austin barbara benjamin betty beverly
+billy bobby brandon brenda brian brittany bruce bryan carl carlos carol caroline catherine charles charlotte
+cheryl chloe christian christina christine christopher cynthia daniel danielle david deborah debra denise
+dennis diana diane donald donna doris dorothy douglas dylan edward elizabeth ellen emily emma eric ethan
+eugene evelyn frances frank gabriel gary george gerald gloria grace gregory hannah harold heather helen
+henry isabella jack jacob jacqueline james janet janice jason jean jeffrey jennifer jeremy jerry jesse
+jessica joan joe john johnny jonathan jon jordan jose joseph joshua joyce juan judith judy julia julie
+justin karen katherine kathleen kathryn kayla keith kelly kenneth kevin kimberly kyle larry laura lauren
+lawrence linda lisa logan lori louis madison margaret maria marie marilyn mark martha mary matthew megan
+melissa michael michelle mildred nancy natalie nathan nicholas nicole noah olivia pamela patricia patrick
+paul peter philip phillip rachel ralph randy raymond rebecca richard robert roger ronald rose roy russell
+ruth ryan samantha samuel sandra sara sarah scott sean sharon shirley sophia stephanie stephen steven
+susan teresa terry theresa thomas timothy tyler victoria vincent virginia walter wayne william willie
+zachary
+bob bill ben dan dave jim jimmy joy kate liz mike nick sam steve tom tony
+adams allen anderson bailey baker barnes bell bennett brooks brown bryant butler campbell carter clark
+collins cook cooper cox cruz davis diaz edwards evans fisher flores foster garcia gomez gonzalez gray
+green griffin hall harris hayes henderson hernandez hill howard hughes jackson james jenkins johnson
+jones kelly kim king lee lewis long lopez martin martinez miller mitchell moore morales morgan morris
+murphy myers nelson nguyen ortiz parker patel perez perry peterson phillips powell price ramirez reed
+reyes richardson rivera roberts robinson rodriguez rogers ross russell sanchez sanders scott smith
+stewart stuart sullivan taylor thomas thompson torres turner walker ward watson white williams wilson
+wood wright young
+""".split())
+
+# ===============================
+# 常用词（小写）- 首字母大写时也不视为人名线索
+# ===============================
+COMMON_WORDS = frozenset("""
+a about after again all also am an and any are as ask at back be because been before being but by
+can could did do does doing don't done down each even every few for from get go going good got had
+has have having he her here him his how i i'd i'll i'm i've if in into is it it's its just know
+last let let's like little long look lot make may maybe me might more most much must my need never
+new no not now of off oh ok okay on once one only or other our out over please pretty quite really
+right said same say see she should since so some something still such sure take tell than thank
+thanks that that's the their them then there there's these they thing think this those through to
+today too try two um uh under until up us very want was way we well were what what's when where which
+while who why will with would yeah yep yes yet you you're your
+hi hello hey good morning afternoon evening bye sorry alright fine great nice perfect exactly sure
+actually usually sometimes currently recently lately probably basically honestly anyway mostly
+yesterday tomorrow tonight week weeks month months year years day days hour hours ago next every
+nothing everything anything someone everyone keep come drink rest call eat sleep stop start started
+around again take taking took feel feeling felt three four five six seven eight nine ten
+monday tuesday wednesday thursday friday saturday sunday
+january february march april may june july august september october november december
+doctor dr nurse patient mr mrs ms sir madam
+pain headache fever cough nausea dizzy tired fatigue hurt hurts ache cold sick stomach stomachache
+chest back head throat knee arm leg blood pressure heart medicine medication pills prescription
+allergic allergy allergies history diagnosis treatment symptoms test tests results
+""".split())
+
+# 姓名线索词（与 pii_ner.NAME_TRIGGERS 一起使用）
+_TITLE_PATTERN = re.compile(r"\b(?:dr|mr|mrs|ms|miss|doctor|nurse)\.?\s+[a-z]", re.IGNORECASE)
+
+
+def might_contain_name(text: str) -> bool:
+    """
+    快速判断是否需要跑 NER
+
+    - 首字母大写且不是常用词的词 → 可能是人名
+    - 词典中的姓名（无论大小写，排除常用词）→ 可能是人名
+    - 称谓 + 单词（"Dr. smith"）→ 可能是人名
+    """
+    if _TITLE_PATTERN.search(text):
+        return True
+
+    for match in _TOKEN.finditer(text):
+        token = match.group(0)
+        lowered = token.lower()
+        if token[0].isupper():
+            if lowered not in COMMON_WORDS or lowered in NAME_GAZETTEER:
+                return True
+        elif lowered in NAME_GAZETTEER and lowered not in COMMON_WORDS:
+            return True
+    return False
+
+
+def needs_ner(text: str) -> bool:
+    """开关关闭时总是返回 True"""
+    return not NER_GATE_ENABLED or might_contain_name(text)
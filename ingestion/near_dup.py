@@ -0,0 +1,142 @@
+# 近似重复病历检测（MinHash + LSH 分段索引）
+#
+# 每次就诊都会新增 "Patient reports: ..." 之类只差一个词或一个脱敏占位符的记录。
+# 以记录的词集合（脱敏占位符统一成一个词）的 Jaccard 相似度判断是否近似重复。
+#
+# 写入时计算 MinHash 签名，切成 b 段、每段 r 个值，每段哈希成一个整数存入 record_bands，
+# 按 (patient_id, record_type, band, value) 建索引。插入时只做 b 次索引查找取候选，
+# 再对候选计算精确 Jaccard —— 开销与该患者的历史记录数量无关。
+#
+# r / b 由阈值推出：在阈值处被召回的概率 >= LSH_RECALL 的前提下取最大的 r（候选最少）。
+# 短文本上 64 位 SimHash 一个词的差异就有 10~15 位，和无关文本（~30 位）区分度不够，所以用 MinHash。
+#
+# 词袋相似度看不出剂量和否定的差异（"Metformin 500mg" / "Metformin 1000mg"，"no chest pain, fever" /
+# "chest pain, no fever"），所以：
+#   - 否定词（no / not / denies ...）之后、同一分句内的词加 "not:" 前缀，与肯定的同一个词不相等
+#   - 含数字的词和被否定的词是"硬特征"：两条记录的硬特征不完全相同就不算重复，不论 Jaccard 多高
+#   - 只有 DEDUP_RECORD_TYPES 中的记录类型做近似去重，其余类型只跳过完全相同的记录
+#
+#   DEDUP_SIMILARITY    Jaccard 阈值（默认 0.8）
+#   DEDUP_POLICY        off（默认，只跳过完全相同的）| skip（保留旧记录，丢弃新记录）| merge（用新内容更新旧记录）
+#   DEDUP_RECORD_TYPES  允许近似去重的记录类型（逗号分隔）；默认是叙述性、逐次就诊重复出现的类型，
+#                       不含药物、化验、就诊记录
+import hashlib
+import os
+import re
+from typing import FrozenSet, List, Tuple
+
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.8"))
+DEDUP_POLICY = os.getenv("DEDUP_POLICY", "off").lower()
+DEDUP_RECORD_TYPES = frozenset(
+    t.strip() for t in os.getenv(
+        "DEDUP_RECORD_TYPES", "Current Symptoms,Conversation Notes,Doctor Notes,Medical History"
+    ).split(",") if t.strip()
+)
+
+POLICIES = ("skip", "merge", "off")
+NUM_PERM = 64
+LSH_RECALL = 0.99
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_TOKEN_PATTERN = re.compile(r"\[[A-Z_]+\]|[A-Za-z0-9]+(?:'[A-Za-z]+)?")
+# 脱敏占位符之间的差异不算内容差异
+_PLACEHOLDER = "[pii]"
+# 否定词的作用范围：到分句结束（标点、but / however），至多 NEGATION_SCOPE 个词
+_CLAUSE_PATTERN = re.compile(r"[.,;:!?\n]|\b(?:but|however|although|except)\b", re.IGNORECASE)
+_NEGATIONS = frozenset({"no", "not", "denies", "denied", "deny", "without", "never", "negative", "none", "nor"})
+NEGATION_SCOPE = 5
+_NEGATED = "not:"
+# 分段布局之外的分词版本；分词规则变化时 record_bands 需要重建
+_TOKENIZER_VERSION = "t2"
+
+
+def _permutations() -> List[Tuple[int, int]]:
+    """固定种子的哈希族参数（写入数据库的签名必须跨进程一致）"""
+    params = []
+    for i in range(NUM_PERM):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "big") % (_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:], "big") % _PRIME
+        params.append((a, b))
+    return params
+
+
+_PERMUTATIONS = _permutations()
+
+
+def _is_negation(token: str) -> bool:
+    return token in _NEGATIONS or token.endswith("n't")
+
+
+def tokens(text: str) -> FrozenSet[str]:
+    result = set()
+    for clause in _CLAUSE_PATTERN.split(text):
+        scope = 0
+        for token in _TOKEN_PATTERN.findall(clause):
+            if token.startswith("["):
+                result.add(_PLACEHOLDER)
+                continue
+            token = token.lower()
+            if _is_negation(token):
+                result.add(token)
+                scope = NEGATION_SCOPE
+            elif scope:
+                result.add(_NEGATED + token)
+                scope -= 1
+            else:
+                result.add(token)
+    return frozenset(result)
+
+
+def hard_features(token_set: FrozenSet[str]) -> FrozenSet[str]:
+    """剂量、数值和被否定的词：不同就不是重复"""
+    return frozenset(t for t in token_set if t.startswith(_NEGATED) or any(c.isdigit() for c in t))
+
+
+def dedup_allowed(record_type: str) -> bool:
+    """该记录类型是否做近似去重"""
+    return record_type in DEDUP_RECORD_TYPES
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def band_layout(similarity: float = DEDUP_SIMILARITY) -> Tuple[int, int]:
+    """阈值 → (段数 b, 每段行数 r)"""
+    similarity = min(max(similarity, 0.05), 1.0)
+    best = (NUM_PERM, 1)
+    for rows in range(1, NUM_PERM + 1):
+        count = NUM_PERM // rows
+        if 1 - (1 - similarity ** rows) ** count >= LSH_RECALL:
+            best = (count, rows)
+    return best
+
+
+def layout_key(similarity: float = DEDUP_SIMILARITY) -> str:
+    """索引布局标识；变化时 record_bands 需要重建"""
+    count, rows = band_layout(similarity)
+    return f"minhash{NUM_PERM}:b{count}:r{rows}:{_TOKENIZER_VERSION}"
+
+
+def signature(token_set: FrozenSet[str]) -> List[int]:
+    if not token_set:
+        return [_MAX_HASH] * NUM_PERM
+    values = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big")
+              for t in token_set]
+    return [min(((a * v + b) % _PRIME) & _MAX_HASH for v in values) for a, b in _PERMUTATIONS]
+
+
+def bands(text: str, similarity: float = DEDUP_SIMILARITY) -> List[Tuple[int, int]]:
+    """记录文本的 LSH 分段 [(段序号, 段哈希值)]，值为有符号 64 位（SQLite INTEGER）"""
+    count, rows = band_layout(similarity)
+    sig = signature(tokens(text))
+    result = []
+    for i in range(count):
+        chunk = ",".join(map(str, sig[i * rows:(i + 1) * rows]))
+        value = int.from_bytes(hashlib.blake2b(chunk.encode(), digest_size=8).digest(), "big", signed=True)
+        result.append((i, value))
+    return result
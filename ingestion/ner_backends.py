@@ -0,0 +1,332 @@
+# 可插拔 NER 后端
+#
+# pii.py / pii_ner.py 只需要一件事：文本中 PERSON 实体的字符区间。
+# 这里把它抽象成 NERBackend.person_spans()，由 NER_BACKEND 选择实现：
+#
+#   spacy      - spaCy en_core_web_sm（默认，原有行为）
+#   gazetteer  - 纯规则 + 姓名词典，无模型，最快、召回最低
+#   onnx       - ONNX Runtime CPU 上跑量化的 token-classification 模型（BERT 类 NER）
+#
+# 各后端的吞吐 / 延迟 / 召回见 benchmarks/ner_backends_bench.py。
+#
+# ONNX 模型目录需包含 model.onnx、tokenizer.json、config.json（含 id2label），
+# 可以用 `python ner_backends.py export --model dslim/bert-base-NER --output models/ner-onnx`
+# 导出并做动态 int8 量化（需要 transformers，仅构建时使用）。
+# onnxruntime 和 tokenizers 已经是 faster-whisper 的依赖。
+# 模型一次最多看 ONNX_NER_MAX_TOKENS 个 token：更长的文本切成相互重叠 ONNX_NER_STRIDE 个 token 的窗口
+# 分别推理，各窗口的实体区间（偏移都相对原文）合并后返回。
+#
+# 配置的后端在服务启动时由 validate_backend() 加载并试跑（见 main.py 的 /ready）；
+# 加载失败时服务不会就绪，而不是在脱敏时悄悄跳过姓名。
+import logging
+import os
+import re
+import threading
+from typing import List, Tuple
+
+from name_gate import COMMON_WORDS, NAME_GAZETTEER
+
+logger = logging.getLogger(__name__)
+
+NER_BACKEND = os.getenv("NER_BACKEND", "spacy").lower()
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+ONNX_NER_MODEL_DIR = os.getenv("ONNX_NER_MODEL_DIR", "models/ner-onnx")
+ONNX_NER_THREADS = int(os.getenv("ONNX_NER_THREADS", "1"))
+ONNX_NER_MAX_TOKENS = int(os.getenv("ONNX_NER_MAX_TOKENS", "512"))
+ONNX_NER_STRIDE = int(os.getenv("ONNX_NER_STRIDE", "128"))
+
+# 规则后端的规则变化时更新
+GAZETTEER_VERSION = 1
+
+Span = Tuple[int, int]
+
+
+class NERBackend:
+    """NER 后端接口"""
+
+    name = "base"
+
+    def load(self):
+        """加载模型（可重复调用）"""
+
+    def person_spans(self, text: str) -> List[Span]:
+        """返回 PERSON 实体的 (start_char, end_char)，按出现顺序"""
+        raise NotImplementedError
+
+
+# ===============================
+# spaCy
+# ===============================
+class SpacyBackend(NERBackend):
+    name = "spacy"
+
+    def __init__(self, model: str = SPACY_MODEL):
+        self.model = model
+        self._nlp = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    # 延迟导入，避免服务启动时加载 spaCy
+                    import spacy
+                    self._nlp = spacy.load(self.model)
+        return self._nlp
+
+    def person_spans(self, text: str) -> List[Span]:
+        doc = self.load()(text)
+        return [(ent.start_char, ent.end_char) for ent in doc.ents if ent.label_ == "PERSON"]
+
+
+# ===============================
+# 规则 + 姓名词典
+# ===============================
+_WORD = re.compile(r"[A-Za-z][A-Za-z'\-]*")
+_TITLES = {"dr", "mr", "mrs", "ms", "miss", "doctor", "nurse"}
+
+
+class GazetteerBackend(NERBackend):
+    """
+    纯规则 PERSON 识别
+
+    - 词典中的姓名（首字母大写，或不是常用词）
+    - 称谓后面的词（"Dr. Kowalski"、"ms. okafor"）
+    - 紧跟在上述姓名后、首字母大写且不是常用词的词（姓）
+    """
+
+    name = "gazetteer"
+
+    def person_spans(self, text: str) -> List[Span]:
+        spans: List[Span] = []
+        previous = ""
+        for match in _WORD.finditer(text):
+            start, end, token = match.start(), match.end(), match.group(0)
+            lowered = token.lower()
+            is_common = lowered in COMMON_WORDS
+            # 与上一个姓名之间只有空白（"John Smith"）
+            adjacent = bool(spans) and not text[spans[-1][1]:start].strip()
+
+            if previous in _TITLES and not is_common:
+                is_name = True
+            elif lowered in NAME_GAZETTEER:
+                is_name = token[0].isupper() or not is_common
+            else:
+                is_name = adjacent and token[0].isupper() and not is_common
+
+            if is_name:
+                if adjacent:
+                    spans[-1] = (spans[-1][0], end)
+                else:
+                    spans.append((start, end))
+            previous = lowered
+        return spans
+
+
+# ===============================
+# ONNX Runtime（量化 token-classification 模型）
+# ===============================
+class OnnxBackend(NERBackend):
+    name = "onnx"
+
+    def __init__(self, model_dir: str = ONNX_NER_MODEL_DIR, threads: int = ONNX_NER_THREADS,
+                 max_tokens: int = ONNX_NER_MAX_TOKENS, stride: int = ONNX_NER_STRIDE):
+        self.model_dir = model_dir
+        self.threads = threads
+        self.max_tokens = max_tokens
+        # 重叠部分至少要能放下一个完整的姓名，又不能占满整个窗口
+        self.stride = min(stride, max_tokens // 2)
+        self._session = None
+        self._tokenizer = None
+        self._labels = None
+        self._input_names = ()
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import json
+
+                    import onnxruntime
+                    from tokenizers import Tokenizer
+
+                    if not os.path.isfile(os.path.join(self.model_dir, "model.onnx")):
+                        raise FileNotFoundError(
+                            f"ONNX NER model not found in {self.model_dir}; export one with "
+                            f"`python ner_backends.py export --output {self.model_dir}` or choose another NER_BACKEND"
+                        )
+                    with open(os.path.join(self.model_dir, "config.json"), encoding="utf-8") as f:
+                        id2label = json.load(f)["id2label"]
+                    self._labels = [id2label[str(i)] for i in range(len(id2label))]
+
+                    tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                    # 超长文本的其余部分在 encoding.overflowing 中，窗口之间重叠 stride 个 token
+                    tokenizer.enable_truncation(self.max_tokens, stride=self.stride)
+                    self._tokenizer = tokenizer
+
+                    options = onnxruntime.SessionOptions()
+                    options.intra_op_num_threads = self.threads
+                    options.inter_op_num_threads = 1
+                    session = onnxruntime.InferenceSession(
+                        os.path.join(self.model_dir, "model.onnx"),
+                        sess_options=options,
+                        providers=["CPUExecutionProvider"],
+                    )
+                    self._input_names = tuple(i.name for i in session.get_inputs())
+                    self._session = session
+        return self._session
+
+    def person_spans(self, text: str) -> List[Span]:
+        self.load()
+        encoding = self._tokenizer.encode(text)
+        spans: List[Span] = []
+        for window in [encoding] + list(encoding.overflowing):
+            spans.extend(self._window_spans(window))
+        if not encoding.overflowing:
+            return spans
+        # 重叠部分的实体会被相邻两个窗口各识别一次（可能只识别到一半），合并相交的区间
+        merged: List[Span] = []
+        for start, end in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def _window_spans(self, encoding) -> List[Span]:
+        """一个窗口（至多 max_tokens 个 token）的 PERSON 区间，偏移相对原文"""
+        import numpy as np
+
+        session = self._session
+        feeds = {
+            "input_ids": np.array([encoding.ids], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids], dtype=np.int64),
+        }
+        logits = session.run(None, {name: feeds[name] for name in self._input_names})[0][0]
+        label_ids = logits.argmax(axis=-1)
+
+        # BIO 标签 → 字符区间；子词 (B-PER, I-PER, ##xx) 合并为一个实体
+        spans: List[Span] = []
+        inside = False
+        for (start, end), special, label_id in zip(encoding.offsets, encoding.special_tokens_mask, label_ids):
+            if special or start == end:
+                inside = False
+                continue
+            label = self._labels[int(label_id)]
+            if label.endswith("PER"):
+                continuing = inside and (label.startswith("I-") or start == spans[-1][1])
+                if continuing:
+                    spans[-1] = (spans[-1][0], end)
+                else:
+                    spans.append((start, end))
+                inside = True
+            else:
+                inside = False
+        return spans
+
+
+BACKENDS = {
+    "spacy": SpacyBackend,
+    "gazetteer": GazetteerBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def backend_config_version(name: str = NER_BACKEND) -> str:
+    """后端配置标识（参与脱敏缓存的版本号），不会触发模型加载"""
+    if name == "spacy":
+        return f"spacy:{SPACY_MODEL}"
+    if name == "gazetteer":
+        return f"gazetteer:{GAZETTEER_VERSION}"
+    if name == "onnx":
+        return f"onnx:{os.path.basename(os.path.normpath(ONNX_NER_MODEL_DIR))}:w{ONNX_NER_MAX_TOKENS}s{ONNX_NER_STRIDE}"
+    raise ValueError(f"Unknown NER backend: {name}")
+
+
+def create_backend(name: str) -> NERBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown NER backend: {name} (choose from {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[name]()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> NERBackend:
+    """进程内共享的 NER 后端（pii.py 和 pii_ner.py 共用一份模型）"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(NER_BACKEND)
+    return _backend
+
+
+def validate_backend() -> NERBackend:
+    """加载配置的后端并试跑一句；失败时抛出 RuntimeError（启动时调用）"""
+    try:
+        backend = get_backend()
+        backend.load()
+        spans = backend.person_spans("My name is John Smith.")
+    except Exception as e:
+        raise RuntimeError(f"NER backend '{NER_BACKEND}' is not usable, names would not be redacted: {e}") from e
+    if not spans:
+        logger.warning(f"NER backend '{NER_BACKEND}' found no PERSON in the validation sentence")
+    return backend
+
+
+# ===============================
+# 导出 + 量化 ONNX 模型（构建时）
+# ===============================
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True):
+    """把 HuggingFace token-classification 模型导出为 ONNX，并做动态 int8 量化"""
+    import json
+
+    import torch
+    from transformers import AutoModelForTokenClassification, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForTokenClassification.from_pretrained(model_name).eval()
+
+    sample = tokenizer("My name is John Smith.", return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    float_path = os.path.join(output_dir, "model.float.onnx" if quantize else "model.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        model,
+        tuple(sample[name] for name in input_names),
+        float_path,
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=14,
+    )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(float_path, os.path.join(output_dir, "model.onnx"), weight_type=QuantType.QInt8)
+        os.remove(float_path)
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, "tokenizer.json"))
+    with open(os.path.join(output_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "id2label": {str(k): v for k, v in model.config.id2label.items()}}, f, indent=2)
+    print(f"✅ ONNX NER model written to {output_dir}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NER backend utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export a HuggingFace NER model to quantized ONNX")
+    export.add_argument("--model", default="dslim/bert-base-NER")
+    export.add_argument("--output", default=ONNX_NER_MODEL_DIR)
+    export.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+    export_onnx(args.model, args.output, quantize=not args.no_quantize)
@@ -0,0 +1,141 @@
+# 容错的患者匹配（盲索引）
+#
+# Whisper 经常把姓名转写错（"John Smith" → "Jon Smyth"），精确的 name_hash 匹配不上，
+# 回访患者就会被 add_patient 重复创建。
+#
+# 盲索引：对姓名的发音编码（Soundex + 辅音骨架）和字母三元组做带密钥的 HMAC，
+# 存入 patient_name_index(key, patient_id)，不保存任何明文姓名。每个特征都和一个
+# 佐证标识（DOB 或 SSN）绑定后再取 HMAC：
+#   - 查询只命中"同一生日/同一 SSN 且发音相近"的少数患者，倒排表很短，与患者总数无关
+#   - 只有姓名、没有 DOB/SSN 时不做模糊匹配（同名同音的人太多，容易误合并）
+#
+# 接受候选需要满足其一：
+#   - 整个姓名发音一致（每个词的 Soundex 或辅音骨架都相同，词序无关）
+#   - 特征重合度（Dice 系数）>= FUZZY_MIN_SCORE
+# 只有名字相同、姓氏不同（同一天生日的 "John Jones" 与 "John Smith"）两条都不满足。
+# 候选按佐证标识数量、整名发音是否一致、Dice 系数排序。
+#
+#   PATIENT_INDEX_KEY   HMAC 密钥。未设置时不写盲索引、不做模糊匹配（公开的默认密钥等于没有保护）；
+#                       数据库记录密钥指纹，密钥变化时旧索引在打开数据库时清空，随精确匹配逐步补建
+#   FUZZY_MATCH_ENABLED 0 关闭模糊匹配
+#   FUZZY_MIN_SCORE     发音不一致时接受候选的最低 Dice 系数
+import hashlib
+import hmac
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+PATIENT_INDEX_KEY = os.getenv("PATIENT_INDEX_KEY", "")
+# 没有密钥时模糊匹配不可用
+FUZZY_MATCH_ENABLED = os.getenv("FUZZY_MATCH_ENABLED", "1").lower() in ("1", "true", "yes") and bool(PATIENT_INDEX_KEY)
+FUZZY_MIN_SCORE = float(os.getenv("FUZZY_MIN_SCORE", "0.7"))
+
+# identify_patient 缺少信息时填入的默认值，不能作为佐证
+PLACEHOLDER_IDENTIFIERS = {"ssn": "000000000", "dob": "19000101"}
+
+_SOUNDEX = str.maketrans("bfpvcgjkqsxzdtlmnr", "111122222222334556")
+_SKELETON_RULES = [("ph", "f"), ("ck", "k"), ("q", "k"), ("c", "k"), ("z", "s"), ("x", "ks")]
+_NON_LETTER = re.compile(r"[^a-z]")
+
+_KEY = PATIENT_INDEX_KEY.encode("utf-8")
+
+if not PATIENT_INDEX_KEY:
+    logger.warning("PATIENT_INDEX_KEY is not set; fuzzy patient matching is disabled and no name index is written")
+
+
+def key_fingerprint() -> Optional[str]:
+    """当前密钥的指纹（不泄露密钥）；未设置密钥时为 None"""
+    if not _KEY:
+        return None
+    return hmac.new(_KEY, b"patient-name-index-fingerprint", hashlib.sha256).hexdigest()[:16]
+
+
+def name_tokens(name: str) -> List[str]:
+    tokens = [_NON_LETTER.sub("", part) for part in name.lower().split()]
+    return [t for t in tokens if len(t) >= 2]
+
+
+def soundex(token: str) -> str:
+    codes = token.translate(_SOUNDEX)
+    result = token[0]
+    previous = codes[0]
+    for letter, code in zip(token[1:], codes[1:]):
+        if code.isdigit() and code != previous:
+            result += code
+        # h / w 不打断相同编码；元音会打断
+        if letter not in "hw":
+            previous = code
+    return (result + "000")[:4]
+
+
+def skeleton(token: str) -> str:
+    """粗略的发音骨架：统一常见拼写变体，去掉元音/h/w/y 并合并重复字母（首字母保留）"""
+    for source, target in _SKELETON_RULES:
+        token = token.replace(source, target)
+    result = token[0]
+    for letter in token[1:]:
+        if letter in "aeiouyhw" or letter == result[-1]:
+            continue
+        result += letter
+    return result
+
+
+# 整名发音特征的前缀
+FULL_NAME_FEATURES = ("fx:", "fk:")
+
+
+def name_features(name: str) -> Set[str]:
+    """姓名 → 特征集合（每个词的发音编码 + 首尾补位的字母三元组 + 整名发音编码）"""
+    tokens = name_tokens(name)
+    features = set()
+    for token in tokens:
+        features.add(f"sx:{soundex(token)}")
+        features.add(f"sk:{skeleton(token)}")
+        padded = f"^{token}$"
+        features.update(f"ng:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    if tokens:
+        features.add("fx:" + "|".join(sorted(soundex(t) for t in tokens)))
+        features.add("fk:" + "|".join(sorted(skeleton(t) for t in tokens)))
+    return features
+
+
+def normalize_identifier(kind: str, value: Optional[str]) -> Optional[str]:
+    """SSN / DOB 只保留数字；缺失或占位值返回 None"""
+    if not value:
+        return None
+    digits = re.sub(r"\D", "", value)
+    if not digits or digits == PLACEHOLDER_IDENTIFIERS[kind]:
+        return None
+    return digits
+
+
+def blind_index(name: str, ssn: str = None, dob: str = None) -> Dict[int, Tuple[str, str]]:
+    """
+    每个 (佐证标识, 姓名特征) 组合的 HMAC，截断为有符号 64 位整数（SQLite INTEGER）
+    
+    返回 {键: (佐证标识类型, 特征)}；特征只在内存中用于打分，不写入数据库。未设置密钥时返回空
+    """
+    if not _KEY:
+        return {}
+    features = name_features(name)
+    index = {}
+    for kind, value in (("ssn", ssn), ("dob", dob)):
+        identifier = normalize_identifier(kind, value)
+        if identifier is None:
+            continue
+        for feature in features:
+            digest = hmac.new(_KEY, f"{kind}:{identifier}|{feature}".encode("utf-8"), hashlib.sha256).digest()
+            index[int.from_bytes(digest[:8], "big", signed=True)] = (kind, feature)
+    return index
+
+
+def blind_keys(name: str, ssn: str = None, dob: str = None) -> List[int]:
+    return list(blind_index(name, ssn, dob))
+
+
+def dice(overlap: int, query_features: int, candidate_features: int) -> float:
+    total = query_features + candidate_features
+    return 2 * overlap / total if total else 0.0
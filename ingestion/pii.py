@@ -1,18 +1,8 @@
 import re
 from typing import Tuple, List
-import spacy
-
-# ===============================
-# spaCy lazy loader
-# ===============================
-_nlp = None
-
-def get_nlp():
-    global _nlp
-    if _nlp is None:
-        _nlp = spacy.load("en_core_web_sm")
-    return _nlp
-
+import inference_client
+import name_gate
+from ner_backends import get_backend
 
 # ===============================
 # DATE (强规则)
@@ -50,6 +40,15 @@ def redact_pii(text: str, allowed_types: List[str] = None) -> Tuple[str, List[st
     if allowed_types is None:
         allowed_types = []
 
+    # 只有 NAME 需要 spaCy；设置了共享推理服务时交给服务端处理
+    if "NAME" in allowed_types and inference_client.INFERENCE_SOCKET:
+        return inference_client.get_client().redact(text, allowed_types)
+    return redact_local(text, allowed_types)
+
+
+def redact_local(text: str, allowed_types: List[str]) -> Tuple[str, List[str]]:
+    """redact_pii 的本进程实现（共享推理服务也调用这里）"""
+
     redacted = text
     found = []
 
@@ -64,22 +63,14 @@ def redact_pii(text: str, allowed_types: List[str] = None) -> Tuple[str, List[st
         redacted = SSN_PATTERN.sub("[SSN]", redacted)
         found.append("SSN")
 
-    # ---------- NAME (spaCy only) ----------
-    if "NAME" in allowed_types:
-        try:
-            nlp = get_nlp()
-            doc = nlp(redacted)
-
-            # 反向替换，避免 span index 失效
-            for ent in reversed(doc.ents):
-                if ent.label_ == "PERSON":
-                    redacted = (
-                        redacted[:ent.start_char]
-                        + "[NAME]"
-                        + redacted[ent.end_char:]
-                    )
-                    found.append("NAME")
-        except Exception:
-            pass
+    # ---------- NAME (NER backend only) ----------
+    # NER 出错时直接抛出：吞掉异常会返回（并缓存）未脱敏姓名的文本
+    if "NAME" in allowed_types and name_gate.needs_ner(redacted):
+        spans = get_backend().person_spans(redacted)
+
+        # 反向替换，避免 span index 失效
+        for start, end in reversed(spans):
+            redacted = redacted[:start] + "[NAME]" + redacted[end:]
+            found.append("NAME")
 
     return redacted, list(set(found))
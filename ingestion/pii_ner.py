@@ -1,17 +1,7 @@
-import spacy
 from typing import List
-
-# ===============================
-# spaCy lazy loader
-# ===============================
-_nlp = None
-
-def get_nlp():
-    global _nlp
-    if _nlp is None:
-        _nlp = spacy.load("en_core_web_sm")
-    return _nlp
-
+import inference_client
+import name_gate
+from ner_backends import get_backend
 
 # ===============================
 # NAME fallback triggers
@@ -39,24 +29,26 @@ def ner_detect_pii(text: str) -> List[str]:
     Determine which PII types are worth attempting.
 
     - NAME:
-        - spaCy detects PERSON
+        - NER backend (NER_BACKEND, default spaCy) detects PERSON
         - OR fallback trigger fires
     - DATE / SSN:
         - Not handled here (always-on in regex layer)
     """
+    if inference_client.INFERENCE_SOCKET:
+        return inference_client.get_client().ner_detect(text)
+    return ner_detect_local(text)
+
+
+def ner_detect_local(text: str) -> List[str]:
+    """ner_detect_pii 的本进程实现（共享推理服务也调用这里）"""
     detected = set()
 
-    # ---------- spaCy semantic detection ----------
-    try:
-        nlp = get_nlp()
-        doc = nlp(text)
-        for ent in doc.ents:
-            if ent.label_ == "PERSON":
-                detected.add("NAME")
-                break
-    except Exception:
-        # spaCy failure should never block redaction
-        pass
+    # ---------- NER semantic detection ----------
+    # 前置过滤：不可能含人名的文本跳过 NER
+    # NER 出错时直接抛出，不能当作"没有姓名"继续（那样姓名不会被脱敏）
+    if name_gate.needs_ner(text):
+        if get_backend().person_spans(text):
+            detected.add("NAME")
 
     # ---------- fallback trigger ----------
     if "NAME" not in detected and should_try_name_fallback(text):
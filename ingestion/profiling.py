@@ -0,0 +1,227 @@
+# 按需性能剖析（cProfile / 采样火焰图）
+#
+# 仅在 PROFILING_ENABLED=1 时由 main.py 注册中间件和 /admin/profiles 端点，
+# 关闭时请求路径上没有任何额外开销。
+# 开启后，带 X-Debug-Profile 请求头的请求，或按 PROFILE_SAMPLE_RATE 抽样的请求会被剖析，
+# 结果保存在 PROFILE_DIR 中，只保留最近 PROFILE_MAX_FILES 个文件。
+#
+# 注意：/ingest 在 Starlette 线程池、/upload-audio 在 run_in_executor 中执行，
+# cprofile 模式只能剖析事件循环线程（协程部分），看不到这些处理逻辑，
+# 而且会把同时运行的其他协程的耗时算进来。默认的 sample 模式只保留
+# 本请求所占线程的调用栈：线程进入 span() / trace_request() / thread_active()
+# 时登记（见 tracing.track_threads），事件循环线程不计入。
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse
+
+from admin import require_admin
+from tracing import ThreadActivity, track_threads
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_HEADER = "X-Debug-Profile"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# sample:   定时采样本请求所占工作线程的调用栈，输出 collapsed stacks（flamegraph.pl / speedscope）
+# cprofile: 确定性剖析（仅事件循环线程），输出 pstats
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "ingestion-profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+PROFILE_EXTENSIONS = {"cprofile": ".prof", "sample": ".collapsed"}
+
+# 同一时刻只允许一个 cProfile 处于激活状态
+_cprofile_lock = threading.Lock()
+
+
+# ===============================
+# 采样剖析器
+# ===============================
+class StackSampler:
+    """后台线程定时抓取调用栈，累计为 collapsed stacks；给定 activity 时只抓其中登记的线程"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL, activity: Optional[ThreadActivity] = None):
+        self.interval = interval
+        self.activity = activity
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            wanted = self.activity.threads() if self.activity is not None else None
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or (wanted is not None and ident not in wanted):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+# ===============================
+# 存储
+# ===============================
+_NAME_PATTERN = re.compile(r"^[\w.\-]+$")
+
+
+def _slug(path: str) -> str:
+    return re.sub(r"[^\w]+", "_", path).strip("_")[:40] or "root"
+
+
+def _store(content: bytes, method: str, path: str, mode: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    name = f"{stamp}-{method}-{_slug(path)}-{uuid.uuid4().hex[:8]}{PROFILE_EXTENSIONS[mode]}"
+    with open(os.path.join(PROFILE_DIR, name), "wb") as f:
+        f.write(content)
+    _enforce_limit()
+    return name
+
+
+def _enforce_limit():
+    """只保留最近 PROFILE_MAX_FILES 个剖析文件"""
+    files = list_profiles()
+    for info in files[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, info["name"]))
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[Dict]:
+    """按时间倒序列出已保存的剖析文件"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    files = []
+    for name in os.listdir(PROFILE_DIR):
+        ext = os.path.splitext(name)[1]
+        if ext not in PROFILE_EXTENSIONS.values():
+            continue
+        stat = os.stat(os.path.join(PROFILE_DIR, name))
+        files.append({
+            "name": name,
+            "mode": "cprofile" if ext == ".prof" else "sample",
+            "size": stat.st_size,
+            "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+        })
+    files.sort(key=lambda info: info["name"], reverse=True)
+    return files
+
+
+def _resolve(name: str) -> Optional[str]:
+    if not _NAME_PATTERN.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+# ===============================
+# 中间件
+# ===============================
+def _requested_mode(request: Request) -> Optional[str]:
+    value = request.headers.get(PROFILE_HEADER)
+    if value:
+        return value if value in PROFILE_EXTENSIONS else PROFILE_MODE
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return PROFILE_MODE
+    return None
+
+
+async def profile_middleware(request: Request, call_next):
+    mode = _requested_mode(request)
+    if mode is None or request.url.path.startswith("/admin/"):
+        return await call_next(request)
+
+    started = time.perf_counter()
+    if mode == "cprofile":
+        if not _cprofile_lock.acquire(blocking=False):
+            # 已有请求在做 cProfile，这次不剖析
+            return await call_next(request)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.disable()
+            _cprofile_lock.release()
+        profiler.create_stats()
+        content = marshal.dumps(profiler.stats)
+    else:
+        with track_threads() as activity:
+            sampler = StackSampler(activity=activity)
+            sampler.start()
+            try:
+                response = await call_next(request)
+            finally:
+                sampler.stop()
+        content = sampler.collapsed().encode()
+
+    try:
+        name = _store(content, request.method, request.url.path, mode)
+        response.headers["X-Profile-Id"] = name
+        logger.info(f"Stored {mode} profile {name} ({(time.perf_counter() - started) * 1000:.1f}ms request)")
+    except Exception as e:
+        logger.warning(f"Failed to store profile: {e}")
+    return response
+
+
+# ===============================
+# 管理端点
+# ===============================
+router = APIRouter(prefix="/admin/profiles", dependencies=[Depends(require_admin)])
+
+
+@router.get("")
+def get_profiles():
+    """列出已保存的剖析文件"""
+    return {"profiles": list_profiles(), "directory": PROFILE_DIR, "max_files": PROFILE_MAX_FILES}
+
+
+@router.get("/{name}")
+def download_profile(name: str, format: str = "raw", limit: int = 50):
+    """下载剖析文件；format=text 时返回 pstats 的文本报告（按累计耗时排序）"""
+    path = _resolve(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if format == "text" and path.endswith(".prof"):
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+        return PlainTextResponse(out.getvalue())
+
+    return FileResponse(path, filename=name, media_type="application/octet-stream")
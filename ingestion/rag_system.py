@@ -1,55 +1,85 @@
 # RAG系统核心模块
+import os
 import re
-from typing import Dict, List, Optional, Tuple
-from database import PatientDatabase, MedicalRecordsDatabase
+from typing import Dict, List, Optional, Tuple, Union
+from database import PatientDatabase, MedicalRecordsDatabase, categorize_record
 import logging
 from datetime import datetime
-from pii import redact_pii
-from pii_ner import ner_detect_pii
+from redaction_cache import redact_segment
+from tracing import traced
+from cache import LRUCache
+from segments import DOCTOR, PATIENT, Segment, format_transcript, parse_transcript, texts_by_speaker
+from write_behind import WRITE_BEHIND_DIR, WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 
+# 患者病历读缓存（按 patient_id）：RECORDS_CACHE_SIZE=0 关闭
+RECORDS_CACHE_SIZE = int(os.getenv("RECORDS_CACHE_SIZE", "1024"))
+RECORDS_CACHE_TTL = float(os.getenv("RECORDS_CACHE_TTL", "300"))
+# 多 worker 部署时每次读取先比对 patient_versions 版本号，保证跨进程一致
+RECORDS_CACHE_VERSION_CHECK = os.getenv("RECORDS_CACHE_VERSION_CHECK", "1").lower() in ("1", "true", "yes")
+
+# 对话输入：文本转录或结构化片段列表
+Transcript = Union[str, List[Segment]]
+
+
+def _segment_texts(transcript: Transcript) -> List[str]:
+    """逐片段搜索，避免正则跨片段匹配，也不需要拼接整段文本"""
+    if isinstance(transcript, str):
+        return [transcript]
+    return [seg.text for seg in transcript]
+
+
+# 姓名模式，按可信度排序（越靠前越可信）
+NAME_PATTERNS = [
+    r"my name is ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
+    r"I'm ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
+    r"name is ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
+    r"I am ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
+    r"it's ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
+    r"this is ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)"
+]
+
+NON_NAME_WORDS = ['suffering', 'having', 'feeling', 'experiencing', 'currently', 'from', 'some', 'painful', 'diseases', 'and', 'don', 't', 'know', 'what', 'else']
+
+
 class RAGSystem:
     """检索增强生成系统"""
     
-    def __init__(self):
-        self.patient_db = PatientDatabase()
-        self.medical_db = MedicalRecordsDatabase()
+    def __init__(self, patient_db: PatientDatabase = None, medical_db: MedicalRecordsDatabase = None):
+        self.patient_db = patient_db or PatientDatabase()
+        self.medical_db = medical_db or MedicalRecordsDatabase()
+        # patient_id -> (version, records)
+        self.records_cache = LRUCache(RECORDS_CACHE_SIZE, RECORDS_CACHE_TTL)
+        # 开启写后缓冲时，医疗记录和对话记录由后台线程批量落库（见 write_behind.py）
+        self.write_behind = None
+        if WRITE_BEHIND_DIR:
+            self.write_behind = WriteBehindQueue(self.medical_db, WRITE_BEHIND_DIR, on_flushed=self._invalidate_patients)
+    
+    def _invalidate_patients(self, patient_ids):
+        for patient_id in patient_ids:
+            self.records_cache.invalidate(patient_id)
     
-    def extract_patient_info(self, transcript: str) -> Dict[str, str]:
-        """从转录文本中提取患者信息"""
+    @traced("rag.extract_patient_info")
+    def extract_patient_info(self, transcript: Transcript) -> Dict[str, str]:
+        """从转录文本（或片段列表）中提取患者信息"""
         patient_info = {}
+        texts = _segment_texts(transcript)
         
         # 提取姓名 - 寻找 "my name is" 或 "I'm" 后面的内容
-        name_patterns = [
-            r"my name is ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
-            r"I'm ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
-            r"name is ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
-            r"I am ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
-            r"it's ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)",
-            r"this is ([A-Za-z\s]+?)(?:\.|,|\s+I'm|\s+I\s|\s+currently|\s+and|\s+speaking|$)"
-        ]
-        
-        for pattern in name_patterns:
-            match = re.search(pattern, transcript, re.IGNORECASE)
-            if match:
-                name = match.group(1).strip()
-                # 简单验证：姓名应该是2-4个单词，每个单词首字母大写
-                name_words = name.split()
-                if len(name_words) >= 1 and len(name_words) <= 4:
-                    # 检查是否包含明显的非姓名词汇
-                    non_name_words = ['suffering', 'having', 'feeling', 'experiencing', 'currently', 'from', 'some', 'painful', 'diseases', 'and', 'don', 't', 'know', 'what', 'else']
-                    if not any(word.lower() in non_name_words for word in name_words):
-                        patient_info['name'] = name
-                        break
+        name, _ = self._extract_name(texts)
+        if name:
+            patient_info['name'] = name
         
         # 提取SSN - 寻找XXX-XX-XXXX格式
         ssn_pattern = r"\b(\d{3}[-\s]?\d{2}[-\s]?\d{4})\b"
-        ssn_match = re.search(ssn_pattern, transcript)
-        if ssn_match:
-            ssn = re.sub(r'[-\s]', '-', ssn_match.group(1))
-            if len(ssn.replace('-', '')) == 9:
-                patient_info['ssn'] = ssn
+        for text in texts:
+            ssn_match = re.search(ssn_pattern, text)
+            if ssn_match:
+                ssn = re.sub(r'[-\s]', '-', ssn_match.group(1))
+                if len(ssn.replace('-', '')) == 9:
+                    patient_info['ssn'] = ssn
+                break
         
         # 提取出生日期 - 寻找日期格式
         dob_patterns = [
@@ -60,16 +90,36 @@ class RAGSystem:
         ]
         
         for pattern in dob_patterns:
-            match = re.search(pattern, transcript, re.IGNORECASE)
-            if match:
-                patient_info['dob'] = match.group(1).strip()
+            for text in texts:
+                match = re.search(pattern, text, re.IGNORECASE)
+                if match:
+                    patient_info['dob'] = match.group(1).strip()
+                    break
+            if 'dob' in patient_info:
                 break
         
         return patient_info
     
-    def identify_patient(self, transcript: str) -> Optional[str]:
-        """识别患者身份并返回patient_id，如果不存在则创建新患者"""
-        patient_info = self.extract_patient_info(transcript)
+    def _extract_name(self, texts: List[str]) -> Tuple[Optional[str], Optional[int]]:
+        """返回 (姓名, 命中的模式序号)，序号越小越可信"""
+        for rank, pattern in enumerate(NAME_PATTERNS):
+            for text in texts:
+                match = re.search(pattern, text, re.IGNORECASE)
+                if match:
+                    name = match.group(1).strip()
+                    # 简单验证：姓名应该是2-4个单词，每个单词首字母大写
+                    name_words = name.split()
+                    if len(name_words) >= 1 and len(name_words) <= 4:
+                        # 检查是否包含明显的非姓名词汇
+                        if not any(word.lower() in NON_NAME_WORDS for word in name_words):
+                            return name, rank
+        return None, None
+    
+    @traced("rag.identify_patient")
+    def identify_patient(self, transcript: Transcript, patient_info: Dict[str, str] = None) -> Optional[str]:
+        """识别患者身份并返回patient_id，如果不存在则创建新患者（已提取的 patient_info 可直接传入）"""
+        if patient_info is None:
+            patient_info = self.extract_patient_info(transcript)
         
         if not patient_info:
             logger.warning("No patient information found in transcript")
@@ -102,22 +152,65 @@ class RAGSystem:
         
         return patient_id
     
+    @traced("rag.retrieve_medical_context")
     def retrieve_medical_context(self, patient_id: str) -> List[Dict]:
-        """检索患者的医疗记录作为上下文"""
+        """检索患者的医疗记录作为上下文（包括写后缓冲中尚未落库的记录）"""
         if not patient_id:
             return []
+        if self.write_behind is None:
+            return self._retrieve_stored_records(patient_id)
+        
+        # 先取待落库快照再读库：快照之后落库的记录一定能从库中读到
+        pending = self.write_behind.pending_records(patient_id)
+        records = self._retrieve_stored_records(patient_id)
+        if pending:
+            stored = {(r['type'], r['content']) for r in records}
+            records = [r for r in pending if (r['type'], r['content']) not in stored] + records
+        return records
+    
+    def _retrieve_stored_records(self, patient_id: str) -> List[Dict]:
+        if not self.records_cache.enabled:
+            records = self.medical_db.get_patient_records(patient_id)
+            logger.info(f"Retrieved {len(records)} medical records for patient {patient_id}")
+            return records
+        
+        # 先读版本号再读记录：并发写入只会让缓存条目提前失效，不会返回旧数据
+        version = self.medical_db.get_patient_version(patient_id) if RECORDS_CACHE_VERSION_CHECK else None
+        cached = self.records_cache.get(patient_id, validate=lambda entry: entry[0] == version)
+        if cached is not None:
+            return list(cached[1])
         
         records = self.medical_db.get_patient_records(patient_id)
+        self.records_cache.set(patient_id, (version, records))
         logger.info(f"Retrieved {len(records)} medical records for patient {patient_id}")
         
-        return records
+        return list(records)
+    
+    def add_record(self, patient_id: str, record_type: str, content: str, metadata: Dict = None) -> str:
+        """添加医疗记录，有变化时使该患者的缓存失效（返回值见 MedicalRecordsDatabase.add_record）"""
+        action = self.medical_db.add_record(patient_id, record_type, content, metadata)
+        if action != "skipped":
+            self.records_cache.invalidate(patient_id)
+        return action
+    
+    def add_conversation(self, patient_id: str, transcript: str, summary: str = None):
+        """保存对话记录并使该患者的缓存失效"""
+        if self.write_behind is not None:
+            self.write_behind.submit_conversation(patient_id, transcript, summary)
+            return
+        self.medical_db.add_conversation(patient_id, transcript, summary)
+        self.records_cache.invalidate(patient_id)
     
     def delete_medical_record(self, record_id: int) -> bool:
         """删除特定的医疗记录"""
-        return self.medical_db.delete_medical_record(record_id)
+        patient_id = self.medical_db.get_record_patient_id(record_id)
+        deleted = self.medical_db.delete_medical_record(record_id)
+        if patient_id:
+            self.records_cache.invalidate(patient_id)
+        return deleted
     
-    def process_conversation(self, transcript: str) -> Dict:
-        """处理完整的对话流程"""
+    def process_conversation(self, transcript: Transcript) -> Dict:
+        """处理完整的对话流程（文本转录或说话人识别后的片段列表）"""
         result = {
             'patient_identified': False,
             'patient_id': None,
@@ -128,8 +221,10 @@ class RAGSystem:
         }
         
         try:
+            segments = parse_transcript(transcript) if isinstance(transcript, str) else transcript
+            
             # 1. 提取患者信息
-            patient_info = self.extract_patient_info(transcript)
+            patient_info = self.extract_patient_info(segments)
             result['extracted_info'] = patient_info
             
             if not patient_info:
@@ -137,7 +232,7 @@ class RAGSystem:
                 return result
             
             # 2. 识别患者（如果不存在则自动创建）
-            patient_id = self.identify_patient(transcript)
+            patient_id = self.identify_patient(segments, patient_info)
             
             if not patient_id:
                 result['error'] = "Unable to identify or create patient record"
@@ -147,7 +242,7 @@ class RAGSystem:
             result['patient_id'] = patient_id
             
             # 3. 从对话中提取新的医疗信息并保存
-            new_medical_info = self.extract_medical_info_from_conversation(transcript, patient_id)
+            new_medical_info = self.extract_medical_info_from_conversation(segments, patient_id)
             result['new_medical_info'] = new_medical_info
             
             # 4. 检索医疗记录（包括新添加的）
@@ -155,7 +250,7 @@ class RAGSystem:
             result['medical_records'] = medical_records
             
             # 5. 保存对话记录
-            self.patient_db.add_conversation(patient_id, transcript)
+            self.add_conversation(patient_id, transcript if isinstance(transcript, str) else format_transcript(segments))
             
             logger.info(f"Successfully processed conversation for patient {patient_id}")
             logger.info(f"Extracted {len(new_medical_info)} new medical info items")
@@ -166,6 +261,62 @@ class RAGSystem:
         
         return result
     
+    @traced("rag.process_utterance")
+    def process_utterance(self, session, segment: Segment) -> Dict:
+        """
+        会话增量处理：只处理新到的一条话语，结果累积到 session（session_store.Session）
+        
+        - 身份：补全 name / ssn / dob 候选（姓名取最可信的模式），只读匹配已有患者；
+          身份信息完整（三项齐全）仍未匹配时才创建新患者
+        - 医疗信息：每种类型每个会话提取一次（与整段对话处理一致），
+          患者识别之前提取的信息在识别后补写入数据库
+        """
+        # 1. 身份候选
+        name, rank = self._extract_name([segment.text])
+        if name and (session.name_rank is None or rank <= session.name_rank):
+            session.identity['name'] = name
+            session.name_rank = rank
+        for key, value in self.extract_patient_info([segment]).items():
+            if key != 'name':
+                session.identity.setdefault(key, value)
+        
+        # 2. 患者识别
+        identity = session.identity
+        if session.patient_id is None and identity.get('name'):
+            patient_id = self.patient_db.find_patient(
+                name=identity.get('name'),
+                ssn=identity.get('ssn'),
+                dob=identity.get('dob')
+            )
+            if patient_id is None and identity.get('ssn') and identity.get('dob'):
+                patient_id = self.patient_db.add_patient(identity['name'], identity['ssn'], identity['dob'])
+                logger.info(f"Created new patient: {patient_id} for session {session.session_id}")
+            session.patient_id = patient_id
+        
+        # 3. 医疗信息
+        seen_types = {item['type'] for item in session.medical_items}
+        new_items = [
+            item for item in self.extract_medical_info([segment], include_notes=False)
+            if item['type'] not in seen_types
+        ]
+        session.medical_items.extend(new_items)
+        
+        if session.patient_id and session.persisted_items < len(session.medical_items):
+            self.save_medical_info(session.patient_id, session.medical_items[session.persisted_items:])
+            session.persisted_items = len(session.medical_items)
+        
+        return {
+            'patient_identified': session.patient_id is not None,
+            'patient_id': session.patient_id,
+            'new_medical_info': new_items,
+        }
+    
+    def finish_session(self, session):
+        """会话结束：保存脱敏后的对话记录"""
+        if session.patient_id and session.utterances:
+            transcript = format_transcript(Segment(u['speaker'], u['text']) for u in session.utterances)
+            self.add_conversation(session.patient_id, transcript)
+    
     def format_medical_records_for_display(self, records: List[Dict]) -> List[Dict]:
         """格式化医疗记录用于前端显示"""
         formatted_records = []
@@ -180,8 +331,19 @@ class RAGSystem:
         
         return formatted_records
     
-    def extract_medical_info_from_conversation(self, transcript: str, patient_id: str):
+    def extract_medical_info_from_conversation(self, transcript: Transcript, patient_id: str):
         """从对话中提取医疗信息并保存到数据库（带PII脱敏）"""
+        unique_info = self.extract_medical_info(transcript)
+        self.save_medical_info(patient_id, unique_info)
+        return unique_info
+    
+    @traced("rag.extract_medical_info")
+    def extract_medical_info(self, transcript: Transcript, include_notes: bool = True) -> List[Dict]:
+        """
+        从对话中提取医疗信息（已脱敏，不写数据库）
+        
+        include_notes=False 时没有具体医疗信息也不生成 "Conversation Notes"（会话增量处理用）
+        """
         # 改进的医疗信息提取逻辑
         medical_keywords = {
             'symptoms': ['headache', 'pain', 'fever', 'cough', 'nausea', 'dizzy', 'tired', 'fatigue', 'hurt', 'ache', 'cold', 'sick', 'stomachache'],
@@ -190,25 +352,10 @@ class RAGSystem:
             'medical_history': ['history', 'diagnosed', 'condition', 'disease', 'illness']
         }
         
-        # 处理不同格式的转录文本
-        patient_statements = []
-        doctor_statements = []
-        
-        # 如果是结构化的对话格式（Speaker: Text）
-        if 'Patient:' in transcript or 'Doctor:' in transcript:
-            lines = transcript.strip().split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.lower().startswith('patient:'):
-                    patient_text = line.split(':', 1)[1].strip()
-                    patient_statements.append(patient_text)
-                elif line.lower().startswith('doctor:'):
-                    doctor_text = line.split(':', 1)[1].strip()
-                    doctor_statements.append(doctor_text)
-        else:
-            # 如果是普通文本，尝试从整个文本中提取
-            # 这里可以添加更复杂的逻辑来识别患者和医生的话
-            patient_statements.append(transcript)
+        # 按说话人拆分；说话人未知的片段（普通文本）按患者的话处理
+        segments = parse_transcript(transcript) if isinstance(transcript, str) else transcript
+        patient_statements = texts_by_speaker(segments, PATIENT, include_unknown=True)
+        doctor_statements = texts_by_speaker(segments, DOCTOR)
         
         extracted_info = []
         current_date = datetime.now().strftime('%Y/%m/%d')
@@ -224,8 +371,7 @@ class RAGSystem:
             
             if found_symptoms and len(statement) > 5:  # 避免太短的句子
                 # 对存储的内容进行PII脱敏
-                detected_types = ner_detect_pii(statement)
-                redacted_statement, _ = redact_pii(statement, detected_types)
+                redacted_statement = redact_segment(statement).text
                 
                 extracted_info.append({
                     'type': 'Current Symptoms',
@@ -241,8 +387,7 @@ class RAGSystem:
             if any(med in statement_lower for med in medical_keywords['medications']):
                 if len(statement) > 5:  # 避免太短的句子
                     # 对存储的内容进行PII脱敏
-                    detected_types = ner_detect_pii(statement)
-                    redacted_statement, _ = redact_pii(statement, detected_types)
+                    redacted_statement = redact_segment(statement).text
                     
                     extracted_info.append({
                         'type': 'Current Medications',
@@ -258,8 +403,7 @@ class RAGSystem:
             if any(word in statement_lower for word in ['diagnosis', 'recommend', 'prescribe', 'treatment']):
                 if len(statement) > 10:
                     # 对存储的内容进行PII脱敏
-                    detected_types = ner_detect_pii(statement)
-                    redacted_statement, _ = redact_pii(statement, detected_types)
+                    redacted_statement = redact_segment(statement).text
                     
                     extracted_info.append({
                         'type': 'Doctor Notes',
@@ -270,14 +414,13 @@ class RAGSystem:
                     break
         
         # 如果没有提取到具体的医疗信息，但有对话内容，保存为一般对话记录
-        if not extracted_info and (patient_statements or doctor_statements):
+        if include_notes and not extracted_info and (patient_statements or doctor_statements):
             conversation_summary = []
             if patient_statements:
                 # 对患者话语进行脱敏
                 redacted_patient_statements = []
                 for stmt in patient_statements[:2]:  # 只取前两句
-                    detected_types = ner_detect_pii(stmt)
-                    redacted_stmt, _ = redact_pii(stmt, detected_types)
+                    redacted_stmt = redact_segment(stmt).text
                     redacted_patient_statements.append(redacted_stmt)
                 conversation_summary.append(f"Patient: {'; '.join(redacted_patient_statements)}")
                 
@@ -285,8 +428,7 @@ class RAGSystem:
                 # 对医生话语进行脱敏
                 redacted_doctor_statements = []
                 for stmt in doctor_statements[:2]:  # 只取前两句
-                    detected_types = ner_detect_pii(stmt)
-                    redacted_stmt, _ = redact_pii(stmt, detected_types)
+                    redacted_stmt = redact_segment(stmt).text
                     redacted_doctor_statements.append(redacted_stmt)
                 conversation_summary.append(f"Doctor: {'; '.join(redacted_doctor_statements)}")
             
@@ -306,34 +448,32 @@ class RAGSystem:
                 unique_info.append(info)
                 seen_contents.add(info['content'])
         
-        # 保存提取的信息到数据库
-        for info in unique_info:
-            self.medical_db.add_record(
-                patient_id=patient_id,
-                record_type=info['type'],
-                content=info['content'],
-                metadata={
-                    'source': info['source'], 
-                    'date': datetime.now().isoformat(),
-                    'conversation_date': info['date']
-                }
-            )
-            print(f"Added new record: {info['type']} - {info['content'][:50]}...")
-        
         return unique_info
+    
+    def save_medical_info(self, patient_id: str, unique_info: List[Dict]):
+        """保存提取的信息到数据库（一个事务，缓存只失效一次）"""
+        records = [{
+            'type': info['type'],
+            'content': info['content'],
+            'metadata': {
+                'source': info['source'], 
+                'date': datetime.now().isoformat(),
+                'conversation_date': info['date']
+            }
+        } for info in unique_info]
+        if self.write_behind is not None:
+            # 去重和缓存失效在后台落库时进行
+            self.write_behind.submit_records(patient_id, records)
+            return
+        actions = self.medical_db.add_records(patient_id, records)
+        if any(action != "skipped" for action in actions):
+            self.records_cache.invalidate(patient_id)
+        for info, action in zip(unique_info, actions):
+            print(f"Record {action}: {info['type']} - {info['content'][:50]}...")
 
     def _categorize_record(self, record_type: str) -> str:
-        """将记录类型分类"""
-        categories = {
-            'Medical History': 'history',
-            'Previous Visit': 'visit',
-            'Allergies': 'allergy',
-            'Medications': 'medication',
-            'Lab Results': 'lab',
-            'Diagnosis': 'diagnosis'
-        }
-        
-        return categories.get(record_type, 'other')
+        """将记录类型分类（映射见 database.RECORD_CATEGORIES，patient_summary 共用）"""
+        return categorize_record(record_type)
 
 
 # 测试函数
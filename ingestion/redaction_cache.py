@@ -0,0 +1,64 @@
+# 片段级脱敏结果缓存
+#
+# 同样的话语（"Okay."、"It hurts here."、重试/编辑后的转录）会反复出现，
+# 每次都跑 ner_detect_pii + redact_pii 会重复付出 spaCy 的开销。
+# 这里按 (规范化文本哈希, 检测器配置版本) 缓存脱敏结果，进程内所有调用方共享。
+import hashlib
+import os
+import re
+import unicodedata
+from typing import NamedTuple, Tuple
+
+from cache import LRUCache
+from name_gate import GATE_VERSION, NER_GATE_ENABLED
+from ner_backends import backend_config_version
+from pii import redact_pii
+from pii_ner import ner_detect_pii
+
+REDACTION_CACHE_SIZE = int(os.getenv("REDACTION_CACHE_SIZE", "4096"))
+
+# 检测规则或模型变化时必须更新，旧缓存条目随之失效
+DETECTOR_CONFIG_VERSION = f"{backend_config_version()}|rules:1|gate:{int(NER_GATE_ENABLED)}.{GATE_VERSION}"
+
+PLACEHOLDER_PATTERN = re.compile(r"\[(NAME|DATE|SSN)\]")
+
+
+class RedactionResult(NamedTuple):
+    text: str                                   # 脱敏后的文本
+    entities: Tuple[str, ...]                   # 实际替换掉的 PII 类型
+    detected_types: Tuple[str, ...]             # ner_detect_pii 判定需要尝试的类型
+    spans: Tuple[Tuple[int, int, str], ...]     # 占位符在脱敏文本中的位置 (start, end, label)
+
+
+_cache = LRUCache(REDACTION_CACHE_SIZE)
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def cache_key(text: str) -> tuple:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    return digest, DETECTOR_CONFIG_VERSION
+
+
+def redact_segment(text: str) -> RedactionResult:
+    """对一段文本做 NER 检测 + 脱敏，结果按文本哈希缓存"""
+    normalized = normalize(text)
+    key = cache_key(normalized)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    detected_types = ner_detect_pii(normalized)
+    redacted, entities = redact_pii(normalized, allowed_types=detected_types)
+    spans = tuple(
+        (m.start(), m.end(), m.group(1)) for m in PLACEHOLDER_PATTERN.finditer(redacted)
+    )
+    result = RedactionResult(redacted, tuple(sorted(entities)), tuple(sorted(detected_types)), spans)
+    _cache.set(key, result)
+    return result
+
+
+def cache_stats() -> dict:
+    return dict(_cache.stats(), config_version=DETECTOR_CONFIG_VERSION)
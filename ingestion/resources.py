@@ -0,0 +1,146 @@
+# CPU 线程预算
+#
+# CTranslate2（Whisper）、torch 和 NumPy/BLAS（spaCy）默认都按机器的核数开线程池。
+# 容器里看到的是宿主机的核数而不是 CPU 配额；多个并发上传、多个 uvicorn worker 时
+# 每一份都按全部核数开线程，线程数远超可用核数，互相抢占，吞吐反而下降。
+#
+# 本模块在加载这些库之前统一分配线程：
+#
+#   可用核数     cgroup CPU 配额（v2 cpu.max / v1 cfs_quota_us），与 CPU 亲和性取较小值
+#   每进程核数   可用核数 / 进程数（WEB_CONCURRENCY，即 uvicorn --workers）
+#   并发流水线   每进程同时运行的上传数（scheduler 的执行槽），默认 每进程核数 / 2
+#   ASR          WhisperModel(cpu_threads=每进程核数 / 并发流水线, num_workers=并发流水线)
+#   BLAS/OpenMP  OMP/MKL/OpenBLAS 等线程数与 ASR 每个流水线的线程数相同（torch 也读取 OMP_NUM_THREADS）
+#   请求线程池   事件循环默认线程池的大小 = 并发流水线
+#
+# 已经显式设置的环境变量（OMP_NUM_THREADS、SCHED_MAX_CONCURRENT、ASR_CPU_THREADS 等）优先，
+# 不会被覆盖。/admin/resources 返回生效的配置及其来源。
+import logging
+import math
+import os
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 数值库读取的线程数环境变量（必须在库加载前设置）
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+_CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+_CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+_CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+_budget: Optional[Dict] = None
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """容器的 CPU 配额（核数，可以是小数）；未限制时返回 None"""
+    cpu_max = _read(_CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota, period = _read(_CGROUP_V1_QUOTA), _read(_CGROUP_V1_PERIOD)
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus() -> int:
+    """本容器实际可用的核数（配额与亲和性取较小值，至少 1）"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        # 1.5 核的配额按 1 核分配线程，多出的部分留给事件循环和数据库
+        cpus = min(cpus, max(1, math.floor(limit)))
+    return max(1, cpus)
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def compute_budget() -> Dict:
+    """按当前环境计算线程预算（不修改任何状态）"""
+    cpus = available_cpus()
+    processes = max(1, _env_int("WEB_CONCURRENCY") or 1)
+    per_process = max(1, cpus // processes)
+
+    sources = {}
+
+    def pick(name: str, default: int) -> int:
+        value = _env_int(name)
+        sources[name] = "env" if value else "budget"
+        return max(1, value or default)
+
+    pipelines = pick("SCHED_MAX_CONCURRENT", max(1, per_process // 2))
+    asr_threads = pick("ASR_CPU_THREADS", max(1, per_process // pipelines))
+    asr_workers = pick("ASR_NUM_WORKERS", pipelines)
+    executor_threads = pick("EXECUTOR_THREADS", pipelines)
+    native_threads = {}
+    for name in THREAD_ENV_VARS:
+        native_threads[name] = pick(name, asr_threads)
+
+    return {
+        "cpu_count": os.cpu_count(),
+        "cgroup_cpu_limit": cgroup_cpu_limit(),
+        "available_cpus": cpus,
+        "processes": processes,
+        "cpus_per_process": per_process,
+        "pipelines": pipelines,
+        "asr_cpu_threads": asr_threads,
+        "asr_num_workers": asr_workers,
+        "executor_threads": executor_threads,
+        "native_threads": native_threads,
+        "sources": sources,
+    }
+
+
+def apply() -> Dict:
+    """计算预算并写入线程数环境变量；须在导入 ctranslate2 / torch / numpy 之前调用（可重复调用）"""
+    global _budget
+    if _budget is None:
+        _budget = compute_budget()
+        for name, value in _budget["native_threads"].items():
+            os.environ.setdefault(name, str(value))
+        logger.info(
+            f"CPU budget: {_budget['available_cpus']} CPUs, {_budget['processes']} processes, "
+            f"{_budget['pipelines']} pipelines x {_budget['asr_cpu_threads']} threads"
+        )
+    return _budget
+
+
+def get_budget() -> Dict:
+    return apply()
+
+
+def effective_config() -> Dict:
+    """生效的配置（/admin/resources）：预算 + 已加载的库实际使用的线程数"""
+    import sys
+
+    config = dict(get_budget())
+    config["environment"] = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    loaded = {}
+    if "torch" in sys.modules:
+        loaded["torch_num_threads"] = sys.modules["torch"].get_num_threads()
+    loaded["asr_models_loaded"] = "faster_whisper" in sys.modules
+    config["loaded"] = loaded
+    return config
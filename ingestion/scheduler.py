@@ -0,0 +1,244 @@
+# /upload-audio 准入调度：最短作业优先（SJF）+ 老化 + 按客户端限流
+#
+# 原来所有上传平等竞争（而且直接在事件循环里执行），一个 90 分钟的录音会挡住后面一串
+# 30 秒的口述。现在每个上传先估算成本再排队，拿到执行槽后才在线程池中运行流水线：
+#
+#   成本     音频时长（从容器元数据读取，不解码）× 解码配置权重；读不出时长时按文件大小估算
+#   排序     有效成本 = 成本 - SCHED_AGING_RATE × 已等待秒数，取最小者。所有作业老化速度相同，
+#            等价于按 成本 + SCHED_AGING_RATE × 入队时刻 排序，用堆即可，不需要周期性重算
+#   并发     同时运行至多 SCHED_MAX_CONCURRENT 个作业；长录音（> SCHED_SHORT_JOB_SECONDS）
+#            至多占用 SCHED_MAX_CONCURRENT - SCHED_RESERVED_SHORT_SLOTS 个，短作业总有槽位可用
+#   客户端   按 X-Client-ID 请求头（没有时按客户端 IP）区分：带 X-Client-ID 的客户端同时运行至多
+#            SCHED_PER_CLIENT 个；按 IP 区分的客户端可能是 NAT 后面的整个诊所，上限为
+#            SCHED_PER_IP_CLIENT（默认等于总槽位数，即不单独限制）。
+#            每个客户端排队至多 SCHED_MAX_QUEUED_PER_CLIENT 个，超出返回 429
+#
+# 调度器只在事件循环线程中使用（asyncio），不需要加锁。
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+import wave
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+import resources
+
+logger = logging.getLogger(__name__)
+
+# 默认由 CPU 预算决定（每进程核数 / 2，见 resources.py）
+SCHED_MAX_CONCURRENT = resources.get_budget()["pipelines"]
+SCHED_RESERVED_SHORT_SLOTS = int(os.getenv("SCHED_RESERVED_SHORT_SLOTS", "1"))
+SCHED_SHORT_JOB_SECONDS = float(os.getenv("SCHED_SHORT_JOB_SECONDS", "120"))
+SCHED_PER_CLIENT = int(os.getenv("SCHED_PER_CLIENT", "1"))
+SCHED_PER_IP_CLIENT = int(os.getenv("SCHED_PER_IP_CLIENT", str(SCHED_MAX_CONCURRENT)))
+SCHED_MAX_QUEUED_PER_CLIENT = int(os.getenv("SCHED_MAX_QUEUED_PER_CLIENT", "20"))
+# 每等待 1 秒，相当于作业缩短多少秒音频
+SCHED_AGING_RATE = float(os.getenv("SCHED_AGING_RATE", "2"))
+# 读不出时长时，按该码率（字节/秒，约 128 kbps）由文件大小估算
+SCHED_FALLBACK_BYTES_PER_SECOND = float(os.getenv("SCHED_FALLBACK_BYTES_PER_SECOND", "16000"))
+
+# 解码配置的相对成本（见 benchmarks/asr_profiles_bench.py 的实时率）
+PROFILE_COST_WEIGHTS = {"preview": 0.5, "default": 1.0, "final": 4.0}
+
+# 每类作业保留的最近排队时间样本数
+WAIT_SAMPLES = 1000
+
+
+class SchedulerFull(Exception):
+    """客户端排队数超过上限"""
+
+
+def probe_duration(path: str, size: int = None) -> Tuple[float, str]:
+    """
+    估算音频时长（秒），返回 (时长, 来源)
+
+    依次尝试：容器元数据（PyAV，faster-whisper 的依赖；只读文件头）→ WAV 头 → 文件大小
+    """
+    try:
+        import av
+
+        with av.open(path) as container:
+            if container.duration:
+                return container.duration / av.time_base, "container"
+    except Exception:
+        # 未安装 PyAV，或容器无法解析（交给后面的方法）
+        pass
+    try:
+        with wave.open(path) as wav:
+            return wav.getnframes() / wav.getframerate(), "wav"
+    except (wave.Error, EOFError, OSError):
+        pass
+    if size is None:
+        size = os.path.getsize(path)
+    return size / SCHED_FALLBACK_BYTES_PER_SECOND, "size"
+
+
+class Job:
+    __slots__ = ("job_id", "client_id", "explicit_client", "profile", "audio_seconds", "cost", "source",
+                 "enqueued_at", "started_at", "future")
+
+    def __init__(self, job_id: int, client_id: str, profile: str, audio_seconds: float, source: str,
+                 explicit_client: bool = True):
+        self.job_id = job_id
+        self.client_id = client_id
+        self.explicit_client = explicit_client
+        self.profile = profile
+        self.audio_seconds = audio_seconds
+        self.cost = audio_seconds * PROFILE_COST_WEIGHTS.get(profile, 1.0)
+        self.source = source
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+
+    @property
+    def short(self) -> bool:
+        return self.audio_seconds <= SCHED_SHORT_JOB_SECONDS
+
+    def describe(self, now: float, aging_rate: float) -> Dict:
+        data = {
+            "job_id": self.job_id,
+            "client_id": self.client_id,
+            "profile": self.profile,
+            "audio_seconds": round(self.audio_seconds, 1),
+            "duration_source": self.source,
+            "cost": round(self.cost, 1),
+        }
+        if self.started_at is None:
+            waited = now - self.enqueued_at
+            data.update(waited_seconds=round(waited, 2), effective_cost=round(self.cost - aging_rate * waited, 1))
+        else:
+            data["running_seconds"] = round(now - self.started_at, 2)
+        return data
+
+
+class AdmissionScheduler:
+    """最短作业优先 + 老化 + 每客户端并发上限"""
+
+    def __init__(
+        self,
+        max_concurrent: int = SCHED_MAX_CONCURRENT,
+        reserved_short_slots: int = SCHED_RESERVED_SHORT_SLOTS,
+        per_client: int = SCHED_PER_CLIENT,
+        per_ip_client: int = SCHED_PER_IP_CLIENT,
+        max_queued_per_client: int = SCHED_MAX_QUEUED_PER_CLIENT,
+        aging_rate: float = SCHED_AGING_RATE,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        # 至少留一个槽位给长录音，否则长录音永远不会运行
+        self.long_slots = max(1, self.max_concurrent - max(0, reserved_short_slots))
+        self.per_client = max(1, per_client)
+        self.per_ip_client = max(1, per_ip_client)
+        self.max_queued_per_client = max_queued_per_client
+        self.aging_rate = aging_rate
+
+        self._heap: List[Tuple[float, int, Job]] = []
+        self._running: Dict[int, Job] = {}
+        self._running_by_client: Counter = Counter()
+        self._queued_by_client: Counter = Counter()
+        self._ids = itertools.count(1)
+        self._waits = {"short": deque(maxlen=WAIT_SAMPLES), "long": deque(maxlen=WAIT_SAMPLES)}
+        self._counts = Counter()
+
+    async def acquire(self, client_id: str, audio_seconds: float, profile: str, source: str = "size",
+                      explicit_client: bool = True) -> Job:
+        """
+        排队直到获得执行槽（客户端断开时自动出队）；之后必须调用 release
+
+        explicit_client=False 表示 client_id 是客户端 IP（没有 X-Client-ID），并发上限用 per_ip_client
+        """
+        job = self._enqueue(client_id, audio_seconds, profile, source, explicit_client)
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.job_id in self._running:
+                self.release(job)
+            else:
+                self._queued_by_client[job.client_id] -= 1
+                self._counts["cancelled"] += 1
+            raise
+        return job
+
+    def _enqueue(self, client_id: str, audio_seconds: float, profile: str, source: str,
+                 explicit_client: bool = True) -> Job:
+        if self._queued_by_client[client_id] >= self.max_queued_per_client:
+            self._counts["rejected"] += 1
+            raise SchedulerFull(f"Client {client_id} already has {self._queued_by_client[client_id]} queued uploads")
+        job = Job(next(self._ids), client_id, profile, audio_seconds, source, explicit_client)
+        job.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (job.cost + self.aging_rate * job.enqueued_at, job.job_id, job))
+        self._queued_by_client[client_id] += 1
+        self._counts["submitted"] += 1
+        self._dispatch()
+        return job
+
+    def _eligible(self, job: Job, long_running: int) -> bool:
+        limit = self.per_client if job.explicit_client else self.per_ip_client
+        if self._running_by_client[job.client_id] >= limit:
+            return False
+        return job.short or long_running < self.long_slots
+
+    def _dispatch(self):
+        """按有效成本从小到大启动可运行的作业，直到槽位用完"""
+        skipped = []
+        long_running = sum(1 for job in self._running.values() if not job.short)
+        while self._heap and len(self._running) < self.max_concurrent:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.future.done():
+                # 已取消（客户端断开）
+                continue
+            if not self._eligible(job, long_running):
+                skipped.append(entry)
+                continue
+            job.started_at = time.monotonic()
+            self._running[job.job_id] = job
+            self._running_by_client[job.client_id] += 1
+            self._queued_by_client[job.client_id] -= 1
+            long_running += 0 if job.short else 1
+            self._waits["short" if job.short else "long"].append(job.started_at - job.enqueued_at)
+            job.future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def release(self, job: Job):
+        if self._running.pop(job.job_id, None) is None:
+            return
+        self._running_by_client[job.client_id] -= 1
+        self._counts["completed"] += 1
+        self._dispatch()
+
+    def snapshot(self) -> Dict:
+        """当前排队/运行状态（/admin/scheduler）"""
+        now = time.monotonic()
+        queued = [entry[2] for entry in sorted(self._heap) if not entry[2].future.done()]
+        waits = {}
+        for kind, samples in self._waits.items():
+            values = sorted(samples)
+            waits[kind] = {
+                "n": len(values),
+                "p50_seconds": round(values[len(values) // 2], 3) if values else None,
+                "p99_seconds": round(values[min(len(values) - 1, int(len(values) * 0.99))], 3) if values else None,
+            }
+        return {
+            "config": {
+                "max_concurrent": self.max_concurrent,
+                "long_job_slots": self.long_slots,
+                "short_job_seconds": SCHED_SHORT_JOB_SECONDS,
+                "per_client": self.per_client,
+                "per_ip_client": self.per_ip_client,
+                "max_queued_per_client": self.max_queued_per_client,
+                "aging_rate": self.aging_rate,
+            },
+            "running": [job.describe(now, self.aging_rate) for job in self._running.values()],
+            "queued": [job.describe(now, self.aging_rate) for job in queued],
+            "clients": {
+                client: {"running": self._running_by_client[client], "queued": self._queued_by_client[client]}
+                for client in set(self._running_by_client) | set(self._queued_by_client)
+                if self._running_by_client[client] or self._queued_by_client[client]
+            },
+            "queue_wait": waits,
+            "counts": dict(self._counts),
+        }
@@ -0,0 +1,71 @@
+# 结构化对话片段
+#
+# 转录 → 说话人识别 → RAG 提取 → 脱敏 全程传递 Segment 列表，
+# 不再把片段拼成一整段文本再按 "Patient:" / "Doctor:" 重新切分
+# （拼接后的文本里已经没有说话人前缀，只能把整段当作患者的话去跑 NER）。
+from typing import Dict, Iterable, List, Optional
+
+DOCTOR = "Doctor"
+PATIENT = "Patient"
+
+
+class Segment:
+    """一段话语：说话人 + 时间 + 文本（__slots__，长对话也不占多少内存）"""
+
+    __slots__ = ("speaker", "start", "end", "text")
+
+    def __init__(self, speaker: Optional[str], text: str, start: float = 0.0, end: float = 0.0):
+        self.speaker = speaker      # "Doctor" / "Patient"，未知为 None
+        self.start = start
+        self.end = end
+        self.text = text
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Segment":
+        return cls(data.get("speaker"), data["text"], data.get("start", 0.0), data.get("end", 0.0))
+
+    def to_dict(self) -> Dict:
+        return {"speaker": self.speaker, "start": self.start, "end": self.end, "text": self.text}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Segment):
+            return NotImplemented
+        return (self.speaker, self.start, self.end, self.text) == (other.speaker, other.start, other.end, other.text)
+
+    def __repr__(self) -> str:
+        return f"Segment({self.speaker!r}, {self.text!r}, start={self.start}, end={self.end})"
+
+
+def parse_transcript(transcript: str) -> List[Segment]:
+    """
+    文本转录 → 片段列表
+
+    - "Speaker: text" 逐行格式按行切分
+    - 普通文本整体作为一个说话人未知的片段
+    """
+    segments = []
+    if "Patient:" in transcript or "Doctor:" in transcript:
+        for line in transcript.strip().split("\n"):
+            line = line.strip()
+            lowered = line.lower()
+            if lowered.startswith("patient:"):
+                segments.append(Segment(PATIENT, line.split(":", 1)[1].strip()))
+            elif lowered.startswith("doctor:"):
+                segments.append(Segment(DOCTOR, line.split(":", 1)[1].strip()))
+    else:
+        text = transcript.strip()
+        if text:
+            segments.append(Segment(None, text))
+    return segments
+
+
+def format_transcript(segments: Iterable[Segment]) -> str:
+    """片段列表 → "Speaker: text" 逐行文本（用于保存对话记录）"""
+    return "\n".join(f"{seg.speaker}: {seg.text}" if seg.speaker else seg.text for seg in segments)
+
+
+def texts_by_speaker(segments: Iterable[Segment], speaker: str, include_unknown: bool = False) -> List[str]:
+    return [
+        seg.text for seg in segments
+        if seg.speaker == speaker or (include_unknown and seg.speaker is None)
+    ]
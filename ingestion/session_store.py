@@ -0,0 +1,287 @@
+# /ingest 会话状态
+#
+# 同一 session_id 的多条消息共享一个 Session：累积脱敏后的话语、逐步补全的身份候选
+# （name / ssn / dob）、已识别的 patient_id 和已提取的医疗信息。每条新消息只处理
+# 这条消息本身（O(消息长度)），不再从头处理整段对话。
+#
+# 活跃会话保存在内存（LRU，至多 SESSION_MEMORY_LIMIT 个），超出的溢出到 SQLite
+# （SESSION_DB），再次访问时读回内存；超过 SESSION_TTL 秒没有新消息的会话过期。
+# 会话只存在于处理它的进程中，多 worker 部署需要按 session_id 做粘性路由。
+#
+# 身份候选（姓名/SSN/出生日期明文）只保存在内存中，溢出或 flush 到 SQLite 时丢弃：
+# 已识别患者的会话不再需要它们；尚未识别的会话读回后需要重新提供身份信息。
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_MEMORY_LIMIT = int(os.getenv("SESSION_MEMORY_LIMIT", "1000"))
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+# 每个会话最多保留的话语条数（更早的只计数不保存）
+SESSION_MAX_UTTERANCES = int(os.getenv("SESSION_MAX_UTTERANCES", "500"))
+# 过期扫描的最小间隔（秒）
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+
+class Session:
+    """一个 /ingest 会话的累积状态"""
+
+    # 写入 SQLite 的字段（不含 identity / name_rank）
+    PERSISTED_FIELDS = ("session_id", "created_at", "updated_at", "message_count", "utterances",
+                        "patient_id", "medical_items", "persisted_items")
+
+    def __init__(self, session_id: str):
+        now = time.time()
+        self.session_id = session_id
+        self.created_at = now
+        self.updated_at = now
+        self.message_count = 0
+        self.utterances: List[Dict] = []        # 脱敏后的话语 {"speaker", "text"}
+        self.identity: Dict[str, str] = {}      # 身份候选 name / ssn / dob
+        self.name_rank: Optional[int] = None    # 当前姓名候选的模式序号（越小越可信）
+        self.patient_id: Optional[str] = None
+        self.medical_items: List[Dict] = []     # 已提取的医疗信息
+        self.persisted_items = 0                # medical_items 中已写入数据库的条数
+
+    def add_utterance(self, speaker: Optional[str], redacted_text: str):
+        self.message_count += 1
+        self.utterances.append({"speaker": speaker, "text": redacted_text})
+        if len(self.utterances) > SESSION_MAX_UTTERANCES:
+            del self.utterances[0]
+
+    def expired(self, now: float, ttl: float) -> bool:
+        return now - self.updated_at > ttl
+
+    def summary(self) -> Dict:
+        """返回给客户端的会话状态（不含身份信息的值）"""
+        return {
+            "message_count": self.message_count,
+            "patient_identified": self.patient_id is not None,
+            "patient_id": self.patient_id,
+            "identity_fields": sorted(self.identity),
+            "medical_items": len(self.medical_items),
+        }
+
+    def to_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.PERSISTED_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Session":
+        session = cls(data["session_id"])
+        for field in cls.PERSISTED_FIELDS:
+            if field in data:
+                setattr(session, field, data[field])
+        return session
+
+
+class SessionStore:
+    """内存 LRU + SQLite 溢出的会话存储，按 TTL 过期"""
+
+    def __init__(
+        self,
+        db_path: str = SESSION_DB,
+        ttl: float = SESSION_TTL,
+        memory_limit: int = SESSION_MEMORY_LIMIT,
+        on_expire: Callable[[Session], None] = None,
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_limit = memory_limit
+        self.on_expire = on_expire
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # 每个会话一把锁，引用计数（持有 + 等待）归零时移除
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock_refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.spills = 0
+        self.loads = 0
+        self.expirations = 0
+        self.init_database()
+
+    def init_database(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)')
+        conn.commit()
+        conn.close()
+
+    @contextmanager
+    def session(self, session_id: str) -> Iterator[Session]:
+        """
+        独占访问一个会话（不存在则创建）
+
+        同一会话的并发消息按到达顺序串行处理；退出时刷新 updated_at。
+        """
+        self._maybe_sweep()
+        with self._session_lock(session_id):
+            session = self._load(session_id)
+            try:
+                yield session
+            finally:
+                session.updated_at = time.time()
+                self._store(session)
+
+    def close(self, session_id: str) -> Optional[Session]:
+        """结束会话：从内存和 SQLite 中移除并返回它（不存在返回 None）"""
+        with self._session_lock(session_id):
+            with self._lock:
+                session = self._sessions.pop(session_id, None)
+            spilled = self._read_spilled(session_id, delete=True)
+            return session or spilled
+
+    @contextmanager
+    def _session_lock(self, session_id: str):
+        """持有会话锁；最后一个持有/等待者退出时才移除锁，保证同一会话始终只有一把锁"""
+        with self._lock:
+            lock = self._locks.setdefault(session_id, threading.Lock())
+            self._lock_refs[session_id] = self._lock_refs.get(session_id, 0) + 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                self._lock_refs[session_id] -= 1
+                if not self._lock_refs[session_id]:
+                    del self._lock_refs[session_id]
+                    del self._locks[session_id]
+
+    def _in_use(self, session_id: str) -> bool:
+        """有线程持有或正在等待该会话（调用方持有 self._lock）"""
+        return session_id in self._lock_refs
+
+    def _load(self, session_id: str) -> Session:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and not session.expired(time.time(), self.ttl):
+                self._sessions.move_to_end(session_id)
+                return session
+            if session is not None:
+                del self._sessions[session_id]
+        if session is not None:
+            self._expire(session)
+            return Session(session_id)
+
+        session = self._read_spilled(session_id, delete=True)
+        if session is not None and session.expired(time.time(), self.ttl):
+            self._expire(session)
+            session = None
+        if session is not None:
+            self.loads += 1
+        return session or Session(session_id)
+
+    def _store(self, session: Session):
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            # 从最久未用的开始溢出；正在被处理的会话留在内存
+            overflow = []
+            excess = len(self._sessions) - self.memory_limit
+            for session_id in list(self._sessions):
+                if excess <= 0:
+                    break
+                if self._in_use(session_id):
+                    continue
+                overflow.append(self._sessions.pop(session_id))
+                excess -= 1
+        if overflow:
+            self._spill(overflow)
+
+    def _spill(self, sessions: List[Session]):
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany(
+            'INSERT OR REPLACE INTO sessions (session_id, updated_at, data) VALUES (?, ?, ?)',
+            [(s.session_id, s.updated_at, json.dumps(s.to_dict())) for s in sessions],
+        )
+        conn.commit()
+        conn.close()
+        self.spills += len(sessions)
+
+    def _read_spilled(self, session_id: str, delete: bool = False) -> Optional[Session]:
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        if delete:
+            # DELETE ... RETURNING 原子地认领该行：并发的 sweep / 其他进程不会再拿到同一个会话
+            cursor.execute('DELETE FROM sessions WHERE session_id = ? RETURNING data', (session_id,))
+            row = cursor.fetchone()
+            conn.commit()
+        else:
+            cursor.execute('SELECT data FROM sessions WHERE session_id = ?', (session_id,))
+            row = cursor.fetchone()
+        conn.close()
+        return Session.from_dict(json.loads(row[0])) if row else None
+
+    def _expire(self, session: Session):
+        self.expirations += 1
+        if self.on_expire:
+            try:
+                self.on_expire(session)
+            except Exception as e:
+                logger.error(f"Session expiry callback failed for {session.session_id}: {e}")
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= SESSION_SWEEP_INTERVAL:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """清理过期会话（内存 + SQLite），返回清理数量"""
+        self._last_sweep = time.monotonic()
+        now = time.time()
+
+        expired = []
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if session.expired(now, self.ttl) and not self._in_use(session_id):
+                    expired.append(self._sessions.pop(session_id))
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        # 删除和读取在同一条语句中完成，每个过期会话只会被一个 sweep 认领（on_expire 只执行一次）
+        cursor.execute('DELETE FROM sessions WHERE updated_at < ? RETURNING data', (now - self.ttl,))
+        rows = cursor.fetchall()
+        conn.commit()
+        expired.extend(Session.from_dict(json.loads(row[0])) for row in rows)
+        conn.close()
+
+        for session in expired:
+            self._expire(session)
+        if expired:
+            logger.info(f"Expired {len(expired)} ingest sessions")
+        return len(expired)
+
+    def flush(self):
+        """把内存中的会话全部写入 SQLite（进程退出前调用，重启后可继续）"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        if sessions:
+            self._spill(sessions)
+
+    def stats(self) -> Dict:
+        conn = sqlite3.connect(self.db_path)
+        spilled_now = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        conn.close()
+        return {
+            "in_memory": len(self._sessions),
+            "spilled": spilled_now,
+            "memory_limit": self.memory_limit,
+            "ttl_seconds": self.ttl,
+            "spills": self.spills,
+            "loads": self.loads,
+            "expirations": self.expirations,
+        }
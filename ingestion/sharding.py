@@ -0,0 +1,267 @@
+# SQLite 水平分片
+#
+# SQLite 每个文件同一时间只允许一个写者，所有上传都写 medical_records.db 时写入会串行。
+# 按 patient_id 的稳定哈希把数据分到 N 个文件（DB_SHARDS），不同患者的写入可以并行。
+#
+#   medical_records.db  →  medical_records.shard0.db ... medical_records.shard{N-1}.db
+#                          medical_records.shards.json   （分片映射：分片数 + 文件列表）
+#
+# - DB_SHARDS=1（默认）时直接使用原文件，行为与不分片完全一致
+# - 分片数以已有的 shards.json 为准；修改分片数需要停服后离线重分片:
+#       python sharding.py reshard --to 8 patients.db medical_records.db
+# - 病历记录 ID 对外使用全局 ID: local_id * N + shard，删除时据此定位分片
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+
+SHARD_MAP_VERSION = 1
+
+# 派生表（引用分片内自增 id）：重分片时不复制，下次打开数据库时重建
+DERIVED_TABLES = {"record_bands", "record_bands_layout"}
+# 每个分片各有一份的元数据表（重分片时复制到所有新分片）
+REPLICATED_TABLES = {"patient_name_index_key"}
+
+
+def shard_index(key: str, count: int) -> int:
+    """稳定哈希（与进程、Python 版本无关）"""
+    if count == 1:
+        return 0
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_path(base_path: str, index: int, count: int) -> str:
+    if count == 1:
+        return base_path
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.shard{index}{ext}"
+
+
+def map_path(base_path: str) -> str:
+    root, _ = os.path.splitext(base_path)
+    return f"{root}.shards.json"
+
+
+def load_shard_map(base_path: str) -> Optional[dict]:
+    path = map_path(base_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def has_rows(path: str) -> bool:
+    """SQLite 文件存在且任意一张表有数据"""
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(path)
+    try:
+        tables = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        return any(conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in tables)
+    finally:
+        conn.close()
+
+
+def write_shard_map(base_path: str, count: int):
+    shard_map = {
+        "version": SHARD_MAP_VERSION,
+        "hash": "blake2b-64",
+        "shards": count,
+        "files": [os.path.basename(shard_path(base_path, i, count)) for i in range(count)],
+    }
+    with open(map_path(base_path), "w", encoding="utf-8") as f:
+        json.dump(shard_map, f, indent=2)
+
+
+class ShardSet:
+    """一组按 patient_id 路由的 SQLite 分片文件"""
+
+    def __init__(self, base_path: str, count: int = None):
+        self.base_path = base_path
+        shard_map = load_shard_map(base_path)
+        if shard_map is not None:
+            if count is not None and count != shard_map["shards"]:
+                logger.warning(
+                    f"{base_path}: shard map has {shard_map['shards']} shards, ignoring requested {count}; "
+                    f"run `python sharding.py reshard` to change it"
+                )
+            count = shard_map["shards"]
+        else:
+            count = count or DB_SHARDS
+            if count > 1:
+                # 已有未分片的数据：直接建分片映射会打开空的分片文件，原数据就"消失"了
+                if has_rows(base_path):
+                    raise RuntimeError(
+                        f"{base_path} already holds unsharded data; stop the service and run "
+                        f"`python sharding.py reshard --to {count} {base_path}` instead of setting DB_SHARDS"
+                    )
+                write_shard_map(base_path, count)
+        self.count = count
+        self.paths = [shard_path(base_path, i, count) for i in range(count)]
+
+    def index_for(self, patient_id: str) -> int:
+        return shard_index(patient_id, self.count)
+
+    def path_for(self, patient_id: str) -> str:
+        return self.paths[self.index_for(patient_id)]
+
+    def connect(self, patient_id: str) -> sqlite3.Connection:
+        return sqlite3.connect(self.path_for(patient_id))
+
+    def connect_index(self, index: int) -> sqlite3.Connection:
+        return sqlite3.connect(self.paths[index])
+
+    def connections(self) -> Iterator[sqlite3.Connection]:
+        """依次打开每个分片（scatter-gather 查询用），调用方负责关闭"""
+        for path in self.paths:
+            yield sqlite3.connect(path)
+
+    # ---------- 全局记录 ID ----------
+    def encode_id(self, local_id: int, index: int) -> int:
+        return local_id * self.count + index
+
+    def decode_id(self, global_id: int) -> Tuple[int, int]:
+        """全局 ID → (分片序号, 分片内 ID)"""
+        return global_id % self.count, global_id // self.count
+
+
+# ===============================
+# 离线重分片
+# ===============================
+def _copy_schema(source: sqlite3.Connection, target: sqlite3.Connection):
+    rows = source.execute(
+        "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END"
+    ).fetchall()
+    for (sql,) in rows:
+        target.execute(sql.replace("CREATE TABLE ", "CREATE TABLE IF NOT EXISTS ", 1)
+                       .replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1)
+                       .replace("CREATE UNIQUE INDEX ", "CREATE UNIQUE INDEX IF NOT EXISTS ", 1))
+
+
+def reshard(base_path: str, new_count: int, batch_size: int = 5000) -> dict:
+    """
+    把 base_path 的全部分片重新分布到 new_count 个分片（服务需停止）
+
+    - 含 patient_id 列的表按新分片路由，REPLICATED_TABLES 复制到每个分片，其余表复制到 0 号分片
+    - 自增主键 id 重新分配（病历全局 ID 会变化）
+    - 旧文件保留为 *.pre-reshard 备份
+    - DERIVED_TABLES 不复制，打开数据库时重建
+    - 已有分片映射但未分片的原文件里仍有数据时，原文件也作为来源
+    """
+    shard_map = load_shard_map(base_path)
+    old = ShardSet(base_path, shard_map["shards"] if shard_map else 1)
+    sources = list(old.paths)
+    if base_path not in sources and has_rows(base_path):
+        sources.insert(0, base_path)
+    staging_dir = os.path.join(os.path.dirname(os.path.abspath(base_path)), ".reshard-staging")
+    os.makedirs(staging_dir, exist_ok=True)
+    staged_base = os.path.join(staging_dir, os.path.basename(base_path))
+    new_paths = [shard_path(staged_base, i, new_count) for i in range(new_count)]
+    for path in new_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    targets = [sqlite3.connect(path) for path in new_paths]
+    moved = {}
+    for old_path in sources:
+        if not os.path.exists(old_path):
+            continue
+        source = sqlite3.connect(old_path)
+        for target in targets:
+            _copy_schema(source, target)
+
+        tables = [r[0] for r in source.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        for table in tables:
+            if table in DERIVED_TABLES:
+                continue
+            info = source.execute(f"PRAGMA table_info({table})").fetchall()
+            # 自增 id 在新分片里重新分配
+            columns = [c[1] for c in info if not (c[1] == "id" and c[5] and c[2].upper() == "INTEGER")]
+            if "patient_id" in columns:
+                key = columns.index("patient_id")
+            else:
+                key = None
+            insert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            order = "ORDER BY id" if len(columns) < len(info) else ""
+            cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} {order}")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                by_shard = [[] for _ in range(new_count)]
+                for row in rows:
+                    if table in REPLICATED_TABLES:
+                        for shard_rows in by_shard:
+                            shard_rows.append(row)
+                        continue
+                    index = shard_index(row[key], new_count) if key is not None else 0
+                    by_shard[index].append(row)
+                for target, shard_rows in zip(targets, by_shard):
+                    if shard_rows:
+                        target.executemany(insert, shard_rows)
+                moved[table] = moved.get(table, 0) + len(rows)
+        source.close()
+
+    for target in targets:
+        target.commit()
+        target.close()
+
+    # 替换：旧文件改名备份，新文件移到原位置
+    for old_path in sources:
+        if os.path.exists(old_path):
+            os.replace(old_path, old_path + ".pre-reshard")
+    if os.path.exists(map_path(base_path)):
+        os.replace(map_path(base_path), map_path(base_path) + ".pre-reshard")
+    for i, path in enumerate(new_paths):
+        shutil.move(path, shard_path(base_path, i, new_count))
+    if new_count > 1:
+        write_shard_map(base_path, new_count)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return {"base_path": base_path, "from": old.count, "to": new_count, "rows": moved}
+
+
+def main(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="SQLite shard maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    show = sub.add_parser("show", help="print the shard map of each database")
+    show.add_argument("databases", nargs="+")
+
+    resh = sub.add_parser("reshard", help="redistribute rows across a new number of shards (offline)")
+    resh.add_argument("databases", nargs="+", help="base paths, e.g. patients.db medical_records.db")
+    resh.add_argument("--to", type=int, required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        for base_path in args.databases:
+            shard_map = load_shard_map(base_path)
+            count = shard_map["shards"] if shard_map else 1
+            paths = [shard_path(base_path, i, count) for i in range(count)]
+            sizes: List[int] = [os.path.getsize(p) if os.path.exists(p) else 0 for p in paths]
+            print(json.dumps({"base_path": base_path, "shards": count, "files": paths, "bytes": sizes}))
+    else:
+        if args.to < 1:
+            parser.error("--to must be >= 1")
+        for base_path in args.databases:
+            print(f"🔀 Resharding {base_path} → {args.to} shards ...")
+            print(json.dumps(reshard(base_path, args.to)))
+        print("✅ Done. Record IDs were reassigned; old files are kept as *.pre-reshard")
+
+
+if __name__ == "__main__":
+    main()
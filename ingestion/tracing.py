@@ -0,0 +1,258 @@
+# 请求级追踪模块（trace / span）
+#
+# 每个请求一个 Trace，通过 contextvars 在同一请求的调用链中传递，
+# 各处理阶段和数据库调用用 span() / @traced 记录嵌套耗时。
+# 没有活动 Trace 时 span() 直接返回，开销可以忽略。
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 客户端可通过该请求头传入 trace id，否则自动生成
+TRACE_HEADER = "X-Request-ID"
+
+# 可选：把每个 span 以 Trace Event Format（Chrome / Perfetto）逐行写入 JSONL 文件
+# 查看方式：jq -s . trace.jsonl > trace.json，然后在 ui.perfetto.dev 中打开
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+# 采样剖析时记录本请求正在哪些工作线程中执行（见 profiling.py）
+_thread_activity: contextvars.ContextVar = contextvars.ContextVar("thread_activity", default=None)
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "tid", "attrs", "children")
+
+    def __init__(self, name: str, attrs: Optional[Dict] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.tid = threading.get_ident()
+        self.attrs = attrs or {}
+        self.children: List["Span"] = []
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self, origin: float) -> Dict:
+        data = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration_ms, 2),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class Trace:
+    """一次请求的追踪上下文"""
+
+    def __init__(self, trace_id: str = None, name: str = "request"):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.end = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Span, parent: Optional[Span]):
+        with self._lock:
+            if parent is not None:
+                parent.children.append(span)
+            else:
+                self.spans.append(span)
+
+    @property
+    def total_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self) -> Dict:
+        """返回给 API 响应的 timings 块"""
+        with self._lock:
+            spans = [span.to_dict(self.start) for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(self.total_ms, 2),
+            "spans": spans,
+        }
+
+    def summary_line(self) -> str:
+        stages = ", ".join(f"{s.name}={s.duration_ms:.1f}ms" for s in self.spans)
+        return f"[trace {self.trace_id}] {self.name} {self.total_ms:.1f}ms | {stages}"
+
+    def iter_events(self):
+        """按 Trace Event Format 展开所有 span（complete events, ph=X）"""
+        pid = os.getpid()
+        origin_us = self.wall_start * 1_000_000
+
+        def walk(span: Span):
+            yield {
+                "name": span.name,
+                "cat": self.name,
+                "ph": "X",
+                "ts": round(origin_us + (span.start - self.start) * 1_000_000),
+                "dur": round(span.duration_ms * 1000),
+                "pid": pid,
+                "tid": span.tid,
+                "args": dict(span.attrs, trace_id=self.trace_id),
+            }
+            for child in span.children:
+                yield from walk(child)
+
+        yield {
+            "name": self.name,
+            "cat": "request",
+            "ph": "X",
+            "ts": round(origin_us),
+            "dur": round(self.total_ms * 1000),
+            "pid": pid,
+            "tid": threading.get_ident(),
+            "args": {"trace_id": self.trace_id},
+        }
+        for span in self.spans:
+            yield from walk(span)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+# ===============================
+# 线程活动登记（供采样剖析过滤调用栈）
+# ===============================
+class ThreadActivity:
+    """记录某个请求当前占用的工作线程（线程 id -> 嵌套进入次数）"""
+
+    def __init__(self):
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def enter(self) -> Optional[int]:
+        # 事件循环线程上的 span 包着 await，期间跑的是别的协程，不计入
+        try:
+            asyncio.get_running_loop()
+            return None
+        except RuntimeError:
+            pass
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = self._active.get(ident, 0) + 1
+        return ident
+
+    def exit(self, ident: Optional[int]):
+        if ident is None:
+            return
+        with self._lock:
+            remaining = self._active.get(ident, 0) - 1
+            if remaining > 0:
+                self._active[ident] = remaining
+            else:
+                self._active.pop(ident, None)
+
+    def threads(self) -> Set[int]:
+        with self._lock:
+            return set(self._active)
+
+
+@contextmanager
+def track_threads():
+    """在当前上下文中登记请求占用的线程；线程池 / 执行器会继承该上下文"""
+    activity = ThreadActivity()
+    token = _thread_activity.set(activity)
+    try:
+        yield activity
+    finally:
+        _thread_activity.reset(token)
+
+
+@contextmanager
+def thread_active():
+    activity = _thread_activity.get()
+    if activity is None:
+        yield
+        return
+    ident = activity.enter()
+    try:
+        yield
+    finally:
+        activity.exit(ident)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """记录一个嵌套 span；没有活动 trace 时为空操作"""
+    trace = _current_trace.get()
+    if trace is None:
+        with thread_active():
+            yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(name, attrs)
+    trace.add_span(current, parent)
+    token = _current_span.set(current)
+    try:
+        with thread_active():
+            yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """装饰器版本的 span()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace_request(name: str, trace_id: str = None):
+    """为一个请求开启 trace，结束时写日志（以及可选的 JSONL 文件）"""
+    trace = Trace(trace_id, name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with thread_active():
+            yield trace
+    finally:
+        trace.end = time.perf_counter()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        logger.info(trace.summary_line())
+        if TRACE_FILE:
+            _dump(trace)
+
+
+def _dump(trace: Trace):
+    try:
+        lines = "".join(json.dumps(event) + "\n" for event in trace.iter_events())
+        with _file_lock:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(lines)
+    except Exception as e:
+        logger.warning(f"Failed to write trace file: {e}")
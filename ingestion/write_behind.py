@@ -0,0 +1,301 @@
+# 写后缓冲（write-behind）：请求路径上只追加一条本地日志，数据库写入由后台批量完成
+#
+# 原来 process_conversation 在返回前要逐条提交医疗记录、再提交对话记录，每次提交都是
+# SQLite 日志 + 数据库文件的若干次 fsync。开启后（WRITE_BEHIND_DIR）：
+#
+#   submit_*  把操作（带 op_id）追加到本进程的日志段 <pid>-<seq>.log 并 fsync，
+#             同时放入内存中的待落库队列，立即返回
+#   刷写线程  每 WRITE_BEHIND_FLUSH_MS 毫秒（或积压 WRITE_BEHIND_BATCH 条时）轮换日志段，
+#             把积压的操作交给 MedicalRecordsDatabase.apply_write_ops（每个分片一个事务），
+#             成功后删除已落库的日志段；失败时保留日志段，操作留在队列里下次重试
+#   读己之写  pending_records 返回同一患者尚未落库的记录，retrieve_medical_context 合并到结果中；
+#             刷写顺序是 提交 → 使缓存失效 → 移出待落库队列，读取时先取待落库快照再读库，不会漏读
+#   崩溃恢复  启动时重放所有已退出进程（<pid>.lock 上的 flock 已释放）留下的日志段，
+#             以及找不到活着的锁文件的孤立日志段；op_id 记录在 write_ops 表中，已落库的操作不会重复写入
+#   锁文件    先在 <pid>.lock.tmp 上加 flock，再 rename 成 <pid>.lock：其他进程看到的锁文件
+#             一定已经被持有，不会在 open 和 flock 之间被当成已退出进程的锁重放并删除
+#
+# 待落库的记录只在本进程可见：多 worker 部署时，其他 worker 最多晚一个刷写周期看到
+# （与 /ingest 会话一样，需要按患者做粘性路由才能保证读己之写）。
+# 近似重复检测在落库时进行，待落库期间只按 (类型, 内容) 去掉完全相同的记录。
+#
+#   WRITE_BEHIND_DIR       日志目录，留空关闭（默认关闭，同步写库）
+#   WRITE_BEHIND_FLUSH_MS  刷写间隔
+#   WRITE_BEHIND_BATCH     积压多少条操作时立即刷写
+#   WRITE_BEHIND_FSYNC     0 时追加日志不 fsync（进程崩溃不丢，断电可能丢最后几条）
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", "")
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1").lower() in ("1", "true", "yes")
+
+
+def _read_segment(path: str) -> List[Dict]:
+    ops = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                # 崩溃时写了一半的最后一行：调用方尚未得到返回，可以丢弃
+                logger.warning(f"Ignoring torn write-behind log entry in {path}")
+    return ops
+
+
+class WriteBehindQueue:
+    """本地追加日志 + 后台批量落库"""
+
+    def __init__(
+        self,
+        medical_db,
+        directory: str = WRITE_BEHIND_DIR,
+        on_flushed: Callable[[Iterable[str]], None] = None,
+        flush_ms: float = WRITE_BEHIND_FLUSH_MS,
+        batch_size: int = WRITE_BEHIND_BATCH,
+        fsync: bool = WRITE_BEHIND_FSYNC,
+    ):
+        self.medical_db = medical_db
+        self.directory = directory
+        self.on_flushed = on_flushed
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.fsync = fsync
+
+        self._lock = threading.Lock()           # 保护日志追加、待落库队列和 overlay
+        self._flush_lock = threading.Lock()     # 同一时间只有一次刷写
+        self._wake = threading.Event()
+        self._pending: List[Dict] = []
+        self._overlay: Dict[str, List[Dict]] = {}   # patient_id -> 待落库的 records 操作
+        self._sealed: List[str] = []                # 已轮换、等待落库后删除的日志段
+        self._closed = False
+        self._stats = {"submitted": 0, "flushed": 0, "flushes": 0, "failures": 0, "replayed": 0,
+                       "last_flush_seconds": None, "last_error": None}
+
+        os.makedirs(directory, exist_ok=True)
+        pid = os.getpid()
+        self._prefix = os.path.join(directory, str(pid))
+        self._owner = self._acquire_owner_lock()
+        self.replay()
+
+        self._seq = 0
+        self._log = self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _acquire_owner_lock(self):
+        """原子地创建本进程的 <pid>.lock：先加锁再让它可见"""
+        lock_path = self._prefix + ".lock"
+        tmp_path = lock_path + ".tmp"
+        handle = open(tmp_path, "w")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        os.replace(tmp_path, lock_path)
+        return handle
+
+    # ---------- 请求路径 ----------
+
+    def submit_records(self, patient_id: str, records: List[Dict]) -> Optional[str]:
+        """records: [{'type', 'content', 'metadata'}]（同 MedicalRecordsDatabase.add_records）"""
+        if not records:
+            return None
+        return self._submit({"kind": "records", "patient_id": patient_id, "records": records})
+
+    def submit_conversation(self, patient_id: str, transcript: str, summary: str = None) -> str:
+        return self._submit({"kind": "conversation", "patient_id": patient_id,
+                             "transcript": transcript, "summary": summary})
+
+    def _submit(self, op: Dict) -> str:
+        op["op_id"] = uuid.uuid4().hex
+        # 与 SQLite CURRENT_TIMESTAMP 相同的格式（UTC）
+        op["submitted_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        line = (json.dumps(op) + "\n").encode("utf-8")
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._log.write(line)
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            self._pending.append(op)
+            if op["kind"] == "records":
+                self._overlay.setdefault(op["patient_id"], []).append(op)
+            self._stats["submitted"] += 1
+            backlog = len(self._pending)
+        if backlog >= self.batch_size:
+            self._wake.set()
+        return op["op_id"]
+
+    def pending_records(self, patient_id: str) -> List[Dict]:
+        """该患者尚未落库的记录（格式同 get_patient_records，id 为 None，新的在前）"""
+        with self._lock:
+            ops = list(self._overlay.get(patient_id, ()))
+        records, seen = [], set()
+        for op in reversed(ops):
+            for record in op["records"]:
+                key = (record["type"], record["content"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                records.append({
+                    "id": None,
+                    "type": record["type"],
+                    "content": record["content"],
+                    "date": op["submitted_at"],
+                    "metadata": record.get("metadata") or {},
+                    "pending": True,
+                })
+        return records
+
+    # ---------- 刷写 ----------
+
+    def _open_segment(self):
+        return open(f"{self._prefix}-{self._seq:06d}.log", "ab")
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    def flush(self) -> int:
+        """把当前积压的操作落库，返回落库的操作数"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, []
+                # 轮换日志段：之后的追加写入新段，本批对应的段落库后删除
+                self._log.close()
+                self._sealed.append(self._log.name)
+                self._seq += 1
+                self._log = self._open_segment()
+                sealed = list(self._sealed)
+
+            t0 = time.perf_counter()
+            try:
+                self.medical_db.apply_write_ops(batch)
+            except Exception as e:
+                with self._lock:
+                    self._pending = batch + self._pending
+                    self._stats["failures"] += 1
+                    self._stats["last_error"] = str(e)
+                raise
+
+            patients = {op["patient_id"] for op in batch}
+            if self.on_flushed:
+                self.on_flushed(patients)
+            with self._lock:
+                flushed = {id(op) for op in batch}
+                for patient_id in patients:
+                    remaining = [op for op in self._overlay.get(patient_id, ()) if id(op) not in flushed]
+                    if remaining:
+                        self._overlay[patient_id] = remaining
+                    else:
+                        self._overlay.pop(patient_id, None)
+                self._sealed = [path for path in self._sealed if path not in sealed]
+                self._stats["flushed"] += len(batch)
+                self._stats["flushes"] += 1
+                self._stats["last_flush_seconds"] = round(time.perf_counter() - t0, 4)
+            for path in sealed:
+                os.remove(path)
+            return len(batch)
+
+    def replay(self) -> int:
+        """重放已退出进程（以及本进程 pid 复用前）留下的日志段"""
+        # 同时启动的进程依次重放，不会读到对方正在删除的日志段
+        with open(os.path.join(self.directory, ".replay"), "a") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            return self._replay()
+
+    def _replay(self) -> int:
+        own_path = self._prefix + ".lock"
+        owners, live = [], set()
+        for lock_path in glob.glob(os.path.join(self.directory, "*.lock")):
+            prefix = lock_path[:-len(".lock")]
+            if lock_path == own_path:
+                owners.append((lock_path, None))
+                continue
+            handle = open(lock_path, "a")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # 进程仍在运行（或另一个进程正在重放）
+                handle.close()
+                live.add(prefix)
+                continue
+            # 拿到锁之后文件可能已被重放它的进程删除，或被重启的同 pid 进程替换（旧 inode）
+            try:
+                current = os.stat(lock_path).st_ino == os.fstat(handle.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            if not current:
+                handle.close()
+                live.add(prefix)
+                continue
+            owners.append((lock_path, handle))
+
+        prefixes = {lock_path[:-len(".lock")] for lock_path, _ in owners}
+        # 孤立日志段：进程的锁文件已经不在了（例如被删除），又没有活着的进程持有它
+        for path in glob.glob(os.path.join(self.directory, "*-*.log")):
+            prefix = path[:path.rindex("-")]
+            if prefix not in prefixes and prefix not in live and not os.path.exists(prefix + ".lock"):
+                prefixes.add(prefix)
+
+        segments = []
+        for prefix in sorted(prefixes):
+            segments.extend(sorted(glob.glob(prefix + "-*.log")))
+        ops = [op for path in segments for op in _read_segment(path)]
+        for start in range(0, len(ops), self.batch_size):
+            self.medical_db.apply_write_ops(ops[start:start + self.batch_size])
+        if ops:
+            logger.info(f"Replayed {len(ops)} write-behind operations from {len(segments)} log segments")
+            if self.on_flushed:
+                self.on_flushed({op["patient_id"] for op in ops})
+
+        for path in segments:
+            os.remove(path)
+        for lock_path, handle in owners:
+            if handle is not None:
+                os.remove(lock_path)
+                handle.close()
+        self._stats["replayed"] += len(ops)
+        return len(ops)
+
+    def close(self):
+        """停止刷写线程并落库剩余操作（进程退出时自动调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            # 日志段保留，下次启动时重放
+            logger.error(f"Final write-behind flush failed, will replay on next start: {e}")
+            return
+        with self._lock:
+            self._log.close()
+            os.remove(self._log.name)
+        os.remove(self._prefix + ".lock")
+        self._owner.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending), pending_patients=len(self._overlay))